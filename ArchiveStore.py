@@ -0,0 +1,140 @@
+#!/usr/bin/python
+
+import os
+import gzip
+import thread
+import shutil
+import hashlib
+from time import time, strftime, localtime
+
+CHUNK_SIZE     = 64 * 1024  # in bytes, read from files being stored at a time
+COMPRESS_LEVEL = 6
+
+class ArchiveStore:
+    """Compressed, content-addressed storage for old paging lists and their output.
+
+    Content is gzipped once into objects/<sha1[:2]>/<sha1>.gz, sha1 being the
+    uncompressed content's.  A stored file is a hard link to its object named
+    days/<YYYY-MM-DD>/<filename>.gz, so identical files share one object and an
+    object goes away with its last link.  Days are expired as a whole.
+
+    put() and expire() aren't safe to run at the same time, expire() could
+    remove an object put() is about to link.
+    """
+
+    def __init__(self, root):
+        self.__objects_dir = os.path.join(root, "objects")
+        self.__days_dir = os.path.join(root, "days")
+        self.__tmp_dir = os.path.join(root, "tmp")
+
+        for dir in (self.__objects_dir, self.__days_dir, self.__tmp_dir):
+            try:
+                os.makedirs(dir)
+            except OSError:
+                pass
+
+
+    def put(self, filename, day=None):
+        """Moves filename into the store, returns its path there.
+
+        day ("YYYY-MM-DD") defaults to the date filename was last modified.
+        """
+
+        if not day:
+            day = strftime("%Y-%m-%d", localtime(os.stat(filename).st_mtime))
+
+        tmp_filename = os.path.join(self.__tmp_dir, "%d.%d.tmp" % (os.getpid(), thread.get_ident()))
+
+        # compress and hash in one pass
+        sha1 = hashlib.sha1()
+        src = open(filename, "rb")
+        try:
+            tmp_file = open(tmp_filename, "wb")
+            try:
+                # no name or time in the gzip header, objects are shared between names
+                out = gzip.GzipFile("", "wb", COMPRESS_LEVEL, tmp_file, 0)
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), ""):
+                    sha1.update(chunk)
+                    out.write(chunk)
+                out.close()
+
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            finally:
+                tmp_file.close()
+        finally:
+            src.close()
+
+        digest = sha1.hexdigest()
+        object_filename = os.path.join(self.__objects_dir, digest[:2], "%s.gz" % (digest))
+
+        if os.path.exists(object_filename):
+            # seen before, keep the existing object
+            os.remove(tmp_filename)
+        else:
+            try:
+                os.mkdir(os.path.dirname(object_filename))
+            except OSError:
+                pass
+            os.rename(tmp_filename, object_filename)
+
+        stored_filename = os.path.join(self.__days_dir, day, "%s.gz" % (os.path.basename(filename)))
+
+        try:
+            os.mkdir(os.path.dirname(stored_filename))
+        except OSError:
+            pass
+
+        if not (os.path.exists(stored_filename) and os.path.samefile(stored_filename, object_filename)):
+            os.link(object_filename, tmp_filename)
+            os.rename(tmp_filename, stored_filename)
+
+        os.remove(filename)
+
+        return stored_filename
+
+
+    def expire(self, max_age, now=None):
+        """Removes days older than max_age seconds and objects nothing links to, returns the days removed."""
+
+        oldest = strftime("%Y-%m-%d", localtime((now or time()) - max_age))
+
+        expired = sorted([day for day in os.listdir(self.__days_dir) if day < oldest])
+        for day in expired:
+            shutil.rmtree(os.path.join(self.__days_dir, day))
+
+        if expired:
+            self.collect()
+
+        return expired
+
+
+    def collect(self):
+        """Removes objects nothing links to, returns the bytes freed."""
+
+        freed = 0
+
+        for prefix in os.listdir(self.__objects_dir):
+            dir = os.path.join(self.__objects_dir, prefix)
+            for name in os.listdir(dir):
+                st = os.stat(os.path.join(dir, name))
+                if st.st_nlink == 1:
+                    os.remove(os.path.join(dir, name))
+                    freed += st.st_size
+
+        return freed
+
+
+    def usage(self):
+        """Returns (objects, bytes) in the store."""
+
+        objects = 0
+        size = 0
+
+        for prefix in os.listdir(self.__objects_dir):
+            dir = os.path.join(self.__objects_dir, prefix)
+            for name in os.listdir(dir):
+                objects += 1
+                size += os.stat(os.path.join(dir, name)).st_size
+
+        return (objects, size)
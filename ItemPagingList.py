@@ -0,0 +1,109 @@
+#!/usr/bin/python
+
+import re
+from itertools import izip
+
+# Item Paging List labels, in the order they appear in each item
+FIELDS = [("AUTHOR",    "author"),
+          ("TITLE",     "title"),
+          ("IMPRINT",   "imprint"),
+          ("PUB DATE",  "pub_date"),
+          ("DESC",      "description"),
+          ("CALL NO",   "call_number"),
+          ("VOLUME",    "volume"),
+          ("BARCODE",   "barcode"),
+          ("STATUS",    "status"),
+          ("REC NO",    "record_number"),
+          ("LOCATION",  "location"),
+          ("PICKUP AT", "pickup_location"),
+          ("OPACMSG",   "opac_message")]
+
+FIELD_KEYS = dict(FIELDS)
+KEYS       = [key for label, key in FIELDS]
+
+FIRST_KEY = KEYS[0]
+LAST_KEY  = KEYS[-1]
+
+EMPTY_ITEM = dict([(key, "") for key in KEYS])
+
+ITEM_HEADER = "Please pull this item and check it in to place in transit:"
+
+# one well-formed item: optional header, then every label once, one line each,
+# then any blank lines up to the next item
+ITEM_REGEX = re.compile(r"[ \t]*(?:%s[ \t\r]*\n\s*)?" % (re.escape(ITEM_HEADER)) +
+                        r"\n[ \t]*".join([r"%s:[ \t]*([^\n]*)" % (re.escape(label)) for label, key in FIELDS]) +
+                        r"(?:\n|\Z)(?:[ \t\r]*\n)*")
+
+
+def iter_items(buf):
+    """Yields one dict per item in an Item Paging List, keyed by FIELDS.
+
+    buf is the whole list as a string or an mmap, it is scanned once without
+    being split into lines.  Well-formed items are matched whole by ITEM_REGEX;
+    anything else falls back to a line at a time: an item starts at ITEM_HEADER
+    or an AUTHOR label and ends at OPACMSG, unlabeled lines inside an item
+    continue the previous field, and lines outside an item (page headers etc.)
+    are skipped.
+    """
+
+    match = ITEM_REGEX.match
+    find = buf.find
+    strip = str.strip
+    field_keys = FIELD_KEYS
+
+    pos = 0
+    end = len(buf)
+
+    item = None
+    key = None
+
+    while pos < end:
+        if item is None:
+            m = match(buf, pos)
+            if m:
+                yield dict(izip(KEYS, map(strip, m.groups())))
+                pos = m.end()
+                continue
+
+        line_end = find("\n", pos)
+        if line_end < 0:
+            line_end = end
+
+        raw_line = buf[pos:line_end]
+        pos = line_end + 1
+
+        label, colon, value = raw_line.partition(":")
+        field_key = colon and field_keys.get(label.strip())
+
+        if field_key:
+            # AUTHOR starts an item unless it follows ITEM_HEADER
+            if field_key == FIRST_KEY and key is not None:
+                if item is not None:
+                    yield item
+                item = None
+
+            if item is None:
+                item = dict(EMPTY_ITEM)
+
+            key = field_key
+            item[key] = value.strip()
+
+            if key == LAST_KEY:
+                yield item
+                item = None
+                key = None
+
+        elif raw_line.lstrip().startswith(ITEM_HEADER):
+            if item is not None and key is not None:
+                yield item
+            item = dict(EMPTY_ITEM)
+            key = None
+
+        elif item is not None and key is not None:
+            # wrapped value
+            value = raw_line.strip()
+            if value:
+                item[key] = ("%s %s" % (item[key], value)).lstrip()
+
+    if item is not None and key is not None:
+        yield item
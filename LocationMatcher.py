@@ -0,0 +1,109 @@
+#!/usr/bin/python
+
+import re
+
+# fallback branch selector when no multi-word location matches (was r"\w+")
+WORD_REGEX = re.compile(r"\w+")
+
+# trailing bib number, e.g. ".b1234567x" (separator and check digit included)
+BIB_REGEX  = re.compile(r"[\s\.]b\d+.$")
+
+# trie key marking the end of a phrase
+TERMINAL = None
+
+class LocationMatcher:
+    """Matches LOCATION [SUBLOCATION] [SUFFIX] at the start of a BLOCK_LINE_1.
+
+    Locations, sublocations and suffixes are stored in word tries, so a line
+    is matched in a single pass over its leading words instead of trying every
+    prefix x sublocation x suffix alternative of a regex.
+    """
+
+    def __init__(self, locations, sublocations, suffixes):
+        # single word locations are covered by WORD_REGEX
+        self.__locations    = self.__build_trie([loc for loc in locations if loc.find(" ") != -1])
+        self.__sublocations = self.__build_trie(sublocations)
+        self.__suffixes     = self.__build_trie(suffixes)
+
+
+    def __build_trie(self, phrases):
+        """Builds word trie from list of phrases."""
+
+        trie = {}
+
+        for phrase in phrases:
+            if not phrase:
+                continue
+
+            node = trie
+            for word in phrase.split(" "):
+                node = node.setdefault(word, {})
+            node[TERMINAL] = True
+
+        return trie
+
+
+    def __walk(self, trie, words, start):
+        """Returns word indexes at which a phrase from trie starting at words[start] ends."""
+
+        ends = []
+        node = trie
+
+        for i in xrange(start, len(words)):
+            node = node.get(words[i])
+            if node is None:
+                break
+            if TERMINAL in node:
+                ends.append(i + 1)
+
+        return ends
+
+
+    def match_location(self, line):
+        """Returns (location, remainder) for the longest location at the start of line, or None."""
+
+        words = line.split(" ")
+
+        prefixes = self.__walk(self.__locations, words, 0)
+
+        m = WORD_REGEX.match(line)
+        if m:
+            if m.end() == len(words[0]):
+                prefixes.append(1)
+            elif not prefixes:
+                # word characters run into punctuation, nothing else can follow
+                return (m.group(), line[m.end():])
+
+        if not prefixes:
+            return None
+
+        end = 0
+        for prefix in prefixes:
+            end = max(end, prefix)
+
+            for subloc in [prefix] + self.__walk(self.__sublocations, words, prefix):
+                end = max(end, subloc)
+
+                for suffix in self.__walk(self.__suffixes, words, subloc):
+                    end = max(end, suffix)
+
+        location = " ".join(words[:end])
+
+        return (location, line[len(location):])
+
+
+    def match(self, line):
+        """Returns (location, call_number, bib_number) parsed from BLOCK_LINE_1, or None."""
+
+        m = self.match_location(line)
+        if not m:
+            return None
+
+        location, remainder = m
+
+        b = BIB_REGEX.search(remainder)
+        if not b:
+            return None
+
+        # remove check digit and leading separator
+        return (location, remainder[:b.start()].strip(), b.group()[1:-1])
@@ -0,0 +1,338 @@
+#!/usr/bin/python
+
+import os
+import logging
+import socket
+import smtplib
+import threading
+import cPickle
+from time import time
+
+RETRY_DELAY     = 30    # in seconds, doubled after each failed attempt...
+RETRY_MAX_DELAY = 900   # ...up to this
+IDLE_TIMEOUT    = 60    # in seconds, how long the SMTP session is kept open waiting for more mail
+SMTP_TIMEOUT    = 60    # in seconds, socket timeout talking to the SMTP server
+
+SPOOL_EXT = ".msg"
+
+DATA_BUFFER_SIZE = 64 * 1024  # in bytes, message data sent per socket write
+
+CRLF = "\r\n"
+
+def is_transient(e):
+    """True if delivery that failed with e is worth retrying."""
+
+    if isinstance(e, (socket.error, smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+
+    # 4xx replies are temporary
+    if isinstance(e, smtplib.SMTPResponseException):
+        return e.smtp_code < 500
+
+    # every recipient refused, worth retrying unless one refusal was permanent
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return bool(e.recipients) and max([code for code, resp in e.recipients.values()]) < 500
+
+    return False
+
+
+class MailQueue:
+    """Delivers mail from a spool directory over one reused SMTP session.
+
+    send() writes the message to spool_dir and returns, a sender thread
+    delivers spooled messages in order, reconnecting with backoff when the
+    server goes away.  Messages are only removed from the spool once they're
+    accepted, so anything unsent is picked up again by the next MailQueue.
+    Messages the server refuses outright are moved to spool_dir/failed.
+    """
+
+    def __init__(self, spool_dir, server, port=25, logger=None, retry_delay=RETRY_DELAY, retry_max_delay=RETRY_MAX_DELAY, idle_timeout=IDLE_TIMEOUT):
+        self.__spool_dir = spool_dir
+        self.__failed_dir = os.path.join(spool_dir, "failed")
+        self.__server = server
+        self.__port = port
+        self.__logger = logger or logging.getLogger("MailQueue")
+        self.__retry_delay = retry_delay
+        self.__retry_max_delay = retry_max_delay
+        self.__idle_timeout = idle_timeout
+
+        self.__smtp = None
+        self.__seq = 0
+        self.__pending = []
+        self.__stopping = False
+        self.__cond = threading.Condition()
+
+        for dir in (self.__spool_dir, self.__failed_dir):
+            try:
+                os.makedirs(dir)
+            except OSError:
+                pass
+
+        # resend whatever the last run left behind
+        self.__pending = sorted([f for f in os.listdir(self.__spool_dir) if f.endswith(SPOOL_EXT)])
+        if self.__pending:
+            self.__logger.info("Resending %d spooled messages" % (len(self.__pending)))
+
+        self.__sender = threading.Thread(target=self.__send_loop)
+        self.__sender.setDaemon(True)
+        self.__sender.start()
+
+
+    def send(self, from_addr, to_addrs, msg, description=""):
+        """Spools msg (a string) for delivery to to_addrs."""
+
+        message = self.open_message(from_addr, to_addrs, description)
+        message.write(msg)
+        message.close()
+
+
+    def open_message(self, from_addr, to_addrs, description=""):
+        """Returns a SpooledMessage to write a message to, it's queued once closed."""
+
+        self.__cond.acquire()
+        try:
+            self.__seq += 1
+            filename = "%.6f.%d.%d%s" % (time(), os.getpid(), self.__seq, SPOOL_EXT)
+        finally:
+            self.__cond.release()
+
+        return SpooledMessage(self, os.path.join(self.__spool_dir, filename), (from_addr, to_addrs, None, description, time()))
+
+
+    def _queue(self, filename):
+        self.__cond.acquire()
+        try:
+            self.__pending.append(os.path.basename(filename))
+            self.__cond.notify()
+        finally:
+            self.__cond.release()
+
+
+    def queue_depth(self):
+        return len(self.__pending)
+
+
+    def shutdown(self):
+        """Delivers what's queued unless the server is unreachable, then stops the sender."""
+
+        self.__cond.acquire()
+        try:
+            self.__stopping = True
+            self.__cond.notify()
+        finally:
+            self.__cond.release()
+
+        self.__sender.join()
+
+
+    def __send_loop(self):
+        delay = self.__retry_delay
+
+        while 1:
+            self.__cond.acquire()
+            try:
+                if not self.__pending and not self.__stopping:
+                    # keep the session around for the rest of the morning wave
+                    self.__cond.wait(self.__smtp and self.__idle_timeout or None)
+
+                if not self.__pending:
+                    if self.__stopping:
+                        break
+                    self.__disconnect()
+                    continue
+
+                filename = self.__pending[0]
+            finally:
+                self.__cond.release()
+
+            try:
+                self.__deliver(filename)
+                delay = self.__retry_delay
+
+            except Exception, e:
+                self.__disconnect()
+
+                if not is_transient(e):
+                    # refused by the server, keep it out of the way
+                    self.__logger.info("Error: SMTP server refused %s, moved to %s: %s" % (filename, self.__failed_dir, e))
+                    try:
+                        os.rename(os.path.join(self.__spool_dir, filename), os.path.join(self.__failed_dir, filename))
+                    except OSError:
+                        pass
+
+                elif self.__stopping:
+                    self.__logger.info("Error: SMTP server unreachable, leaving %d messages spooled: %s" % (len(self.__pending), e))
+                    break
+
+                else:
+                    self.__logger.info("Error: SMTP delivery failed, retrying in %d seconds [queue depth: %d]: %s" % (delay, len(self.__pending), e))
+                    self.__wait(delay)
+                    delay = min(delay * 2, self.__retry_max_delay)
+                    continue
+
+            self.__cond.acquire()
+            try:
+                self.__pending.remove(filename)
+            finally:
+                self.__cond.release()
+
+        self.__disconnect()
+
+
+    def __deliver(self, filename):
+        path = os.path.join(self.__spool_dir, filename)
+
+        try:
+            f = open(path, "rb")
+        except IOError, e:
+            raise ValueError("unreadable spool file: %s" % (e))
+
+        try:
+            try:
+                from_addr, to_addrs, msg, description, queued_at = cPickle.load(f)
+            except (EOFError, cPickle.UnpicklingError), e:
+                raise ValueError("unreadable spool file: %s" % (e))
+
+            # the message follows the envelope, unless it's in it
+            offset = f.tell()
+
+            reused = self.__smtp is not None
+            if not reused:
+                self.__smtp = smtplib.SMTP(self.__server, self.__port, timeout=SMTP_TIMEOUT)
+
+            try:
+                refused = self.__sendmail(from_addr, to_addrs, msg, f)
+
+            except (socket.error, smtplib.SMTPServerDisconnected):
+                if not reused:
+                    raise
+
+                # server closed the idle session, try once more on a new one
+                self.__disconnect()
+                self.__smtp = smtplib.SMTP(self.__server, self.__port, timeout=SMTP_TIMEOUT)
+                f.seek(offset)
+                refused = self.__sendmail(from_addr, to_addrs, msg, f)
+
+        finally:
+            f.close()
+
+        for addr in refused:
+            self.__logger.info("Error: SMTP server refused %s for %s: %s" % (addr, description or filename, refused[addr]))
+
+        os.remove(path)
+
+        self.__logger.info("%s delivered to %s [latency: %.2fs, queue depth: %d]" % (description or filename, ", ".join(to_addrs), time() - queued_at, len(self.__pending) - 1))
+
+
+    def __sendmail(self, from_addr, to_addrs, msg, f):
+        """smtplib's sendmail(), except the message is streamed from f when msg is None."""
+
+        smtp = self.__smtp
+
+        if msg is not None:
+            return smtp.sendmail(from_addr, to_addrs, msg)
+
+        smtp.ehlo_or_helo_if_needed()
+
+        code, resp = smtp.mail(from_addr)
+        if code != 250:
+            smtp.rset()
+            raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+
+        refused = {}
+        for addr in to_addrs:
+            code, resp = smtp.rcpt(addr)
+            if code not in (250, 251):
+                refused[addr] = (code, resp)
+
+        if len(refused) == len(to_addrs):
+            smtp.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        smtp.putcmd("data")
+        code, resp = smtp.getreply()
+        if code != 354:
+            smtp.rset()
+            raise smtplib.SMTPDataError(code, resp)
+
+        # CRLF line endings and dot-stuffing, like smtplib.quotedata(), a buffer at a time
+        buf = []
+        size = 0
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line[:1] == ".":
+                line = "." + line
+            buf.append(line)
+            size += len(line)
+
+            if size >= DATA_BUFFER_SIZE:
+                buf.append("")
+                smtp.send(CRLF.join(buf))
+                buf = []
+                size = 0
+
+        buf.append(".")
+        buf.append("")
+        smtp.send(CRLF.join(buf))
+
+        code, resp = smtp.getreply()
+        if code != 250:
+            smtp.rset()
+            raise smtplib.SMTPDataError(code, resp)
+
+        return refused
+
+
+    def __wait(self, delay):
+        """Sleeps for delay seconds, only shutdown() cuts it short."""
+
+        deadline = time() + delay
+
+        self.__cond.acquire()
+        try:
+            while not self.__stopping and time() < deadline:
+                self.__cond.wait(deadline - time())
+        finally:
+            self.__cond.release()
+
+
+    def __disconnect(self):
+        if self.__smtp:
+            try:
+                self.__smtp.quit()
+            except (socket.error, smtplib.SMTPException):
+                pass
+            self.__smtp = None
+
+
+class SpooledMessage:
+    """A message being written to the spool, see MailQueue.open_message()."""
+
+    def __init__(self, queue, filename, envelope):
+        self.__queue = queue
+        self.__filename = filename
+
+        # write then rename, so a crash never leaves half a message in the spool
+        self.__tmp_filename = os.path.join(os.path.dirname(filename), ".%s.tmp" % (os.path.basename(filename)))
+        self.__file = open(self.__tmp_filename, "wb")
+        cPickle.dump(envelope, self.__file, 2)
+
+        self.write = self.__file.write
+
+
+    def close(self):
+        """Moves the message into the spool and queues it."""
+
+        try:
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+        finally:
+            self.__file.close()
+
+        os.rename(self.__tmp_filename, self.__filename)
+        self.__queue._queue(self.__filename)
+
+
+    def discard(self):
+        self.__file.close()
+        os.remove(self.__tmp_filename)
@@ -0,0 +1,151 @@
+#!/usr/bin/python
+
+import os
+import sys
+import zlib
+import random
+import base64
+from email.header import Header
+from email.MIMEText import MIMEText
+
+CHUNK_SIZE = 57 * 1024  # in bytes, read from attachments at a time (57 bytes per base64 line)
+
+def make_boundary():
+    return "===============%d==" % (random.randrange(sys.maxint))
+
+
+def write_headers(out, headers):
+    for name, value in headers:
+        out.write("%s: %s\n" % (name, Header(value, header_name=name).encode()))
+
+
+def iter_gzip(f):
+    """Yields f's data gzip compressed, a chunk at a time."""
+
+    # wbits 16 + MAX_WBITS writes a gzip header and trailer
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    while 1:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
+class MultipartWriter:
+    """Writes a multipart MIME message to out a part at a time.
+
+    Attachments are read and encoded in CHUNK_SIZE pieces, so a message never
+    has to fit in memory.  The output matches what email.generator produces
+    for the equivalent email.MIMEMultipart message.
+    """
+
+    def __init__(self, out, subtype="mixed", headers=()):
+        self.__out = out
+        self.__boundary = make_boundary()
+        self.__parts = 0
+
+        write_headers(out, [("Content-Type", 'multipart/%s; boundary="%s"' % (subtype, self.__boundary)),
+                            ("MIME-Version", "1.0")] + list(headers))
+        out.write("\n")
+
+
+    def __start_part(self, headers):
+        if self.__parts:
+            self.__out.write("\n")
+        self.__out.write("--%s\n" % (self.__boundary))
+        self.__parts += 1
+
+        write_headers(self.__out, headers)
+        self.__out.write("\n")
+
+
+    def attach_text(self, text, subtype="plain"):
+        """Attaches a small text part, as email.MIMEText would."""
+
+        part = MIMEText(text, subtype)
+        self.__start_part(part.items())
+        self.__out.write(part.get_payload())
+
+
+    def attach_file(self, filename, maintype, subtype, attachment_filename=None, encoding="base64", gzip=False):
+        """Attaches filename as is (encoding "7or8bit") or base64 encoded, gzipped first if gzip."""
+
+        if not attachment_filename:
+            attachment_filename = os.path.basename(filename)
+
+        # open before writing anything, a missing file leaves the message intact
+        f = open(filename, "rb")
+
+        try:
+            if gzip:
+                maintype, subtype = "application", "x-gzip"
+                attachment_filename = "%s.gz" % (attachment_filename)
+                encoding = "base64"
+
+            if encoding == "base64":
+                transfer_encoding = "base64"
+            else:
+                transfer_encoding = "7bit"
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), ""):
+                    try:
+                        chunk.decode("ascii")
+                    except UnicodeError:
+                        transfer_encoding = "8bit"
+                        break
+                f.seek(0)
+
+            self.__start_part([("Content-Type", "%s/%s" % (maintype, subtype)),
+                               ("MIME-Version", "1.0"),
+                               ("Content-Transfer-Encoding", transfer_encoding),
+                               ("Content-Disposition", 'attachment; filename="%s"' % (attachment_filename))])
+
+            if gzip:
+                chunks = iter_gzip(f)
+            else:
+                chunks = iter(lambda: f.read(CHUNK_SIZE), "")
+
+            if transfer_encoding == "base64":
+                self.__write_base64(chunks)
+            else:
+                for chunk in chunks:
+                    self.__out.write(chunk)
+
+        finally:
+            f.close()
+
+
+    def __write_base64(self, chunks):
+        # encode whole base64 lines, carry the rest over to the next chunk
+        rest = ""
+        last = ""
+        encoded = ""
+        for chunk in chunks:
+            if not chunk:
+                continue
+            data = rest + chunk
+            whole = len(data) - len(data) % 57
+            self.__out.write(encoded)
+            encoded = base64.encodestring(data[:whole])
+            rest = data[whole:]
+            last = chunk[-1]
+
+        if rest:
+            self.__out.write(encoded)
+            encoded = base64.encodestring(rest)
+
+        # like email.encoders, the last newline is only kept if the data ended with one
+        if last != "\n":
+            encoded = encoded[:-1]
+
+        self.__out.write(encoded)
+
+
+    def close(self):
+        """Ends the message, out is left open."""
+
+        self.__out.write("\n--%s--\n" % (self.__boundary))
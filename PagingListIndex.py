@@ -0,0 +1,228 @@
+#!/usr/bin/python
+
+import os
+import urllib
+import sqlite3
+from cgi import escape
+from time import time, strftime, localtime
+
+INDEX_RUNS = 30  # runs listed in index.html, older runs stay in the manifest
+DB_TIMEOUT = 30  # in seconds, how long to wait on other writers
+
+# manifest columns for a run's files, in index.html order
+FILE_COLUMNS = ("title_html", "title_csv", "title_raw", "item_html", "item_csv", "item_raw")
+
+FILE_LABELS = {"title_html" : "html", "title_csv" : "csv", "title_raw" : "raw",
+               "item_html"  : "html", "item_csv"  : "csv", "item_raw"  : "raw"}
+
+COLUMNS = ("timestamp",) + FILE_COLUMNS + ("title_count", "item_count", "created_at", "updated_at", "linked")
+
+def link_name(column, target):
+    """Name of target's link in the branch's web directory."""
+
+    name = os.path.basename(target)
+
+    # compressed files (see ArchiveStore) keep .gz last, for the web server's Content-Encoding
+    suffix = ""
+    if name.endswith(".gz"):
+        name, suffix = name[:-3], ".gz"
+
+    # raw lists are served as text
+    if column.endswith("_raw"):
+        name = "%s.txt" % (name)
+
+    return name + suffix
+
+
+class PagingListIndex:
+    """A branch's manifest of published paging lists and the index.html built from it.
+
+    The manifest is an SQLite database with a row per run (timestamp).  update()
+    changes one run, links its files into web_dir, unlinks the files of the run
+    that just dropped out of the last keep, and rewrites index.html from the last
+    keep rows, so the cost of a run doesn't grow with the archive.
+    """
+
+    def __init__(self, db_filename, web_dir, title, keep=INDEX_RUNS):
+        self.__web_dir = web_dir
+        self.__title = title
+        self.__keep = keep
+
+        self.__db = sqlite3.connect(db_filename, timeout=DB_TIMEOUT, isolation_level=None)
+        self.__db.text_factory = str
+
+        self.__db.execute("CREATE TABLE IF NOT EXISTS runs (timestamp TEXT PRIMARY KEY, %s, title_count INTEGER, item_count INTEGER, created_at REAL, updated_at REAL, linked INTEGER DEFAULT 1)"
+                          % (", ".join(["%s TEXT" % (column) for column in FILE_COLUMNS])))
+
+
+    def close(self):
+        self.__db.close()
+
+
+    def update(self, timestamp, **fields):
+        """Sets fields (FILE_COLUMNS as paths, title_count, item_count) for the run at timestamp."""
+
+        now = time()
+
+        # one writer at a time, index.html always matches the manifest
+        self.__db.execute("BEGIN IMMEDIATE")
+
+        try:
+            row = self.__run(timestamp)
+            if row is None:
+                row = {"timestamp" : timestamp, "created_at" : now}
+
+            for column in fields:
+                if column not in FILE_COLUMNS + ("title_count", "item_count"):
+                    raise ValueError("unknown column: %s" % (column))
+
+            # replaced files lose their links
+            for column in FILE_COLUMNS:
+                if column in fields and row.get(column) and row[column] != fields[column]:
+                    self.__unlink(column, row[column])
+
+            row.update(fields)
+            row["updated_at"] = now
+            row["linked"] = 1
+
+            self.__db.execute("INSERT OR REPLACE INTO runs (%s) VALUES (%s)" % (", ".join(COLUMNS), ", ".join("?" * len(COLUMNS))),
+                              [row.get(column) for column in COLUMNS])
+
+            for column in FILE_COLUMNS:
+                if row.get(column):
+                    self.__link(column, row[column])
+
+            # runs that fell out of the last keep
+            for expired in self.__rows("SELECT * FROM runs WHERE linked = 1 ORDER BY timestamp DESC LIMIT -1 OFFSET ?", (self.__keep,)):
+                for column in FILE_COLUMNS:
+                    if expired[column]:
+                        self.__unlink(column, expired[column])
+                self.__db.execute("UPDATE runs SET linked = 0 WHERE timestamp = ?", (expired["timestamp"],))
+
+            self.__write_html(self.runs(self.__keep))
+
+            self.__db.execute("COMMIT")
+
+        except:
+            self.__db.execute("ROLLBACK")
+            raise
+
+
+    def relocate(self, moves):
+        """Points runs at files that moved, moves is {old path : new path}."""
+
+        self.__db.execute("BEGIN IMMEDIATE")
+
+        try:
+            changed = False
+
+            for row in self.runs():
+                for column in FILE_COLUMNS:
+                    if row[column] not in moves:
+                        continue
+
+                    if row["linked"]:
+                        self.__unlink(column, row[column])
+                        self.__link(column, moves[row[column]])
+
+                    self.__db.execute("UPDATE runs SET %s = ? WHERE timestamp = ?" % (column), (moves[row[column]], row["timestamp"]))
+                    changed = True
+
+            if changed:
+                self.__write_html(self.runs(self.__keep))
+
+            self.__db.execute("COMMIT")
+
+        except:
+            self.__db.execute("ROLLBACK")
+            raise
+
+
+    def runs(self, limit=None):
+        """Returns the latest limit runs (all without a limit) as dicts, newest first."""
+
+        return self.__rows("SELECT * FROM runs ORDER BY timestamp DESC LIMIT ?", (limit or -1,))
+
+
+    def __run(self, timestamp):
+        rows = self.__rows("SELECT * FROM runs WHERE timestamp = ?", (timestamp,))
+        return rows and rows[0] or None
+
+
+    def __rows(self, sql, args=()):
+        cursor = self.__db.execute(sql, args)
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+
+    def __link(self, column, target):
+        link = os.path.join(self.__web_dir, link_name(column, target))
+
+        if os.path.islink(link) and os.readlink(link) == target:
+            return
+
+        tmp_link = "%s.tmp" % (link)
+        try:
+            os.remove(tmp_link)
+        except OSError:
+            pass
+
+        os.symlink(target, tmp_link)
+        os.rename(tmp_link, link)
+
+
+    def __unlink(self, column, target):
+        link = os.path.join(self.__web_dir, link_name(column, target))
+
+        # only links this index made, latest_* and friends are left alone
+        if os.path.islink(link) and os.readlink(link) == target:
+            os.remove(link)
+
+
+    def __write_html(self, runs):
+        filename = os.path.join(self.__web_dir, "index.html")
+        tmp_filename = os.path.join(self.__web_dir, ".index.html.tmp")
+
+        f = open(tmp_filename, "w")
+        try:
+            f.write(self.__html(runs))
+        finally:
+            f.close()
+
+        os.rename(tmp_filename, filename)
+
+
+    def __html(self, runs):
+        title = escape(self.__title)
+
+        html = ["<html>",
+                "<head><title>%s Paging Lists</title></head>" % (title),
+                "<body>",
+                "<h1>%s Paging Lists</h1>" % (title),
+                "<p>Latest: <a href='latest_title.html'>title list</a> (<a href='latest_title_raw.txt'>raw</a>), "
+                "<a href='latest_item.html'>item list</a> (<a href='latest_item_raw.txt'>raw</a>)</p>",
+                "<table border='1' cellpadding='4'>",
+                "<tr><th>Date</th><th>Title list</th><th>Titles</th><th>Item list</th><th>Items</th><th>Updated</th></tr>"]
+
+        for run in runs:
+            cells = [escape(run["timestamp"] or "")]
+
+            for prefix in ("title", "item"):
+                links = []
+                for column in FILE_COLUMNS:
+                    if column.startswith(prefix) and run[column]:
+                        links.append("<a href='%s'>%s</a>" % (urllib.quote(link_name(column, run[column])), FILE_LABELS[column]))
+
+                cells.append(" ".join(links) or "none")
+                cells.append(run["%s_count" % (prefix)] is not None and str(run["%s_count" % (prefix)]) or "")
+
+            cells.append(strftime("%Y-%m-%d %H:%M:%S", localtime(run["updated_at"])))
+
+            html.append("<tr>%s</tr>" % ("".join(["<td>%s</td>" % (cell) for cell in cells])))
+
+        html += ["</table>",
+                 "</body>",
+                 "</html>",
+                 ""]
+
+        return "\n".join(html)
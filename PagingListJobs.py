@@ -0,0 +1,193 @@
+#!/usr/bin/python
+
+from collections import deque
+from time import time
+
+ITEM_LIST_TIMEOUT = 900    # in seconds, how long a parsed title list waits for its item list
+ITEM_LIST_TTL     = 86400  # in seconds, how long an unmatched item list is kept
+
+class JobStates:
+    TITLE_PARSED, ITEM_PARSED, RENDERING, EMAILED = range(4)
+
+    @staticmethod
+    def getstatestr(state):
+        return {JobStates.TITLE_PARSED : "title_parsed",
+                JobStates.ITEM_PARSED  : "item_parsed",
+                JobStates.RENDERING    : "rendering",
+                JobStates.EMAILED      : "emailed"}.get(state, "unknown")
+
+
+class PagingListJob:
+    """A branch's title and item paging lists for one date."""
+
+    def __init__(self, branch, date):
+        self.branch     = branch
+        self.date       = date
+        self.state      = None
+        self.title_info = None
+        self.item_info  = None
+        self.timeout    = None  # pending Timeouts entry
+        self.created_at = time()
+
+
+    def __repr__(self):
+        return "<PagingListJob %s %s %s>" % (self.branch, self.date, JobStates.getstatestr(self.state))
+
+
+class Timeouts:
+    """Deadlines for a single fixed delay.
+
+    With one delay deadlines are added in order, so a FIFO is all the timer
+    wheel needs: O(1) to add, the next deadline is at the front.  Cancelled
+    entries are left in place and skipped when they reach the front.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.__entries = deque()
+
+
+    def add(self, job, now):
+        job.timeout = (now + self.delay, job)
+        self.__entries.append(job.timeout)
+
+
+    def next_deadline(self):
+        self.__discard_cancelled()
+
+        if self.__entries:
+            return self.__entries[0][0]
+
+        return None
+
+
+    def expire(self, now):
+        """Returns jobs whose deadline has passed."""
+
+        expired = []
+
+        self.__discard_cancelled()
+        while self.__entries and self.__entries[0][0] <= now:
+            deadline, job = self.__entries.popleft()
+            job.timeout = None
+            expired.append(job)
+            self.__discard_cancelled()
+
+        return expired
+
+
+    def __discard_cancelled(self):
+        while self.__entries and self.__entries[0][1].timeout is not self.__entries[0]:
+            self.__entries.popleft()
+
+
+class JobTable:
+    """Pairs title and item paging lists by (branch, date).
+
+    title_parsed() and item_parsed() return the job once both halves are in,
+    expire() returns title lists that waited too long along with unmatched
+    item lists that are dropped.  Jobs ready to render are in RENDERING.
+    """
+
+    def __init__(self, item_list_timeout=ITEM_LIST_TIMEOUT, item_list_ttl=ITEM_LIST_TTL):
+        self.__jobs = {}
+        self.__title_timeouts = Timeouts(item_list_timeout)
+        self.__item_timeouts  = Timeouts(item_list_ttl)
+
+
+    def __len__(self):
+        return len(self.__jobs)
+
+
+    def get(self, branch, date):
+        return self.__jobs.get((branch, date))
+
+
+    def jobs(self):
+        return self.__jobs.values()
+
+
+    def title_parsed(self, branch, date, info, now=None):
+        """Adds a parsed title list, returns the job if it's ready to render."""
+
+        job = self.__job(branch, date)
+
+        job.title_info = info
+
+        if job.item_info is not None:
+            return self.__ready(job)
+
+        job.state = JobStates.TITLE_PARSED
+        self.__title_timeouts.add(job, now or time())
+
+        return None
+
+
+    def item_parsed(self, branch, date, info, now=None):
+        """Adds a parsed item list, returns the job if it's ready to render."""
+
+        job = self.__job(branch, date)
+
+        job.item_info = info
+
+        if job.title_info is not None:
+            return self.__ready(job)
+
+        job.state = JobStates.ITEM_PARSED
+        self.__item_timeouts.add(job, now or time())
+
+        return None
+
+
+    def emailed(self, job):
+        """Marks job done and removes it from the table."""
+
+        job.state = JobStates.EMAILED
+        self.__remove(job)
+
+
+    def next_deadline(self):
+        deadlines = [d for d in (self.__title_timeouts.next_deadline(), self.__item_timeouts.next_deadline()) if d is not None]
+
+        if deadlines:
+            return min(deadlines)
+
+        return None
+
+
+    def expire(self, now=None):
+        """Returns (jobs to render without an item list, dropped item list jobs)."""
+
+        now = now or time()
+
+        ready = [self.__ready(job) for job in self.__title_timeouts.expire(now)]
+
+        stale = self.__item_timeouts.expire(now)
+        for job in stale:
+            self.__remove(job)
+
+        return (ready, stale)
+
+
+    def __job(self, branch, date):
+        key = (branch, date)
+        job = self.__jobs.get(key)
+
+        # start over if the last job for this key is already rendering
+        if job is None or job.state in (JobStates.RENDERING, JobStates.EMAILED):
+            job = PagingListJob(branch, date)
+            self.__jobs[key] = job
+
+        return job
+
+
+    def __remove(self, job):
+        if self.__jobs.get((job.branch, job.date)) is job:
+            del self.__jobs[(job.branch, job.date)]
+
+
+    def __ready(self, job):
+        job.timeout = None
+        job.state = JobStates.RENDERING
+
+        return job
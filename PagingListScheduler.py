@@ -0,0 +1,137 @@
+#!/usr/bin/python
+
+import heapq
+from itertools import count
+from time import time
+
+MAX_JOBS = 4  # title lists processed at once
+
+class ScheduledList:
+    """A title list waiting for, or holding, one of the scheduler's slots."""
+
+    def __init__(self, name, size, args, queued_at):
+        self.name       = name
+        self.size       = size
+        self.args       = args
+        self.queued_at  = queued_at
+        self.started_at = None
+        self.rate       = None  # WebPAC requests per second, set when started
+        self.fixed_rate = False  # rate can't be changed once started, see fix_rate()
+
+
+    def __repr__(self):
+        return "<ScheduledList %s %d>" % (self.name, self.size)
+
+
+class PagingListScheduler:
+    """Runs at most max_jobs title lists at once, smallest first.
+
+    When every branch's list lands at once, the small ones finish in seconds
+    instead of waiting behind the largest.  Equal sizes keep arrival order.
+
+    webpac_budget (requests per second, None for no limit) is split evenly
+    between the running lists, shares are recomputed as lists start and
+    finish; share() is what each of them should be running at.  Lists whose
+    rate can't be changed once started (fix_rate()) keep a whole slot's
+    share, budget / max_jobs, and the rest is split between the others.  So
+    all running lists together never go over the budget.
+    """
+
+    def __init__(self, max_jobs=MAX_JOBS, webpac_budget=None):
+        self.__max_jobs = max(1, max_jobs)
+        self.__webpac_budget = webpac_budget
+        self.__queue = []
+        self.__running = []
+        self.__order = count()
+        self.__share = webpac_budget
+
+
+    def __len__(self):
+        return len(self.__queue) + len(self.__running)
+
+
+    def submit(self, name, size, args, now=None):
+        """Queues a list of size bytes, args are handed back by start()."""
+
+        scheduled = ScheduledList(name, size, args, now or time())
+        heapq.heappush(self.__queue, (size, self.__order.next(), scheduled))
+
+        return scheduled
+
+
+    def start(self, now=None):
+        """Returns the lists that can start now, smallest first, they hold a slot until finished()."""
+
+        now = now or time()
+
+        started = []
+        while self.__queue and len(self.__running) < self.__max_jobs:
+            size, order, scheduled = heapq.heappop(self.__queue)
+
+            scheduled.started_at = now
+
+            self.__running.append(scheduled)
+            started.append(scheduled)
+
+        self.__share_budget()
+
+        return started
+
+
+    def finished(self, scheduled):
+        """Frees the slot held by a started list."""
+
+        if scheduled in self.__running:
+            self.__running.remove(scheduled)
+            self.__share_budget()
+
+
+    def fix_rate(self, scheduled):
+        """Gives a started list whose rate can't be changed from now on a whole slot's share."""
+
+        scheduled.fixed_rate = True
+        self.__share_budget()
+
+
+    def share(self):
+        """WebPAC requests per second for each running list without a fixed rate, None for no limit."""
+
+        return self.__share
+
+
+    def __share_budget(self):
+        if not self.__webpac_budget:
+            return
+
+        slot = float(self.__webpac_budget) / self.__max_jobs
+        fixed = [s for s in self.__running if s.fixed_rate]
+        others = [s for s in self.__running if not s.fixed_rate]
+
+        self.__share = (self.__webpac_budget - slot * len(fixed)) / max(1, len(others))
+
+        for scheduled in fixed:
+            scheduled.rate = slot
+        for scheduled in others:
+            scheduled.rate = self.__share
+
+
+    def running(self):
+        return list(self.__running)
+
+
+    def queued(self):
+        """Returns the queued lists in the order they'll start."""
+
+        return [scheduled for size, order, scheduled in sorted(self.__queue)]
+
+
+    def status(self, now=None):
+        """One line summary of running and queued lists, for the log."""
+
+        now = now or time()
+
+        running = ["%s %dKB %.0fs" % (s.name, s.size / 1024, now - s.started_at) for s in self.__running]
+        queued  = ["%s %dKB %.0fs" % (s.name, s.size / 1024, now - s.queued_at) for s in self.queued()]
+
+        return "running %d/%d: %s; queued %d: %s" % (len(running), self.__max_jobs, ", ".join(running) or "none",
+                                                     len(queued), ", ".join(queued) or "none")
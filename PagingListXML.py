@@ -0,0 +1,73 @@
+#!/usr/bin/python
+
+from cgi import escape
+
+def escape_value(value):
+    """Escapes record values the way the XSL stylesheets expect (they disable output escaping)."""
+
+    v = escape(str(value).strip())
+    v = v.replace("'", "&#39;")
+    v = v.replace('"', "&quot;")
+
+    v = v.replace(",", "&#44;")
+
+    return v
+
+
+def escape_data(data):
+    """Escapes text and attribute values like xml.dom.minidom does."""
+
+    data = data.replace("&", "&amp;").replace("<", "&lt;")
+    data = data.replace("\"", "&quot;").replace(">", "&gt;")
+
+    return data
+
+
+class PagingListXMLWriter:
+    """Streams a <paging_list> document to out as records are written.
+
+    Output matches what xml.dom.minidom's writexml (or toprettyxml, when
+    indent is given) produced for the same document, without building the
+    document in memory.
+    """
+
+    def __init__(self, out, attrs, indent=None):
+        self.__out = out
+        self.__indent = indent
+        self.__newl = indent is not None and "\n" or ""
+        self.count = 0
+
+        out.write('<?xml version="1.0" ?>%s' % (self.__newl))
+        out.write("<paging_list")
+
+        for name in sorted(attrs):
+            out.write(' %s="%s"' % (name, escape_data(attrs[name])))
+
+
+    def write_record(self, record):
+        """Writes <record /> element, one child element per field."""
+
+        indent = self.__indent or ""
+        newl = self.__newl
+        write = self.__out.write
+
+        if not self.count:
+            write(">%s" % (newl))
+
+        write("%s<record>%s" % (indent, newl))
+
+        for key in record:
+            write("%s<%s>%s</%s>%s" % (indent * 2, key, escape_data(escape_value(record[key])), key, newl))
+
+        write("%s</record>%s" % (indent, newl))
+
+        self.count += 1
+
+
+    def close(self):
+        """Ends the document, the underlying file is left open."""
+
+        if self.count:
+            self.__out.write("</paging_list>%s" % (self.__newl))
+        else:
+            self.__out.write("/>%s" % (self.__newl))
@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+import sqlite3
+import cPickle
+from time import time
+
+CACHE_TTL         = 4 * 60 * 60  # in seconds
+CACHE_MAX_ENTRIES = 50000        # least recently used entries are evicted past this
+DB_TIMEOUT        = 30           # in seconds, how long to wait on other writers
+SQL_MAX_VARIABLES = 500          # keep IN (...) lists under SQLITE_MAX_VARIABLE_NUMBER
+
+class WebPACCache:
+    """Persistent cache of WebPACScraper item lookups, shared by all squire.py processes."""
+
+    def __init__(self, filename, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.__ttl = ttl
+        self.__max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self.__db = sqlite3.connect(filename, timeout=DB_TIMEOUT)
+        self.__db.text_factory = str
+
+        try:
+            self.__db.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.DatabaseError:
+            pass
+
+        self.__db.execute("CREATE TABLE IF NOT EXISTS items (bib_number TEXT PRIMARY KEY, items BLOB, created_at REAL, accessed_at REAL)")
+        self.__db.execute("CREATE INDEX IF NOT EXISTS items_accessed_at ON items (accessed_at)")
+        self.__db.commit()
+
+
+    def get_many(self, bib_numbers):
+        """Returns {bib_number : items} for every fresh entry in bib_numbers."""
+
+        bib_numbers = list(set(bib_numbers))
+        now = time()
+        found = {}
+
+        for i in xrange(0, len(bib_numbers), SQL_MAX_VARIABLES):
+            chunk = bib_numbers[i:i + SQL_MAX_VARIABLES]
+            rows = self.__db.execute("SELECT bib_number, items FROM items WHERE created_at > ? AND bib_number IN (%s)" % (",".join("?" * len(chunk))),
+                                     [now - self.__ttl] + chunk)
+
+            for bib_number, items in rows:
+                found[bib_number] = cPickle.loads(str(items))
+
+        # touch entries for LRU eviction
+        self.__db.executemany("UPDATE items SET accessed_at = ? WHERE bib_number = ?", [(now, bib_number) for bib_number in found])
+        self.__db.commit()
+
+        self.hits += len(found)
+        self.misses += len(bib_numbers) - len(found)
+
+        return found
+
+
+    def get(self, bib_number):
+        """Returns cached items for bib_number, or None."""
+
+        return self.get_many([bib_number]).get(bib_number)
+
+
+    def put_many(self, items):
+        """Stores {bib_number : items}, then drops expired and least recently used entries."""
+
+        now = time()
+
+        self.__db.executemany("INSERT OR REPLACE INTO items (bib_number, items, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                              [(bib_number, sqlite3.Binary(cPickle.dumps(items[bib_number], 2)), now, now) for bib_number in items])
+
+        self.__db.execute("DELETE FROM items WHERE created_at <= ?", (now - self.__ttl,))
+
+        count = self.__db.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        if count > self.__max_entries:
+            self.__db.execute("DELETE FROM items WHERE bib_number IN (SELECT bib_number FROM items ORDER BY accessed_at LIMIT ?)",
+                              (count - self.__max_entries,))
+
+        self.__db.commit()
+
+
+    def put(self, bib_number, items):
+        """Stores items for bib_number."""
+
+        self.put_many({bib_number : items})
+
+
+    def close(self):
+        self.__db.close()
@@ -2,31 +2,247 @@
 
 import sys
 import urllib2
+import urlparse
+import httplib
+import socket
+import threading
+import Queue
 import re
 import htmllib
+from time import sleep, time
+
+HTTP_TIMEOUT     = 10   # in seconds
+HTTP_RETRIES     = 2    # retries after a failed request
+HTTP_RETRY_DELAY = 1    # in seconds, multiplied by attempt number
+POOL_SIZE        = 4    # max concurrent requests for get_items_for_bibs
+
+class HTTPStatusError(Exception):
+    """WebPAC answered with something other than 200, code like urllib2.HTTPError's."""
+
+    def __init__(self, code, reason):
+        Exception.__init__(self, "HTTP %d %s" % (code, reason))
+        self.code = code
 
-HTTP_TIMEOUT = 10   # in seconds
 
 class WebPACScraper:
-    def __init__(self, server, port=80):
+    def __init__(self, server, port=80, pool_size=POOL_SIZE, retries=HTTP_RETRIES, cache=None, rate=None):
         self.__server = server
         self.__port = port
-        self.__item_search_string = r"http://%s/search~S1?%s/.%s/.%s/1%%2C1%%2C1%%2CB/marc~%s"
+        self.__item_search_path = r"/search~S1?%s/.%s/.%s/1%%2C1%%2C1%%2CB/marc~%s"
         self.__http_timeout = HTTP_TIMEOUT
+        self.__retries = retries
+        self.__pool_size = max(1, pool_size)
+        self.__jobs = Queue.Queue()
+        self.__workers = []
+        self.__local = threading.local()
+        self.__cache = cache
+        self.__searchscopes = None
+        self.__rate_lock = threading.Lock()
+        self.set_rate(rate)
+
+
+    def set_rate(self, rate):
+        """Limits requests to rate per second across all workers (None for no limit).
+
+        A token bucket, bursts of up to pool_size requests are let through.
+        """
+
+        self.__rate_lock.acquire()
+        try:
+            self.__rate = rate
+            self.__tokens = float(self.__pool_size)
+            self.__refilled_at = time()
+        finally:
+            self.__rate_lock.release()
+
+
+    def __throttle(self):
+        """Waits until the request budget allows another request."""
+
+        while 1:
+            self.__rate_lock.acquire()
+            try:
+                if not self.__rate:
+                    return
+
+                now = time()
+                self.__tokens = min(self.__pool_size, self.__tokens + (now - self.__refilled_at) * self.__rate)
+                self.__refilled_at = now
+
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+
+                wait = (1 - self.__tokens) / self.__rate
+            finally:
+                self.__rate_lock.release()
+
+            sleep(wait)
+
+
+    def __get_connection(self):
+        """Returns keep-alive connection for the calling thread."""
+
+        conn = getattr(self.__local, "conn", None)
+
+        if conn is None:
+            conn = httplib.HTTPConnection(self.__server, self.__port, timeout=self.__http_timeout)
+            self.__local.conn = conn
+
+        return conn
+
+
+    def __close_connection(self):
+        conn = getattr(self.__local, "conn", None)
+
+        if conn is not None:
+            conn.close()
+            self.__local.conn = None
+
+
+    def __fetch(self, path):
+        """Returns content at path, reusing the calling thread's connection and retrying failures."""
+
+        attempt = 0
+
+        while 1:
+            try:
+                self.__throttle()
+
+                conn = self.__get_connection()
+                conn.request("GET", path)
+                response = conn.getresponse()
+                content = response.read()
+
+                if response.getheader("connection", "").lower() == "close":
+                    self.__close_connection()
+
+                if response.status in (301, 302, 303, 307):
+                    # let urllib2 deal with redirects
+                    url = urlparse.urljoin("http://%s:%s/" % (self.__server, self.__port), response.getheader("location"))
+                    return urllib2.urlopen(url, None, self.__http_timeout).read()
+
+                if response.status != 200:
+                    raise HTTPStatusError(response.status, response.reason)
+
+                return content
+
+            except (httplib.HTTPException, socket.error, urllib2.URLError, HTTPStatusError), e:
+                # 4xx won't go away by asking again, 5xx (WebPAC overloaded or restarting) might
+                if getattr(e, "code", 500) < 500:
+                    raise
+
+                self.__close_connection()
+
+                if attempt >= self.__retries:
+                    raise
+
+                attempt += 1
+                sleep(HTTP_RETRY_DELAY * attempt)
+
+
+    def __worker(self):
+        """Pulls (bib_number, results) jobs until told to stop."""
+
+        while 1:
+            job = self.__jobs.get()
+
+            if job is None:
+                self.__close_connection()
+                break
+
+            bib_number, results = job
+
+            try:
+                results.put((bib_number, self.__fetch_items_for_bib(bib_number)))
+            except Exception, e:
+                results.put((bib_number, e))
+
+
+    def get_items_for_bibs(self, bib_numbers):
+        """Returns {bib_number : items} for bib_numbers, fetched concurrently.
+
+        At most pool_size requests are in flight at once; each worker thread
+        keeps its own keep-alive connection.  Bibs found in the cache are not
+        fetched.  Failed lookups map to the exception raised by
+        get_items_for_bib.
+        """
+
+        bib_numbers = set(bib_numbers)
+        results = Queue.Queue()
+        items = {}
+        fetched = {}
+
+        if self.__cache:
+            items = self.__cache.get_many(bib_numbers)
+            bib_numbers.difference_update(items)
+
+        # start workers on first use
+        while len(self.__workers) < self.__pool_size:
+            worker = threading.Thread(target=self.__worker)
+            worker.setDaemon(True)
+            worker.start()
+            self.__workers.append(worker)
+
+        for bib_number in bib_numbers:
+            self.__jobs.put((bib_number, results))
+
+        for i in xrange(len(bib_numbers)):
+            bib_number, v = results.get()
+            items[bib_number] = v
+
+            if not isinstance(v, Exception):
+                fetched[bib_number] = v
+
+        if self.__cache and fetched:
+            self.__cache.put_many(fetched)
+
+        return items
+
+
+    def close(self):
+        """Stops worker threads and closes connections."""
+
+        for worker in self.__workers:
+            self.__jobs.put(None)
+
+        for worker in self.__workers:
+            worker.join()
+
+        self.__workers = []
+        self.__close_connection()
 
 
     def get_items_for_bib(self, bib_number):
         """Returns item info for bib_number."""
 
+        if not bib_number:
+            raise ValueError("get_items_for_bib: bib_number == None")
+
+        if self.__cache:
+            items = self.__cache.get(bib_number)
+
+            if items is None:
+                items = self.__fetch_items_for_bib(bib_number)
+                self.__cache.put(bib_number, items)
+
+            return items
+
+        return self.__fetch_items_for_bib(bib_number)
+
+
+    def __fetch_items_for_bib(self, bib_number):
+        """Scrapes item info for bib_number from WebPAC."""
+
         if not bib_number:
             raise ValueError("get_items_for_bib: bib_number == None")
 
         items = []
         item_table = None
 
-        # TODO: retry on timeout/unavailable 
-        url = self.__item_search_string % (self.__server, `self.__port`, bib_number, bib_number, bib_number)
-        content = urllib2.urlopen(url, None, self.__http_timeout).read()
+        path = self.__item_search_path % (`self.__port`, bib_number, bib_number, bib_number)
+        url = "http://%s%s" % (self.__server, path)
+        content = self.__fetch(path)
 
         # find bibItems table
         m = re.search('class="bibItems".*?>(.*?)</table>', content, re.DOTALL)
@@ -75,10 +291,13 @@ class WebPACScraper:
     def get_searchscope_table(self):
         """Gets available search scopes."""
 
+        # fetched once per scraper
+        if self.__searchscopes is not None:
+            return self.__searchscopes
+
         searchscopes = {}
 
-        url = "http://%s:%s" % (self.__server, self.__port)
-        content = urllib2.urlopen(url, None, self.__http_timeout).read()
+        content = self.__fetch("/")
 
         # find searchscope select
         m = re.search(r"id=\"searchscope\"\.*?>(.*?)\</select>", content, re.DOTALL)
@@ -92,6 +311,8 @@ class WebPACScraper:
         else:
             raise Exception("get_searchscope_table: couldn't get select of searchscopes")
 
+        self.__searchscopes = searchscopes
+
         return searchscopes
 
 
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+"""Usage: bench_inotify_events.py [FILES] [ROUNDS]
+
+Creates FILES files (default 5000) in a watched temporary directory, a burst
+of 2 * FILES IN_CREATE/IN_CLOSE_WRITE events, and times draining them from the
+squired extension, best of ROUNDS (default 5).  Events are drained with
+select(0), which every build of the extension has, and with read_events()
+when available, so an older build can be compared by putting it first on
+PYTHONPATH.  FILES should stay under half of fs.inotify.max_queued_events.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+from time import time
+
+import squired
+
+IN_CLOSE_WRITE = 0x00000008
+IN_CREATE      = 0x00000100
+
+
+def burst(dir, files, round):
+    for i in xrange(files):
+        open(os.path.join(dir, "Branch_%d.paginglist.t%d.auton" % (i, round)), "w").close()
+
+
+def drain_select():
+    events = []
+    while 1:
+        # older builds return a message dict once there's nothing left
+        batch = squired.select(0)
+        if not batch or type(batch) is not list:
+            return events
+        events.extend(batch)
+
+
+def drain_read_events():
+    return squired.read_events()
+
+
+def main():
+    files = 5000
+    rounds = 5
+    if len(sys.argv) > 1:
+        files = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        rounds = int(sys.argv[2])
+
+    dir = tempfile.mkdtemp()
+
+    try:
+        squired.inotify_init()
+        squired.add_watch(dir, IN_CREATE | IN_CLOSE_WRITE)
+
+        drains = [("select(0)", drain_select)]
+        if hasattr(squired, "read_events"):
+            drains.append(("read_events()", drain_read_events))
+
+        print "events:         %d per burst (%s)" % (2 * files, squired.__file__)
+
+        round = 0
+        for name, drain in drains:
+            best = None
+            for i in xrange(rounds):
+                round += 1
+                burst(dir, files, round)
+
+                t = time()
+                events = drain()
+                elapsed = time() - t
+
+                if len(events) != 2 * files:
+                    print "%-15s got %d events, expected %d (queue overflow?)" % (name + ":", len(events), 2 * files)
+                    break
+
+                best = min(best or elapsed, elapsed)
+
+            if best:
+                print "%-15s %.2fms, %.2fus per event" % (name + ":", best * 1000, best * 1000000 / (2 * files))
+
+        squired.shutdown()
+
+    finally:
+        shutil.rmtree(dir)
+
+
+if __name__ == "__main__":
+    main()
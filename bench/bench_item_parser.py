@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+"""Usage: bench_item_parser.py [ITEMS]
+
+Compares ItemPagingList.iter_items against the previous DOTALL regex parser on
+a synthetic Item Paging List of ITEMS items (default 50000).  Both parse an
+mmap of the list in a forked child so peak RSS is measured separately.
+"""
+
+import os
+import sys
+import re
+import mmap
+import random
+import resource
+import tempfile
+import cPickle
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from ItemPagingList import iter_items, ITEM_HEADER
+
+LEGACY_ITEM_REGEX = r"(^\s*AUTHOR:|^\s*Please\ pull\ this\ item\ and\ check\ it\ in\ to\ place\ in\ transit:\s*)(\s*AUTHOR:|)(.*?)^(\s*TITLE:|\s*)(.*?)^(\s*IMPRINT:|\s*)(.*?)^(\s*PUB\ DATE:|\s*)(.*?)^(\s*DESC:|\s*)(.*?)^(\s*CALL\ NO:|\s*)(.*?)^(\s*VOLUME:|\s*)(.*?)^(\s*BARCODE:|\s*)(.*?)^(\s*STATUS:|\s*)(.*?)^(\s*REC\ NO:|\s*)(.*?)^(\s*LOCATION:|\s*)(.*?)^(\s*PICKUP AT:|\s*)(.*?)^(\s*OPACMSG:|\s*)(.*?)$"
+
+
+def synthetic_list(item_count):
+    random.seed(item_count)
+    lines = []
+    for i in xrange(item_count):
+        if random.random() < 0.8:
+            lines.append(ITEM_HEADER)
+        lines.append("     AUTHOR:  Smith, John %d" % (i))
+        lines.append("     TITLE:   A title number %d" % (i))
+        lines.append("     IMPRINT: Publisher, 2010")
+        lines.append("     PUB DATE: 2010")
+        lines.append("     DESC:    %d p." % (random.randint(10, 900)))
+        lines.append("     CALL NO: FIC SMITH %d" % (i))
+        lines.append("     VOLUME:  ")
+        lines.append("     BARCODE: 3%013d" % (random.randint(0, 10 ** 12)))
+        lines.append("     STATUS:  AVAILABLE")
+        lines.append("     REC NO:  i%07d" % (i))
+        lines.append("     LOCATION: Central Fiction")
+        lines.append("     PICKUP AT: Branch 1")
+        lines.append("     OPACMSG: ")
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+def legacy_parse(buf):
+    """process_item_list() parsing before ItemPagingList."""
+    items = []
+    for l in re.findall(LEGACY_ITEM_REGEX, buf, re.DOTALL|re.MULTILINE):
+        items.append((l[2].strip(), l[4].strip(), l[12].strip(), l[16].strip(), l[22].strip()))
+    return items
+
+
+def stream_parse(buf):
+    items = []
+    for item in iter_items(buf):
+        items.append((item["author"], item["title"], item["call_number"], item["barcode"], item["location"]))
+    return items
+
+
+def run(parser, filename):
+    """Runs parser over filename in a child process, returns (seconds, peak RSS in KB, items)."""
+
+    r, w = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        os.close(r)
+        f = open(filename)
+        buf = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        t = time()
+        items = parser(buf)
+        elapsed = time() - t
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(w, cPickle.dumps((elapsed, peak - baseline, items), 2))
+        os._exit(0)
+
+    os.close(w)
+    chunks = []
+    while True:
+        chunk = os.read(r, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(r)
+    os.waitpid(pid, 0)
+
+    return cPickle.loads("".join(chunks))
+
+
+def main():
+    item_count = 50000
+    if len(sys.argv) > 1:
+        item_count = int(sys.argv[1])
+
+    filename = tempfile.mktemp(suffix=".itemlist")
+    open(filename, "w").write(synthetic_list(item_count))
+
+    legacy_time, legacy_rss, legacy = run(legacy_parse, filename)
+    stream_time, stream_rss, items = run(stream_parse, filename)
+
+    os.remove(filename)
+
+    print "items:      %d" % (item_count)
+    print "legacy:     %.3fs (%.0f items/s), +%d KB peak RSS" % (legacy_time, item_count / legacy_time, legacy_rss)
+    print "iter_items: %.3fs (%.0f items/s), +%d KB peak RSS" % (stream_time, item_count / stream_time, stream_rss)
+    print "speedup:    %.1fx" % (legacy_time / stream_time)
+    print "identical:  %s" % (legacy == items)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+"""Usage: bench_job_table.py [BRANCHES]
+
+Feeds synthetic title/item list close events for BRANCHES branches (default
+20000) through PagingListJobs.JobTable on a simulated clock, and through the
+previous scan-every-tick pairing of title procs with item list infos.  Checks
+that both pair the same lists and time out the same titles.
+"""
+
+import os
+import sys
+import random
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PagingListJobs import JobTable, JobStates
+
+ITEM_LIST_TIMEOUT = 900
+TICK = 1  # the old daemon loop's select() timeout
+
+
+def synthetic_events(branch_count):
+    """Returns [(at, "title"|"item", branch)] sorted by time, some item lists missing or late."""
+
+    random.seed(branch_count)
+    events = []
+    for i in xrange(branch_count):
+        branch = "Branch_%d" % (i)
+        title_at = random.uniform(0, 3600)
+        events.append((title_at, "title", branch))
+
+        r = random.random()
+        if r < 0.8:
+            events.append((title_at + random.uniform(-600, 600), "item", branch))
+        elif r < 0.9:
+            events.append((title_at + ITEM_LIST_TIMEOUT + random.uniform(60, 600), "item", branch))
+
+    events.sort()
+    return events
+
+
+def run_job_table(events):
+    """Returns {branch : paired?} for title lists rendered via JobTable."""
+
+    jobs = JobTable(ITEM_LIST_TIMEOUT)
+    rendered = {}
+
+    def render(job):
+        rendered[job.branch] = job.item_info is not None
+        jobs.emailed(job)
+
+    for at, list_type, branch in events:
+        ready, stale = jobs.expire(at)
+        for job in ready:
+            render(job)
+
+        if list_type == "title":
+            job = jobs.title_parsed(branch, "2011-01-01", {}, at)
+        else:
+            job = jobs.item_parsed(branch, "2011-01-01", {}, at)
+
+        if job:
+            render(job)
+
+    ready, stale = jobs.expire(events[-1][0] + ITEM_LIST_TIMEOUT + 1)
+    for job in ready:
+        render(job)
+
+    assert not [job for job in jobs.jobs() if job.state != JobStates.ITEM_PARSED]
+
+    return rendered
+
+
+def run_legacy(events):
+    """Returns {branch : paired?} using the old per-tick scan of waiting procs."""
+
+    procs = []
+    item_list_infos = {}
+    rendered = {}
+
+    def check_procs(now):
+        for proc in procs[:]:
+            if proc["key"] in item_list_infos:
+                del item_list_infos[proc["key"]]
+                rendered[proc["branch"]] = True
+                procs.remove(proc)
+            elif now - proc["wait_timestamp"] >= ITEM_LIST_TIMEOUT:
+                rendered[proc["branch"]] = False
+                procs.remove(proc)
+
+    now = events[0][0]
+    for at, list_type, branch in events:
+        # every tick until this event
+        while now + TICK <= at:
+            now += TICK
+            check_procs(now)
+
+        key = "%s%s" % (branch, "2011-01-01")
+        if list_type == "title":
+            procs.append({"key" : key, "branch" : branch, "wait_timestamp" : at})
+        else:
+            item_list_infos[key] = {}
+
+    while procs:
+        now += TICK
+        check_procs(now)
+
+    return rendered
+
+
+def main():
+    branch_count = 20000
+    if len(sys.argv) > 1:
+        branch_count = int(sys.argv[1])
+
+    events = synthetic_events(branch_count)
+
+    t = time()
+    legacy = run_legacy(events)
+    legacy_time = time() - t
+
+    t = time()
+    rendered = run_job_table(events)
+    job_table_time = time() - t
+
+    print "events:    %d (%d branches, %d paired)" % (len(events), branch_count, len([b for b in rendered if rendered[b]]))
+    print "legacy:    %.3fs" % (legacy_time)
+    print "JobTable:  %.3fs" % (job_table_time)
+    print "speedup:   %.1fx" % (legacy_time / job_table_time)
+    print "identical: %s" % (legacy == rendered)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+
+"""Usage: bench_location_matcher.py [RECORDS]
+
+Compares LocationMatcher against the legacy RegexBorg alternation on a
+synthetic Title Paging List of RECORDS records (default 5000).
+"""
+
+import os
+import sys
+import re
+import random
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from LocationMatcher import LocationMatcher
+
+ETC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "etc")
+
+SUFFIXES = ["New"]
+
+
+def load_lines(filename):
+    file = open(filename)
+    lines = [line.strip() for line in file if line.strip()]
+    file.close()
+    return lines
+
+
+def legacy_location_regex(locations, sublocations, suffixes):
+    """Rebuilds the RegexBorg.get_location_regex() alternation."""
+
+    prefixes = [re.escape(loc) for loc in locations if loc.find(" ") != -1]
+    prefixes.extend([r"\w+"])
+
+    v = []
+    for prefix in prefixes:
+        v.extend([(r"%s\ %s" % (prefix, re.escape(loc))) for loc in sublocations])
+        for suffix in suffixes:
+            v.extend([(r"%s\ %s\ %s" % (prefix, re.escape(loc), suffix)) for loc in sublocations])
+
+    for prefix in prefixes:
+        v.append(r"%s" % (prefix))
+        for suffix in suffixes:
+            v.append(r"%s\ %s" % (prefix, suffix))
+
+    v.sort(key=len, reverse=True)
+
+    return r"(" + '|'.join(v) + r")"
+
+
+def synthetic_lines(count, locations, sublocations):
+    random.seed(count)
+    call_numbers = ["FIC SMITH", "B LINCOLN", "641.5 JONES", "CD MUSIC", "J 398.2 GRIMM"]
+    lines = []
+    for i in xrange(count):
+        location = "%s %s" % (random.choice(locations), random.choice(sublocations))
+        if random.random() < 0.1:
+            location += " " + random.choice(SUFFIXES)
+        lines.append("%s %s .b%d%s" % (location, random.choice(call_numbers), random.randint(1000000, 9999999), random.choice("0123456789x")))
+    return lines
+
+
+def main():
+    count = 5000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    locations = load_lines(os.path.join(ETC_DIR, "locations.cfg")) + ["Central"]
+    sublocations = load_lines(os.path.join(ETC_DIR, "sublocations.cfg"))
+    lines = synthetic_lines(count, locations, sublocations)
+
+    t = time()
+    location_regex = legacy_location_regex(locations, sublocations, SUFFIXES)
+    legacy = []
+    for line in lines:
+        m = re.search("^%s(.*?)([\\s\\.]b\\d+.$)" % (location_regex), line)
+        legacy.append((m.group(1), m.group(2).strip(), m.group(3)[1:-1]))
+    legacy_time = time() - t
+
+    t = time()
+    matcher = LocationMatcher(locations, sublocations, SUFFIXES)
+    matched = [matcher.match(line) for line in lines]
+    matcher_time = time() - t
+
+    mismatches = len([1 for a, b in zip(legacy, matched) if a != b])
+
+    print "records:         %d" % (count)
+    print "regex length:    %d chars" % (len(location_regex))
+    print "legacy regex:    %.3fs (%.0f lines/s)" % (legacy_time, count / legacy_time)
+    print "LocationMatcher: %.3fs (%.0f lines/s)" % (matcher_time, count / matcher_time)
+    print "speedup:         %.1fx" % (legacy_time / matcher_time)
+    print "mismatches:      %d" % (mismatches)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+
+"""Usage: bench_mail_attachments.py [MEGABYTES]
+
+Builds a paging list email with a MEGABYTES (default 5) CSV and HTML list
+attached, once the old way (read whole files, email.Encoders, as_string())
+and once with MultipartWriter streaming into a MailQueue spool file.  Each
+build runs in its own child so peak RSS can be compared.  Checks that both
+messages decode to the same attachments.
+"""
+
+import os
+import sys
+import gzip
+import email
+import shutil
+import resource
+import tempfile
+import cPickle
+from time import time
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from email.MIMEBase import MIMEBase
+from email.MIMEText import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email import Encoders
+
+from MailQueue import MailQueue
+from MultipartWriter import MultipartWriter
+
+GZIP_HTML_SIZE = 1024 * 1024  # squired's EMAIL_GZIP_HTML_SIZE
+
+ROW  = '"Title %d","Author, Some","PR6045.O72 M7 %d","31234001%06d","Central stacks"\n'
+HTML = '<tr><td>Title %d</td><td>Author, Some</td><td>PR6045.O72 M7 %d</td><td>31234001%06d</td></tr>\n'
+
+
+def write_list(filename, row, size):
+    f = open(filename, "wb")
+    i = 0
+    while f.tell() < size:
+        f.write(row % (i, i, i))
+        i += 1
+    f.close()
+
+
+def build_legacy(csv_filename, html_filename, out_filename):
+    msg = MIMEMultipart("alternative")
+    msg["Subject"] = "Central Paging Lists for 2011-01-01"
+
+    csv_attachment = MIMEBase("text", "csv")
+    csv_attachment.set_payload(open(csv_filename, "rb").read())
+    Encoders.encode_7or8bit(csv_attachment)
+    csv_attachment.add_header("Content-Disposition", "attachment", filename=os.path.basename(csv_filename))
+    msg.attach(csv_attachment)
+
+    html_attachment = MIMEBase("application", "octet-stream")
+    html_attachment.set_payload(open(html_filename, "rb").read())
+    Encoders.encode_base64(html_attachment)
+    html_attachment.add_header("Content-Disposition", "attachment", filename=os.path.basename(html_filename))
+    msg.attach(html_attachment)
+
+    msg.attach(MIMEText("body", "plain"))
+
+    open(out_filename, "wb").write(msg.as_string())
+
+
+def build_streaming(csv_filename, html_filename, out_filename):
+    spool_dir = os.path.join(os.path.dirname(out_filename), "spool")
+
+    # an unreachable server, the message stays in the spool
+    queue = MailQueue(spool_dir, "127.0.0.1", 1, retry_delay=3600)
+    message = queue.open_message("from@example.org", ["to@example.org"])
+
+    msg = MultipartWriter(message, "alternative", [("Subject", "Central Paging Lists for 2011-01-01")])
+    msg.attach_file(csv_filename, "text", "csv", encoding="7or8bit")
+    msg.attach_file(html_filename, "application", "octet-stream", gzip=os.path.getsize(html_filename) > GZIP_HTML_SIZE)
+    msg.attach_text("body", "plain")
+    msg.close()
+    message.close()
+
+    # skip past the envelope
+    spooled = os.path.join(spool_dir, [f for f in os.listdir(spool_dir) if f.endswith(".msg")][0])
+    f = open(spooled, "rb")
+    cPickle.load(f)
+    shutil.copyfileobj(f, open(out_filename, "wb"))
+    f.close()
+
+
+def run(build, *args):
+    """Runs build(*args) in a child, returns (seconds, peak RSS in KB)."""
+
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        t = time()
+        build(*args)
+        os.write(w, "%f %d" % (time() - t, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+        os._exit(0)
+
+    os.close(w)
+    result = os.read(r, 128)
+    os.close(r)
+    os.waitpid(pid, 0)
+
+    seconds, rss = result.split()
+    return float(seconds), int(rss)
+
+
+def attachments(filename):
+    """Returns {attachment filename : decoded data}, gunzipping .gz attachments."""
+
+    parts = {}
+    for part in email.message_from_file(open(filename, "rb")).walk():
+        name = part.get_filename()
+        if not name:
+            continue
+        data = part.get_payload(decode=True)
+        if name.endswith(".gz"):
+            name = name[:-3]
+            data = gzip.GzipFile(fileobj=StringIO(data)).read()
+        parts[name] = data
+
+    return parts
+
+
+def main():
+    megabytes = 5
+    if len(sys.argv) > 1:
+        megabytes = float(sys.argv[1])
+
+    tmp = tempfile.mkdtemp()
+    try:
+        csv_filename = os.path.join(tmp, "Central.itemlist.csv")
+        html_filename = os.path.join(tmp, "Central.itemlist.html")
+        write_list(csv_filename, ROW, int(megabytes * 1024 * 1024))
+        write_list(html_filename, HTML, int(megabytes * 1024 * 1024))
+
+        # the interpreter with everything imported, before building anything
+        baseline_time, baseline_rss = run(lambda: None)
+
+        legacy_out = os.path.join(tmp, "legacy.eml")
+        legacy_time, legacy_rss = run(build_legacy, csv_filename, html_filename, legacy_out)
+
+        streaming_out = os.path.join(tmp, "streaming.eml")
+        streaming_time, streaming_rss = run(build_streaming, csv_filename, html_filename, streaming_out)
+
+        print "attachments: %.1f MB csv + %.1f MB html" % (os.path.getsize(csv_filename) / 1048576.0, os.path.getsize(html_filename) / 1048576.0)
+        print "baseline:    %6d KB peak RSS" % (baseline_rss)
+        print "legacy:      %6d KB peak RSS, %.3fs, %d byte message" % (legacy_rss, legacy_time, os.path.getsize(legacy_out))
+        print "streaming:   %6d KB peak RSS, %.3fs, %d byte message" % (streaming_rss, streaming_time, os.path.getsize(streaming_out))
+        print "identical:   %s" % (attachments(legacy_out) == attachments(streaming_out))
+
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
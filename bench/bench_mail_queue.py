@@ -0,0 +1,178 @@
+#!/usr/bin/python
+
+"""Usage: bench_mail_queue.py [MESSAGES]
+
+Runs MailQueue against an smtpd stand-in on localhost: delivers a morning wave
+of MESSAGES (default 20) branch emails and reports connections used and
+delivery latency, then checks that recipients refused with 4xx are retried,
+that 5xx refusals end up in the spool's failed directory, that a session the
+server dropped is reconnected, and that mail spooled while the server was down
+goes out with the next MailQueue.
+"""
+
+import os
+import sys
+import shutil
+import smtpd
+import asyncore
+import logging
+import tempfile
+import threading
+from time import time, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from MailQueue import MailQueue
+
+MESSAGE = "Subject: Central Paging Lists for 2011-01-01\r\n\r\n%s\r\n" % ("Title, Author, Call number, Barcode\r\n" * 100)
+
+
+class StandInChannel(smtpd.SMTPChannel):
+
+    dropped = False
+
+    def found_terminator(self):
+        # the server timed the session out, the client finds out on its next command
+        if self.dropped:
+            self.close()
+            return
+
+        smtpd.SMTPChannel.found_terminator(self)
+
+
+    def smtp_RCPT(self, arg):
+        # refusals handed out in order, one per RCPT, before accepting again
+        if self._SMTPChannel__server.refusals:
+            self.push(self._SMTPChannel__server.refusals.pop(0))
+            return
+
+        smtpd.SMTPChannel.smtp_RCPT(self, arg)
+
+
+class StandInServer(smtpd.SMTPServer):
+    """Accepts everything, unless told to refuse recipients or drop sessions."""
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ("127.0.0.1", 0), None)
+
+        self.connections = 0
+        self.messages = []
+        self.refusals = []
+        self.drop_after_message = False
+        self.channel = None
+
+
+    def handle_accept(self):
+        pair = self.accept()
+        if pair is not None:
+            self.connections += 1
+            self.channel = StandInChannel(self, *pair)
+
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((rcpttos, data))
+
+        # like an idle timeout on the server's end
+        if self.drop_after_message:
+            self.channel.dropped = True
+
+
+def wait_for(queue, timeout=10):
+    """Waits for queue to empty, True unless it timed out."""
+
+    deadline = time() + timeout
+    while queue.queue_depth() and time() < deadline:
+        sleep(0.01)
+
+    return not queue.queue_depth()
+
+
+def check(name, ok):
+    print "%-18s %s" % (name + ":", ok and "ok" or "FAILED")
+    return ok
+
+
+def main():
+    messages = 20
+    if len(sys.argv) > 1:
+        messages = int(sys.argv[1])
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    server = StandInServer()
+    port = server.socket.getsockname()[1]
+
+    thread = threading.Thread(target=asyncore.loop, kwargs={"timeout" : 0.05})
+    thread.setDaemon(True)
+    thread.start()
+
+    tmp = tempfile.mkdtemp()
+    spool_dir = os.path.join(tmp, "spool")
+    results = []
+
+    try:
+        queue = MailQueue(spool_dir, "127.0.0.1", port, retry_delay=0.2, retry_max_delay=0.2)
+
+        # the morning wave, one session
+        t = time()
+        for i in xrange(messages):
+            queue.send("squire@example.org", ["branch%d@example.org" % (i)], MESSAGE, "Branch%d" % (i))
+        delivered = wait_for(queue)
+        print "wave:              %d messages over %d connection(s), %.1fms per message" % (len(server.messages), server.connections,
+                                                                                          (time() - t) * 1000 / messages)
+        results.append(check("wave", delivered and len(server.messages) == messages and server.connections == 1))
+
+        # greylisted, 4xx for every recipient twice
+        del server.messages[:]
+        server.refusals = ["450 4.7.1 greylisted, try again later"] * 2
+        queue.send("squire@example.org", ["central@example.org"], MESSAGE, "Central")
+        delivered = wait_for(queue)
+        results.append(check("4xx retried", delivered and len(server.messages) == 1 and not server.refusals))
+
+        # no such mailbox, 5xx, not retried
+        del server.messages[:]
+        server.refusals = ["550 5.1.1 no such mailbox"]
+        queue.send("squire@example.org", ["nobody@example.org"], MESSAGE, "Nobody")
+        wait_for(queue)
+        failed = os.listdir(os.path.join(spool_dir, "failed"))
+        results.append(check("5xx failed", len(failed) == 1 and not server.messages))
+
+        # one 4xx and one 5xx recipient, the 5xx is final
+        server.refusals = ["450 4.7.1 greylisted, try again later", "550 5.1.1 no such mailbox"]
+        queue.send("squire@example.org", ["central@example.org", "nobody@example.org"], MESSAGE, "Mixed")
+        wait_for(queue)
+        failed = os.listdir(os.path.join(spool_dir, "failed"))
+        results.append(check("4xx+5xx failed", len(failed) == 2 and not server.messages))
+
+        # server drops the session after each message
+        connections = server.connections
+        server.drop_after_message = True
+        for i in xrange(3):
+            queue.send("squire@example.org", ["branch%d@example.org" % (i)], MESSAGE, "Branch%d" % (i))
+            wait_for(queue)
+        server.drop_after_message = False
+        results.append(check("reconnected", len(server.messages) == 3 and server.connections > connections))
+
+        queue.shutdown()
+
+        # spooled while the server was unreachable, sent by the next queue
+        del server.messages[:]
+        down_queue = MailQueue(spool_dir, "127.0.0.1", 1, retry_delay=3600)
+        down_queue.send("squire@example.org", ["midland@example.org"], MESSAGE, "Midland")
+        down_queue.shutdown()
+
+        queue = MailQueue(spool_dir, "127.0.0.1", port)
+        delivered = wait_for(queue)
+        queue.shutdown()
+        results.append(check("spool resent", delivered and len(server.messages) == 1))
+
+    finally:
+        shutil.rmtree(tmp)
+        server.close()
+
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+
+"""Usage: bench_title_parser.py [LINES]
+
+Compares squire.iter_records against the previous readline/findall parser on
+a synthetic Title Paging List of about LINES lines (default 100000).
+"""
+
+import os
+import sys
+import re
+import random
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import squire
+from squire import LineTypes
+
+ETC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "etc")
+
+squire.LOCATIONS_FILE    = os.path.join(ETC_DIR, "locations.cfg")
+squire.SUBLOCATIONS_FILE = os.path.join(ETC_DIR, "sublocations.cfg")
+
+HEADER = ["",
+          "                              Title Paging List",
+          "                                                   Mon Jan 01 2011 12:00AM",
+          ""]
+
+
+def synthetic_list(line_count):
+    random.seed(line_count)
+    sublocations = [line.strip() for line in open(squire.SUBLOCATIONS_FILE) if line.strip()]
+    lines = list(HEADER)
+    i = 0
+    while len(lines) < line_count:
+        lines.append("Central %s FIC SMITH .b%d%s" % (random.choice(sublocations), random.randint(1000000, 9999999), random.choice("0123456789x")))
+        lines.append("A title number %d / Author %d." % (i, i))
+        if random.random() < 0.2:
+            lines.append("v. %d" % (random.randint(1, 9)))
+        lines.append("Publisher, 2010.")
+        lines.append("Pickup Branch")
+        lines.append("")
+        i += 1
+        if i % 50 == 0:
+            lines.append("Page %d" % (i / 50))
+            lines.extend(HEADER[1:])
+    return "\n".join(lines) + "\n", len(lines)
+
+
+def legacy_get_line_type(line, last_type):
+    """get_line_type() before the state machine rewrite."""
+    if re.findall(r"^\s+", line):
+        if not line.strip():
+            if last_type == LineTypes.BLOCK_LINE_2:
+                return LineTypes.BLOCK_LINE_3
+            return LineTypes.BLANK
+        elif last_type == LineTypes.BLOCK_LINE_1:
+            return LineTypes.BLOCK_LINE_2
+        elif last_type == LineTypes.BLOCK_LINE_2:
+            return LineTypes.BLOCK_LINE_3
+        elif last_type == LineTypes.BLOCK_LINE_3:
+            return LineTypes.BLOCK_LINE_4
+        elif last_type == LineTypes.CAPTION:
+            return LineTypes.TIMESTAMP
+        elif last_type == LineTypes.PAGE_MARK:
+            return LineTypes.CAPTION
+        return LineTypes.INVALID
+    elif re.findall(r"^\Page\s\d+$", line):
+        return LineTypes.PAGE_MARK
+    elif last_type == LineTypes.BLANK:
+        return LineTypes.BLOCK_LINE_1
+    elif last_type == LineTypes.BLOCK_LINE_1:
+        return LineTypes.BLOCK_LINE_2
+    elif last_type == LineTypes.BLOCK_LINE_2:
+        return LineTypes.BLOCK_LINE_3
+    elif last_type == LineTypes.BLOCK_LINE_3:
+        return LineTypes.BLOCK_LINE_4
+    elif last_type == LineTypes.BLOCK_LINE_4:
+        return LineTypes.BLOCK_LINE_5
+    return LineTypes.INVALID
+
+
+def legacy_parse(buf, location_matcher):
+    """load_records() parsing loop before the state machine rewrite."""
+    blocks = []
+    lines = iter(buf.splitlines(True))
+    block_range = range(LineTypes.BLOCK_LINE_1, LineTypes.BLOCK_LINE_5 + 1)
+
+    for raw_line in lines:
+        if not raw_line.strip() == "" and raw_line.strip() == "Title Paging List":
+            break
+
+    line_type = last_type = LineTypes.CAPTION
+    record = {}
+    for raw_line in lines:
+        line_type = legacy_get_line_type(raw_line, line_type)
+        if line_type in block_range:
+            squire.parse_record_line(record, raw_line, line_type, location_matcher)
+        if line_type == LineTypes.BLANK and \
+           (last_type == LineTypes.BLOCK_LINE_3 or last_type == LineTypes.BLOCK_LINE_4 or last_type == LineTypes.BLOCK_LINE_5):
+            if last_type == LineTypes.BLOCK_LINE_3:
+                record["pickup_location"] = record["publishing"]
+                record["publishing"] = str(None)
+            blocks.append(record)
+            record = {}
+        last_type = line_type
+    return blocks
+
+
+def main():
+    line_count = 100000
+    if len(sys.argv) > 1:
+        line_count = int(sys.argv[1])
+
+    buf, line_count = synthetic_list(line_count)
+    location_matcher = squire.LocationBorg().get_location_matcher()
+
+    t = time()
+    legacy = legacy_parse(buf, location_matcher)
+    legacy_time = time() - t
+
+    t = time()
+    blocks = list(squire.iter_records(buf, location_matcher))
+    stream_time = time() - t
+
+    print "lines:        %d (%d blocks)" % (line_count, len(blocks))
+    print "legacy:       %.3fs (%.0f lines/s)" % (legacy_time, line_count / legacy_time)
+    print "iter_records: %.3fs (%.0f lines/s)" % (stream_time, line_count / stream_time)
+    print "speedup:      %.1fx" % (legacy_time / stream_time)
+    print "identical:    %s" % (legacy == blocks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+
+"""Usage: bench_title_workers.py [LISTS] [LINES]
+
+Processes LISTS (default 10) synthetic Title Paging Lists of about LINES lines
+(default 2000) one after another, once by running squire.py for each list the
+way squired did, and once through a warm worker that already has squire
+imported, the location matcher built and the WebPAC scraper connected, the way
+squired's title list workers do.  Item lookups go to a WebPAC stub on
+localhost, the cache is off for both.  Reports per-list latency.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import multiprocessing
+import BaseHTTPServer
+import SocketServer
+from time import time
+from cStringIO import StringIO
+from subprocess import Popen, PIPE
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+ETC_DIR = os.path.join(ROOT_DIR, "etc")
+
+sys.path.insert(0, ROOT_DIR)
+
+import squire
+from bench_title_parser import synthetic_list
+
+ITEMS = ('<table class="bibItems" width="100%">'
+         '<tr class="bibItemsEntry"><td><!-- field 1 -->&nbsp;Central Fiction</td><td><!-- field C --><a href="x">FIC SMITH</a></td><td><!-- field % -->AVAILABLE</td></tr>'
+         '<tr class="bibItemsEntry"><td><!-- field 1 -->&nbsp;Central Closed Stacks</td><td><!-- field C --><a href="x">FIC SMITH</a></td><td><!-- field % -->CHECKED OUT</td></tr>'
+         '</table>')
+SCOPES = '<select name="searchscope" id="searchscope"><option value="1">Entire Collection</option><option value="2">Central</option></select>'
+
+# squire's config, for both paths
+CONFIG = {"LOCATIONS_FILE"    : os.path.join(ETC_DIR, "locations.cfg"),
+          "SUBLOCATIONS_FILE" : os.path.join(ETC_DIR, "sublocations.cfg"),
+          "CATALOG_HOSTNAME"  : "127.0.0.1",
+          "WEBPAC_CACHE_FILE" : None,
+          "REDIS_SERVER"      : None}
+
+# what running SQUIRE_CMD costs, with CONFIG instead of the installed settings
+SQUIRE_CMD = """
+import sys
+sys.path.insert(0, %r)
+import squire
+for name, value in %r.items():
+    setattr(squire, name, value)
+squire.main()
+"""
+
+
+class WebPACHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1  # one write per response, no Nagle stalls on keep-alive
+
+    def do_GET(self):
+        if self.path.startswith("/search"):
+            body = "<html>%s</html>" % (ITEMS)
+        else:
+            body = "<html>%s</html>" % (SCOPES)
+
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class WebPACServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def init_worker():
+    # see squired's init_title_list_worker
+    squire.LocationBorg()
+    squire.scraper = squire.WebPACScraper(squire.CATALOG_HOSTNAME, squire.CATALOG_PORT, squire.WEBPAC_CONCURRENCY, squire.WEBPAC_RETRIES, squire.cache)
+
+
+def build_title_list(filename, csv_filename, xml_filename):
+    # see squired's build_title_list
+    stderr = sys.stderr
+    sys.stderr = StringIO()
+    try:
+        squire.process_title_list(filename, csv_filename, xml_filename)
+    finally:
+        sys.stderr = stderr
+
+
+def run_popen(job):
+    filename, csv_filename, xml_filename = job
+    proc = Popen([sys.executable, "-c", SQUIRE_CMD % (ROOT_DIR, CONFIG),
+                  "--file=%s" % (filename),
+                  "--csv", "--output-file-csv=%s" % (csv_filename),
+                  "--xml", "--output-file-xml=%s" % (xml_filename)],
+                 stderr=PIPE)
+    proc.communicate()
+    if proc.returncode != 0:
+        raise Exception("squire.py failed [%s]" % (filename))
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    print "%-15s mean %.1fms, median %.1fms, max %.1fms per list" % (name + ":",
+          sum(latencies) * 1000 / len(latencies), latencies[len(latencies) / 2] * 1000, latencies[-1] * 1000)
+
+
+def main():
+    lists = 10
+    lines = 2000
+    if len(sys.argv) > 1:
+        lists = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        lines = int(sys.argv[2])
+
+    server = WebPACServer(("127.0.0.1", 0), WebPACHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+
+    CONFIG["CATALOG_PORT"] = server.server_address[1]
+    for name, value in CONFIG.items():
+        setattr(squire, name, value)
+
+    dir = tempfile.mkdtemp()
+
+    try:
+        jobs = []
+        for i in xrange(lists):
+            name = os.path.join(dir, "Central_%d" % (i))
+            data, count = synthetic_list(lines + i)
+            open("%s.paginglist" % (name), "w").write(data)
+            jobs.append(("%s.paginglist" % (name), "%s.csv" % (name), "%s.xml" % (name)))
+
+        print "lists:          %d of %d lines" % (lists, lines)
+
+        latencies = []
+        for job in jobs:
+            t = time()
+            run_popen(job)
+            latencies.append(time() - t)
+        report("popen", latencies)
+
+        pool = multiprocessing.Pool(1, init_worker)
+        pool.apply(len, ("warm up",))
+
+        latencies = []
+        for job in jobs:
+            t = time()
+            pool.apply(build_title_list, job)
+            latencies.append(time() - t)
+        report("warm worker", latencies)
+
+        pool.close()
+        pool.join()
+
+    finally:
+        shutil.rmtree(dir)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/python
+
+"""Usage: bench_webpac_scraper.py [BIBS] [LATENCY_MS]
+
+Looks up BIBS (default 200) bibs against a WebPAC stub on localhost that takes
+LATENCY_MS (default 5) per request, once one bib at a time with
+get_items_for_bib and once with get_items_for_bibs, and reports the time and
+connections used.  Then checks the error paths: 5xx replies and dropped
+connections are retried, 4xx replies are not, a bib that keeps failing comes
+back as its exception, and "Connection: close" is honoured.
+"""
+
+import os
+import re
+import sys
+import threading
+import BaseHTTPServer
+import SocketServer
+from time import time, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import WebPACScraper
+from WebPACScraper import HTTPStatusError
+
+ITEMS = ('<table class="bibItems" width="100%%">'
+         '<tr class="bibItemsEntry"><td><!-- field 1 -->&nbsp;Central Fiction</td><td><!-- field C --><a href="x">FIC %s</a></td><td><!-- field %% -->AVAILABLE</td></tr>'
+         '</table>')
+
+
+class WebPACHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1  # one write per response, no Nagle stalls on keep-alive
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.count("connections")
+
+
+    def do_GET(self):
+        bib_number = re.search(r"marc~(.*)$", self.path).group(1)
+        self.server.count("requests")
+        self.server.count(bib_number)
+
+        sleep(self.server.latency)
+
+        # canned failures for this bib, one per request, then its items
+        reply = self.server.replies.get(bib_number) and self.server.replies[bib_number].pop(0) or 200
+
+        if reply == "drop":
+            self.close_connection = 1
+            return
+
+        if reply == "close":
+            reply = 200
+            self.close_connection = 1
+
+        body = reply == 200 and "<html>%s</html>" % (ITEMS % (bib_number)) or "<html>error</html>"
+
+        self.send_response(reply)
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def log_message(self, *args):
+        pass
+
+
+class WebPACServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), WebPACHandler)
+
+        self.latency = latency
+        self.replies = {}
+        self.counts = {}
+        self.lock = threading.Lock()
+
+
+    def count(self, name):
+        self.lock.acquire()
+        try:
+            self.counts[name] = self.counts.get(name, 0) + 1
+        finally:
+            self.lock.release()
+
+
+    def reset(self, replies={}):
+        self.replies = dict([(bib_number, list(r)) for bib_number, r in replies.items()])
+        self.counts = {}
+
+
+def check(name, ok):
+    print "%-22s %s" % (name + ":", ok and "ok" or "FAILED")
+    return ok
+
+
+def main():
+    bibs = 200
+    latency = 5
+    if len(sys.argv) > 1:
+        bibs = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        latency = float(sys.argv[2])
+
+    server = WebPACServer(latency / 1000.0)
+    port = server.server_address[1]
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+
+    # no waiting between retries
+    WebPACScraper.HTTP_RETRY_DELAY = 0
+
+    bib_numbers = ["b%07d" % (i) for i in xrange(bibs)]
+    results = []
+
+    try:
+        print "bibs:                  %d, %gms per request" % (bibs, latency)
+
+        scraper = WebPACScraper.WebPACScraper("127.0.0.1", port)
+        t = time()
+        for bib_number in bib_numbers:
+            scraper.get_items_for_bib(bib_number)
+        print "one at a time:         %.2fs, %d connection(s)" % (time() - t, server.counts["connections"])
+        scraper.close()
+
+        server.reset()
+        scraper = WebPACScraper.WebPACScraper("127.0.0.1", port)
+        t = time()
+        items = scraper.get_items_for_bibs(bib_numbers)
+        print "get_items_for_bibs:    %.2fs, %d connection(s), pool of %d" % (time() - t, server.counts["connections"], WebPACScraper.POOL_SIZE)
+        results.append(check("all found", len(items) == bibs and not [v for v in items.values() if isinstance(v, Exception)]))
+        results.append(check("keep-alive reused", server.counts["connections"] <= WebPACScraper.POOL_SIZE))
+
+        # error paths, on the pool's open connections
+        server.reset({"b_503" : [503, 503], "b_drop" : ["drop"], "b_404" : [404], "b_500" : [500] * 10, "b_close" : ["close"]})
+        items = scraper.get_items_for_bibs(["b_503", "b_drop", "b_404", "b_500", "b_close"])
+
+        results.append(check("5xx retried", not isinstance(items["b_503"], Exception) and server.counts["b_503"] == 3))
+        results.append(check("dropped retried", not isinstance(items["b_drop"], Exception) and server.counts["b_drop"] == 2))
+        results.append(check("4xx not retried", isinstance(items["b_404"], HTTPStatusError) and items["b_404"].code == 404 and server.counts["b_404"] == 1))
+        results.append(check("5xx gave up", isinstance(items["b_500"], HTTPStatusError) and server.counts["b_500"] == WebPACScraper.HTTP_RETRIES + 1))
+        results.append(check("connection close", not isinstance(items["b_close"], Exception)))
+
+        # the pool's connections survive all that
+        server.reset()
+        items = scraper.get_items_for_bibs(bib_numbers[:20])
+        results.append(check("pool still working", len(items) == 20 and not [v for v in items.values() if isinstance(v, Exception)]))
+
+        scraper.close()
+
+    finally:
+        server.shutdown()
+
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+
+"""Usage: bench_xml_writer.py [RECORDS]
+
+Compares PagingListXMLWriter against the previous xml.dom.minidom
+serialization for RECORDS synthetic title records (default 50000).  Each
+serializer runs in a forked child so peak RSS is measured separately.
+"""
+
+import os
+import sys
+import resource
+import tempfile
+from time import time
+from xml.dom.minidom import Document
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from PagingListXML import PagingListXMLWriter, escape_value
+
+
+def synthetic_records(count):
+    for i in xrange(count):
+        yield {"call_number"     : "FIC SMITH %d" % (i),
+               "publishing"      : "Publisher, 2010",
+               "author"          : "Smith, John & Jones, Jane",
+               "title"           : "A title number %d <with markup>" % (i),
+               "volume"          : " ",
+               "requested_count" : 1,
+               "flags"           : "N,C",
+               "location"        : "Central Fiction",
+               "pickup_location" : "Branch 1",
+               "bib_number"      : "b%07d" % (i),
+               "available_count" : 2}
+
+
+def write_minidom(records, out, attrs):
+    doc = Document()
+    root_node = doc.createElement("paging_list")
+    for name in attrs:
+        root_node.setAttribute(name, attrs[name])
+    doc.appendChild(root_node)
+
+    for record in records:
+        elem = doc.createElement("record")
+        for key in record:
+            e = doc.createElement(key)
+            e.appendChild(doc.createTextNode(escape_value(record[key])))
+            elem.appendChild(e)
+        root_node.appendChild(elem)
+
+    doc.writexml(out)
+
+
+def write_streaming(records, out, attrs):
+    writer = PagingListXMLWriter(out, attrs)
+    for record in records:
+        writer.write_record(record)
+    writer.close()
+
+
+def run(serializer, count, filename):
+    """Runs serializer in a child process, returns (seconds, peak RSS in KB)."""
+
+    r, w = os.pipe()
+    pid = os.fork()
+
+    if pid == 0:
+        os.close(r)
+        # records are built up front, as records_to_xml sorts them first
+        records = list(synthetic_records(count))
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        t = time()
+        out = open(filename, "w")
+        serializer(records, out, {"location" : "Central", "count" : str(count)})
+        out.close()
+        elapsed = time() - t
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(w, "%f %d" % (elapsed, peak - baseline))
+        os._exit(0)
+
+    os.close(w)
+    result = os.read(r, 64).split()
+    os.close(r)
+    os.waitpid(pid, 0)
+
+    return float(result[0]), int(result[1])
+
+
+def main():
+    count = 50000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+
+    minidom_file = tempfile.mktemp(suffix=".xml")
+    streaming_file = tempfile.mktemp(suffix=".xml")
+
+    minidom_time, minidom_rss = run(write_minidom, count, minidom_file)
+    streaming_time, streaming_rss = run(write_streaming, count, streaming_file)
+
+    identical = open(minidom_file).read() == open(streaming_file).read()
+    os.remove(minidom_file)
+    os.remove(streaming_file)
+
+    print "records:             %d" % (count)
+    print "minidom:             %.3fs, +%d KB peak RSS" % (minidom_time, minidom_rss)
+    print "PagingListXMLWriter: %.3fs, +%d KB peak RSS" % (streaming_time, streaming_rss)
+    print "identical output:    %s" % (identical)
+
+
+if __name__ == "__main__":
+    main()
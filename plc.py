@@ -1,13 +1,377 @@
-import redis
+from time import time
+from datetime import date, timedelta
+
+# http://pypi.python.org/pypi/redis (optional with a backend such as MemoryRedis)
+try:
+    import redis
+except ImportError:
+    redis = None
+
+DAILY_RETENTION_DAYS = 400  # daily counts older than this are rolled up into monthly totals
+
+# one pool per server, shared by every PagingListStatistics in the process
+_connection_pools = {}
+
+def getConnectionPool(redis_host, redis_port):
+    """ Returns the process wide connection pool for redis_host:redis_port. """
+
+    key = (redis_host, redis_port)
+    if key not in _connection_pools:
+        _connection_pools[key] = redis.ConnectionPool(host=redis_host, port=redis_port, db=0)
+
+    return _connection_pools[key]
+
+
+def _month(day):
+    return day.strftime("%Y-%m")
+
+
+def _iterMonths(start, end):
+    """ Yields "YYYY-MM" for every month from start up to, not including, end ("YYYY-MM" strings). """
+
+    month = start
+    while month < end:
+        yield month
+        month = _nextMonth(month)
+
+
+def _nextMonth(month):
+    year, month = [int(i) for i in month.split("-")]
+    return "%04d-%02d" % (year + month / 12, month % 12 + 1)
+
+
+def _iterDays(start, end):
+    day = start
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
 
 class PagingListStatistics(object):
-    """ Handles reporting of weekling title paging list counts to redis. """
+    """ Handles reporting of weekling title paging list counts to redis.
+
+    Counts and metrics are buffered until flush(), which sends them all in one
+    pipeline.  backend may be any object with redis' pipeline(), e.g. a
+    MemoryRedis for tests.
+
+    Daily counts are kept as one hash per branch and month (<key>:ts:<branch>:
+    <YYYY-MM>, fields are days of the month), small enough for redis' compact
+    hash encoding.  Months older than retention_days are rolled up into
+    <key>:ts:<branch>:monthly, "YYYY-MM" -> total and "YYYY-MM:days" -> days
+    with a list.  <key>:ts maps each branch to its oldest daily month.
+    """
+
+    def __init__(self, redis_host, redis_port, redis_key, backend=None, retention_days=DAILY_RETENTION_DAYS):
+        if backend is None:
+            if redis is None:
+                raise ImportError("redis module not available")
+            backend = redis.StrictRedis(connection_pool=getConnectionPool(redis_host, redis_port))
 
-    def __init__(self, redis_host, redis_port, redis_key):
-        self._redis = redis.StrictRedis(host=redis_host, port=redis_port, db=0)
+        self._redis = backend
         self._redis_key = redis_key
+        self._retention_days = retention_days
+        self._counts = {}
+        self._daily = {}
+        self._metrics = {}
+        self._durations = {}
+        self._runs = {}
 
 
     def setBranchCount(self, branch, day, count):
-        self._redis.hset(self._redis_key, "%s:%s" % (branch, day), count)
+        self._counts["%s:%s" % (branch, day)] = count
+
+
+    def recordBranchCount(self, branch, day, count):
+        """ Records count for branch on day (a date), in the weekly counts and the daily time series. """
+
+        self.setBranchCount(branch, day.strftime("%A"), count)
+        self._daily[(branch, day)] = int(count)
+
+
+    def addBranchMetrics(self, branch, duration=None, **counts):
+        """ Adds one run's counts (records, bibs, cache_hits, ...) and duration in seconds to branch's totals. """
+
+        self._runs[branch] = self._runs.get(branch, 0) + 1
+
+        metrics = self._metrics.setdefault(branch, {})
+        for name, count in counts.iteritems():
+            metrics[name] = metrics.get(name, 0) + count
+
+        if duration is not None:
+            self._durations[branch] = self._durations.get(branch, 0.0) + duration
+
+
+    def pending(self):
+        """ Returns the number of buffered commands. """
+
+        return len(self._counts) + 2 * len(self._daily) + sum([len(m) for m in self._metrics.itervalues()]) + len(self._durations) + 2 * len(self._runs)
+
+
+    def flush(self):
+        """ Sends everything buffered since the last flush in one pipeline. """
+
+        if not self.pending():
+            return
+
+        pipe = self._redis.pipeline(transaction=False)
+
+        if self._counts:
+            pipe.hmset(self._redis_key, self._counts)
+
+        for (branch, day), count in self._daily.iteritems():
+            pipe.hset(self._dailyKey(branch, _month(day)), "%02d" % (day.day), count)
+            pipe.hsetnx(self._indexKey(), branch, _month(day))
+
+        for branch, runs in self._runs.iteritems():
+            key = "%s:%s" % (self._redis_key, branch)
+            pipe.hincrby(key, "runs", runs)
+            for name, count in self._metrics.get(branch, {}).iteritems():
+                pipe.hincrby(key, name, count)
+            if branch in self._durations:
+                pipe.hincrbyfloat(key, "duration", self._durations[branch])
+            pipe.hset(key, "last_run", "%.0f" % (time()))
+
+        # oldest daily month of every branch just written, for downsampling
+        written = {}
+        for branch, day in self._daily:
+            written[branch] = min(written.get(branch, _month(day)), _month(day))
+        branches = written.keys()
+        if branches:
+            pipe.hmget(self._indexKey(), branches)
+
+        # clear first, a failed flush isn't retried with the next batch
+        self._counts, self._daily, self._metrics, self._durations, self._runs = {}, {}, {}, {}, {}
+
+        results = pipe.execute()
+
+        if branches:
+            self._downsample(dict(zip(branches, results[-1])), written)
+
+
+    def downsample(self, today=None):
+        """ Rolls up every branch's daily counts older than retention_days into monthly totals. """
+
+        self._downsample(self._redis.hgetall(self._indexKey()), {}, today)
+
+
+    def _downsample(self, oldest, written, today=None):
+        cutoff = _month((today or date.today()) - timedelta(days=self._retention_days))
+
+        due = []
+        backfilled = []
+        for branch, month in oldest.iteritems():
+            # counts written for days before the branch's oldest daily month
+            if branch in written and written[branch] < month:
+                month = written[branch]
+                backfilled.append((branch, month))
+
+            if month and month < cutoff:
+                due.append((branch, list(_iterMonths(month, cutoff))))
+
+        if not due and not backfilled:
+            return
+
+        results = iter([])
+        if due:
+            pipe = self._redis.pipeline(transaction=False)
+            for branch, months in due:
+                for month in months:
+                    pipe.hgetall(self._dailyKey(branch, month))
+            results = iter(pipe.execute())
+
+        pipe = self._redis.pipeline(transaction=False)
+        for branch, months in due:
+            for month in months:
+                counts = results.next()
+                if counts:
+                    pipe.hincrby(self._monthlyKey(branch), month, sum([int(c) for c in counts.itervalues()]))
+                    pipe.hincrby(self._monthlyKey(branch), "%s:days" % (month), len(counts))
+                    pipe.delete(self._dailyKey(branch, month))
+            pipe.hset(self._indexKey(), branch, cutoff)
+        for branch, month in backfilled:
+            if month >= cutoff:
+                pipe.hset(self._indexKey(), branch, month)
+        pipe.execute()
+
+
+    def branches(self):
+        """ Returns the branches with recorded daily counts. """
+
+        return sorted(self._redis.hgetall(self._indexKey()).keys())
+
+
+    def dailyCounts(self, branch, start, end):
+        """ Returns [(date, count)] for days from start to end (dates) with a list, not yet rolled up. """
+
+        months = list(_iterMonths(_month(start), _nextMonth(_month(end))))
+
+        pipe = self._redis.pipeline(transaction=False)
+        for month in months:
+            pipe.hgetall(self._dailyKey(branch, month))
+
+        counts = []
+        for month, fields in zip(months, pipe.execute()):
+            year, month = [int(i) for i in month.split("-")]
+            for day, count in fields.iteritems():
+                day = date(year, month, int(day))
+                if start <= day <= end:
+                    counts.append((day, int(count)))
+
+        return sorted(counts)
+
+
+    def monthlyCounts(self, branch, start, end):
+        """ Returns [("YYYY-MM", total, days with a list)] for months from start to end (dates), rolled up or not. """
+
+        months = list(_iterMonths(_month(start), _nextMonth(_month(end))))
+
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.hgetall(self._monthlyKey(branch))
+        for month in months:
+            pipe.hgetall(self._dailyKey(branch, month))
+        results = pipe.execute()
+
+        monthly = results[0]
+
+        counts = []
+        for month, fields in zip(months, results[1:]):
+            total = int(monthly.get(month, 0)) + sum([int(c) for c in fields.itervalues()])
+            days = int(monthly.get("%s:days" % (month), 0)) + len(fields)
+            if days:
+                counts.append((month, total, days))
+
+        return counts
+
+
+    def rollingAverage(self, branch, start, end, days=7):
+        """ Returns [(date, average)] for each day from start to end, averaging the lists in the days up to it.
+
+        Days without a list (closures) don't count towards the average.
+        """
+
+        counts = dict(self.dailyCounts(branch, start - timedelta(days=days - 1), end))
+
+        averages = []
+        window = []
+        for day in _iterDays(start - timedelta(days=days - 1), end):
+            window.append(counts.get(day))
+            window = window[-days:]
+
+            listed = [count for count in window if count is not None]
+            if day >= start and listed:
+                averages.append((day, float(sum(listed)) / len(listed)))
+
+        return averages
+
+
+    def peakDays(self, branch, start, end, n=5):
+        """ Returns the n busiest [(date, count)] from start to end. """
+
+        return sorted(self.dailyCounts(branch, start, end), key=lambda (day, count): (-count, day))[:n]
+
+
+    def peakWeekdays(self, branch, start, end):
+        """ Returns [(weekday name, average count)] from start to end, busiest first. """
+
+        weekdays = {}
+        for day, count in self.dailyCounts(branch, start, end):
+            weekdays.setdefault(day.strftime("%A"), []).append(count)
+
+        averages = [(weekday, float(sum(counts)) / len(counts)) for weekday, counts in weekdays.iteritems()]
+
+        return sorted(averages, key=lambda (weekday, average): -average)
+
+
+    def _indexKey(self):
+        return "%s:ts" % (self._redis_key)
+
+
+    def _dailyKey(self, branch, month):
+        return "%s:ts:%s:%s" % (self._redis_key, branch, month)
+
+
+    def _monthlyKey(self, branch):
+        return "%s:ts:%s:monthly" % (self._redis_key, branch)
+
+
+class MemoryRedis(object):
+    """ Local stand-in for the few redis.StrictRedis hash commands used here. """
+
+    def __init__(self):
+        self.data = {}
+        self.pipelines_executed = 0
+
+
+    def hset(self, key, field, value):
+        new = field not in self.data.setdefault(key, {})
+        self.data[key][field] = str(value)
+        return int(new)
+
+
+    def hmset(self, key, mapping):
+        for field, value in mapping.iteritems():
+            self.hset(key, field, value)
+        return True
+
+
+    def hsetnx(self, key, field, value):
+        if self.hget(key, field) is not None:
+            return 0
+        return self.hset(key, field, value)
+
+
+    def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+
+    def hmget(self, key, fields):
+        return [self.hget(key, field) for field in fields]
+
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+
+    def hincrby(self, key, field, amount=1):
+        value = int(self.hget(key, field) or 0) + amount
+        self.hset(key, field, value)
+        return value
+
+
+    def hincrbyfloat(self, key, field, amount=1.0):
+        value = float(self.hget(key, field) or 0) + amount
+        self.hset(key, field, repr(value))
+        return value
+
+
+    def delete(self, *keys):
+        return len([self.data.pop(key) for key in keys if key in self.data])
+
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+
+class MemoryPipeline(object):
+    """ Buffers MemoryRedis commands until execute(), like redis' pipelines. """
+
+    def __init__(self, backend):
+        self._backend = backend
+        self._commands = []
+
+
+    def __getattr__(self, name):
+        command = getattr(self._backend, name)
+
+        def buffer(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+
+        return buffer
+
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        self._backend.pipelines_executed += 1
 
+        return [command(*args, **kwargs) for command, args, kwargs in commands]
@@ -1,24 +1,39 @@
 #!/usr/bin/python
 
-"""Usage: squire [--csv [--output-file-csv=FILENAME]] [--xml [--output-file-xml=FILENAME]] --file=FILENAME
+"""Usage: squire [--csv [--output-file-csv=FILENAME]] [--xml [--output-file-xml=FILENAME]] [--concurrency=N] [--rate=N] [--no-cache] --file=FILENAME
+       squire --batch [--csv] [--xml] [--output-dir=DIR] [--concurrency=N] [--rate=N] [--no-cache] FILENAME...
 
 Processes Millennium Title Paging List into structured formats.
 
+--batch processes every FILENAME in one process, sharing the location matcher,
+WebPAC connections and cache.  Output is written to DIR (default: next to each
+list) as NAME.csv and NAME.xml, NAME being the list's filename without
+'.paginglist'.  Lists that would share an output name are refused.
+
+--rate limits WebPAC requests to N per second.
+
 Report bugs to <andrew.livesay@gmail.com>.
 """
 
+import os
 import sys
 import getopt
+import mmap
 import re
 import operator
 import csv
 import codecs
-from xml.dom.minidom import Document
-from cgi import escape
+from time import time
 from datetime import datetime
 
 from WebPACScraper import WebPACScraper
 
+from WebPACCache import WebPACCache
+
+from LocationMatcher import LocationMatcher
+
+from PagingListXML import PagingListXMLWriter
+
 from plc import PagingListStatistics
 
 ###############################################################################
@@ -31,6 +46,27 @@ CATALOG_HOSTNAME = "catalog.yourlibrary.org"
 # WebPAC server port
 CATALOG_PORT = 80
 
+# Max concurrent WebPAC requests while loading records
+WEBPAC_CONCURRENCY = 4
+
+# Retries for failed WebPAC requests
+WEBPAC_RETRIES = 2
+
+# Max WebPAC requests per second (None for no limit), squired sets each list's share of its budget
+WEBPAC_RATE = None
+
+# Title Paging List file extension, dropped from --batch output names
+PAGING_LIST_EXT = ".paginglist"
+
+# Cache of WebPAC item lookups shared by all squire runs (None to disable)
+WEBPAC_CACHE_FILE = "/var/lib/squired/webpac_cache.db"
+
+# How long cached item lookups stay fresh, in seconds
+WEBPAC_CACHE_TTL = 4 * 60 * 60
+
+# Max cached bibs, least recently used are evicted
+WEBPAC_CACHE_MAX_ENTRIES = 50000
+
 # Special location suffixes (e.g., 'New' in 'Central Media New')
 SPECIAL_LOCATION_SUFFIXES = ["New"]
 
@@ -55,7 +91,7 @@ INCLUDE_PICKUP_LOCATION_IN_CSV = False
 # Write UTF-8 byte order mark to CSV files?
 WRITE_BOM_TO_CSV = True
 
-# Redis
+# Redis, where weekly branch counts and run metrics are reported (None to disable)
 REDIS_SERVER = 'redis.yourlibrary.org'
 REDIS_PORT   = 6379
 REDIS_KEY    = 'plc'
@@ -81,22 +117,51 @@ class LineTypes:
     BLOCK_LINE_5  = 8 #[PICKUP_LOCATION if VOLUME is present]
     PAGE_MARK     = 9 #PAGE #
 
+# type of an indented, non-blank line following last_type
+INDENTED_LINE_TYPES = {LineTypes.BLOCK_LINE_1 : LineTypes.BLOCK_LINE_2,
+                       LineTypes.BLOCK_LINE_2 : LineTypes.BLOCK_LINE_3,
+                       LineTypes.BLOCK_LINE_3 : LineTypes.BLOCK_LINE_4,
+                       LineTypes.CAPTION      : LineTypes.TIMESTAMP,
+                       LineTypes.PAGE_MARK    : LineTypes.CAPTION}
+
+# type of an unindented line following last_type
+BLOCK_LINE_TYPES = {LineTypes.BLANK        : LineTypes.BLOCK_LINE_1,
+                    LineTypes.BLOCK_LINE_1 : LineTypes.BLOCK_LINE_2,
+                    LineTypes.BLOCK_LINE_2 : LineTypes.BLOCK_LINE_3,
+                    LineTypes.BLOCK_LINE_3 : LineTypes.BLOCK_LINE_4,
+                    LineTypes.BLOCK_LINE_4 : LineTypes.BLOCK_LINE_5}
+
+# a BLANK line after these ends a record block
+BLOCK_END_LINE_TYPES = (LineTypes.BLOCK_LINE_3, LineTypes.BLOCK_LINE_4, LineTypes.BLOCK_LINE_5)
+
+PAGE_MARK_REGEX    = re.compile(r"^Page\s\d+$")
+TITLE_AUTHOR_REGEX = re.compile(r"(^(.*)[\/])([^/]*$)")
+
 # GLOBAL - scraper
 scraper = None
 
-class RegexBorg:
-    """Borg for location regex."""
-    __shared_state   = {}
-    __sublocations   = []
-    __locations      = []
-    __location_regex = None
+# GLOBAL - item lookup cache
+cache = None
+
+# GLOBAL - counters for the last load_records call
+stats = {}
+
+# GLOBAL - redis statistics, flushed by close()
+statistics = None
+
+class LocationBorg:
+    """Borg for location matcher."""
+    __shared_state     = {}
+    __sublocations     = []
+    __locations        = []
+    __location_matcher = None
 
     def __init__(self):
         self.__dict__ = self.__shared_state
-        if not self.__location_regex:
+        if not self.__location_matcher:
             self.__load_locations(LOCATIONS_FILE)
             self.__load_sublocations(SUBLOCATIONS_FILE)
-            self.get_location_regex()
+            self.get_location_matcher()
         
     def __load_sublocations(self, filename):
         try:
@@ -118,179 +183,165 @@ class RegexBorg:
             sys.stderr.write("Error: __load_locations: unable to open file: %s\n" % (filename))
             sys.exit(1)
 
-    def get_location_regex(self):
-        """Generates an *insane* regex for matching all possible locations in BLOCK_LINE_1."""
+    def get_location_matcher(self):
+        """Builds matcher for all possible locations in BLOCK_LINE_1."""
 
         # return cached value if available
-        if self.__location_regex:
-            return self.__location_regex
-
-        # special prefix matching required for location names containing spaces
-        prefixes = [re.escape(loc) for loc in self.__locations if loc.find(" ") != -1]
-        prefixes.extend([r"\w+"])
-
-        suffixes = SPECIAL_LOCATION_SUFFIXES
+        if self.__location_matcher:
+            return self.__location_matcher
 
-        # start of regex 
-        rtv = r"("
-        
-        v = []
-        # WARNING: O(N^2)
-        for prefix in prefixes:
-            v.extend([(r"%s\ %s" % (prefix, re.escape(loc))) for loc in self.__sublocations])
-            for suffix in suffixes:
-                v.extend([(r"%s\ %s\ %s" % (prefix, re.escape(loc), suffix)) for loc in self.__sublocations])
-        
-        # add final branch selectors
-        for prefix in prefixes:
-            v.append(r"%s" % (prefix))
-            for suffix in suffixes:
-                v.append(r"%s\ %s" % (prefix, suffix))
+        self.__location_matcher = LocationMatcher(self.__locations, self.__sublocations, SPECIAL_LOCATION_SUFFIXES)
 
-        # sort by length
-        v.sort(key=len, reverse=True)
-
-        rtv += '|'.join(v)
-
-        # end of regex
-        rtv += r")"
-        
-        # cache value
-        self.__location_regex = rtv
-        
-        return rtv
+        return self.__location_matcher
 
 
 def load_records(filename, location_filter=None):
     """Loads title paging list text file."""
 
     records = {}
-    last_type = LineTypes.INVALID
-    regex_borg = RegexBorg()
-    block_range = range(LineTypes.BLOCK_LINE_1, LineTypes.BLOCK_LINE_5 + 1)
+    location_borg = LocationBorg()
+
+    stats["started_at"] = time()
+    stats["blocks"] = 0
+    stats["lookups_saved"] = 0
+    stats["location"] = None
 
     global scraper
-    scraper = WebPACScraper(CATALOG_HOSTNAME, CATALOG_PORT)
+    if not scraper:
+        scraper = WebPACScraper(CATALOG_HOSTNAME, CATALOG_PORT, WEBPAC_CONCURRENCY, WEBPAC_RETRIES, cache, WEBPAC_RATE)
  
     try:
         file = open(filename)
 
+        map = None
+
         try:
+            # map the list instead of buffering reads
+            try:
+                map = mmap.mmap(file.fileno(), 0, prot=mmap.PROT_READ)
+                lines = iter(map.readline, "")
+            except ValueError:
+                # empty file
+                lines = []
 
-            # skip initial blank lines, find "Title Paging List"
-            while 1:
-                raw_line = file.readline()
+            for record in iter_records(lines, location_borg.get_location_matcher()):
+                stats["blocks"] += 1
 
-                if not raw_line:
-                    sys.stderr.write("Error: file does not appear to be a Title Paging List: %s\n" % (filename))
-                    sys.exit(1)
+                # update count on duplicates, only one lookup per bib is needed...
+                if record["bib_number"] in records:
+                    records[record["bib_number"]]["requested_count"] += 1
+                    stats["lookups_saved"] += 1
 
-                if not raw_line.strip() == "" and raw_line.strip() == "Title Paging List":
-                    break
+                # or add new records
+                else:
+                    record["requested_count"] = 1
+                    records[record["bib_number"]] = record
 
-            # first line is CAPTION
-            line_type = LineTypes.CAPTION
+        finally:
+            if map:
+                map.close()
+            file.close()
 
-            record = {}
+    except (IOError, mmap.error), e:
+        sys.stderr.write("Error: load_records: %s\n" % (e))
+        sys.exit(1)
 
-            while 1:
-                raw_line = file.readline()
-                if not raw_line:
-                    break
+    except ValueError, e:
+        sys.stderr.write("Error: load_records: %s [%s]\n" % (e, filename))
+        sys.exit(1)
 
-                line_type = get_line_type(raw_line, line_type)
+    # look up items for every unique bib at once
+    hits, misses = cache and (cache.hits, cache.misses) or (0, 0)
+    items = scraper.get_items_for_bibs(records.keys())
+    stats["cache_hits"], stats["cache_misses"] = cache and (cache.hits - hits, cache.misses - misses) or (0, 0)
 
-                if line_type == LineTypes.INVALID:
-                    # TODO: try to recover by skipping to next records block
-                    raise ValueError("load_records: invalid line: %s" % (raw_line))
+    for record in records.itervalues():
+        # set record flags
+        set_record_flags(record, record["location"], scraper, items.get(record["bib_number"]))
 
-                if line_type in block_range:
-                    parse_record_line(record, raw_line, line_type, regex_borg.get_location_regex())
+    return records
 
-                # done with the block, so add it to records
-                if line_type == LineTypes.BLANK and \
-                   (last_type == LineTypes.BLOCK_LINE_3 or last_type == LineTypes.BLOCK_LINE_4 or last_type == LineTypes.BLOCK_LINE_5):
 
-                    if last_type == LineTypes.BLOCK_LINE_3:
+def iter_records(lines, location_matcher=None):
+    """Yields record blocks parsed from the lines of a Title Paging List.
 
-                        record["pickup_location"] = record["publishing"]
-                        record["publishing"] = str(None)
+    lines may be an open file, any iterable of lines (e.g. iter(mmap.readline, ""))
+    or the whole list as a string.  Blocks for duplicate bibs are yielded separately.
+    """
 
-                    # set record flags
-                    set_record_flags(record, record["location"], scraper)
+    if isinstance(lines, basestring):
+        lines = lines.splitlines(True)
 
-                    # update count on duplicates...
-                    if not record["bib_number"] in records:
-                        record["requested_count"] = 1
-                        records[record["bib_number"]] = record
+    if not location_matcher:
+        location_matcher = LocationBorg().get_location_matcher()
 
-                    # or add new records
-                    else:
-                        records[record["bib_number"]]["requested_count"] += 1
+    lines = iter(lines)
 
-                    # clear current record
-                    record = {}
+    # skip initial blank lines, find "Title Paging List"
+    for raw_line in lines:
+        if raw_line.strip() == "Title Paging List":
+            break
+    else:
+        raise ValueError("file does not appear to be a Title Paging List")
 
-                # save line_type
-                last_type = line_type
+    # first line is CAPTION
+    last_type = LineTypes.CAPTION
 
-        finally:
-            file.close()
+    record = {}
 
-    except IOError, e:
-        sys.stderr.write("Error: load_records: %s\n" % (e))
-        sys.exit(1)
+    for raw_line in lines:
+        line_type = get_line_type(raw_line, last_type)
 
-    return records
+        if line_type == LineTypes.INVALID:
+            # TODO: try to recover by skipping to next records block
+            raise ValueError("invalid line: %s" % (raw_line))
+
+        if line_type >= LineTypes.BLOCK_LINE_1 and line_type <= LineTypes.BLOCK_LINE_5:
+            parse_record_line(record, raw_line, line_type, location_matcher)
+
+        # done with the block
+        elif line_type == LineTypes.BLANK and last_type in BLOCK_END_LINE_TYPES:
+
+            if last_type == LineTypes.BLOCK_LINE_3:
+
+                record["pickup_location"] = record["publishing"]
+                record["publishing"] = str(None)
+
+            yield record
+
+            # clear current record
+            record = {}
+
+        # save line_type
+        last_type = line_type
 
 
 def get_line_type(line=None, last_type=LineTypes.INVALID):
     """Attempts to determine parsed line type."""
-    # determine raw_line type
-    if line:
+
+    if not line:
+        raise ValueError("get_line_type: line == None")
+
     # does it start with white space?
-        if re.findall(r"^\s+", line):
+    if line[0].isspace():
         # BLANK, CAPTION, or TIMESTAMP?
-            if not line.strip():
-                if last_type == LineTypes.BLOCK_LINE_2:
-                    return LineTypes.BLOCK_LINE_3
-                else:
-                    return LineTypes.BLANK
-            elif last_type == LineTypes.BLOCK_LINE_1:
-                return LineTypes.BLOCK_LINE_2
-            elif last_type == LineTypes.BLOCK_LINE_2:
+        if not line.strip():
+            if last_type == LineTypes.BLOCK_LINE_2:
                 return LineTypes.BLOCK_LINE_3
-            elif last_type == LineTypes.BLOCK_LINE_3:
-                return LineTypes.BLOCK_LINE_4
-            elif last_type == LineTypes.CAPTION:
-                return LineTypes.TIMESTAMP
-            elif last_type == LineTypes.PAGE_MARK:
-                return LineTypes.CAPTION
             else:
-                return LineTypes.INVALID
+                return LineTypes.BLANK
 
-        # PAGE_MARK or a BLOCK_LINE?
-        elif re.findall(r"^\Page\s\d+$", line):
-            return LineTypes.PAGE_MARK
-        else:
-            # must be a record block, but which line?
-            if last_type == LineTypes.BLANK:
-                return LineTypes.BLOCK_LINE_1
-            elif last_type == LineTypes.BLOCK_LINE_1:
-                return LineTypes.BLOCK_LINE_2
-            elif last_type == LineTypes.BLOCK_LINE_2:
-                return LineTypes.BLOCK_LINE_3
-            elif last_type == LineTypes.BLOCK_LINE_3:
-                return LineTypes.BLOCK_LINE_4
-            elif last_type == LineTypes.BLOCK_LINE_4:
-                return LineTypes.BLOCK_LINE_5
-            else:
-                return LineTypes.INVALID
-    else:
-        raise ValueError("get_line_type: line == None")
+        return INDENTED_LINE_TYPES.get(last_type, LineTypes.INVALID)
+
+    # PAGE_MARK or a BLOCK_LINE?
+    if PAGE_MARK_REGEX.match(line):
+        return LineTypes.PAGE_MARK
 
+    # must be a record block, but which line?
+    return BLOCK_LINE_TYPES.get(last_type, LineTypes.INVALID)
 
-def parse_record_line(record=None, line=None, line_type=LineTypes.INVALID, location_regex=None):
+
+def parse_record_line(record=None, line=None, line_type=LineTypes.INVALID, location_matcher=None):
     """Parse values from record line."""
 
     if not line:
@@ -300,19 +351,18 @@ def parse_record_line(record=None, line=None, line_type=LineTypes.INVALID, locat
 
     # BLOCK_LINE_1
     if line_type == LineTypes.BLOCK_LINE_1:
-        # get location
-        m = re.search("^%s(.*?)([\\s\\.]b\\d+.$)" % (location_regex or r"(\w+)"), line)
-        try:
-            record["location"]    = m.group(1)
-            record["call_number"] = str(m.group(2)).strip()
-            record["bib_number"]  = m.group(3)
-
-            # remove check digit and leading '.'
-            record["bib_number"] = record["bib_number"][1:-1]
-        except IndexError:
-            sys.stderr.write("Error: parse_record_line: regex group out of bounds parsing BLOCK_LINE_1: %s\n" % (line))
+        if not location_matcher:
+            location_matcher = LocationBorg().get_location_matcher()
+
+        # get location, call number and bib number
+        m = location_matcher.match(line)
+
+        if not m:
+            sys.stderr.write("Error: parse_record_line: no location match parsing BLOCK_LINE_1: %s\n" % (line))
             sys.exit(1)
 
+        record["location"], record["call_number"], record["bib_number"] = m
+
         if not record["location"]:
             record["location"] = "ERROR"
 
@@ -330,7 +380,7 @@ def parse_record_line(record=None, line=None, line_type=LineTypes.INVALID, locat
     elif line_type == LineTypes.BLOCK_LINE_2:
         # try line as TITLE/AUTHOR...
         try:
-            m = re.search(r"(^(.*)[\/])([^/]*$)", line)
+            m = TITLE_AUTHOR_REGEX.search(line)
 
             if not m:
                 raise ValueError("parse_record_line: BLOCK_LINE_2 regex failed: %s" % (line))
@@ -379,8 +429,8 @@ def parse_record_line(record=None, line=None, line_type=LineTypes.INVALID, locat
         raise ValueError("parse_record_line: not a record block line: %d" % (line_type))
 
 
-def set_record_flags(record, location_filter=None, scraper=None):
-    """Sets flags for record."""
+def set_record_flags(record, location_filter=None, scraper=None, items=None):
+    """Sets flags for record, using items from get_items_for_bibs if given."""
 
     flags = set() 
 
@@ -397,7 +447,12 @@ def set_record_flags(record, location_filter=None, scraper=None):
         record["available_count"] = 0
 
     try:
-        items = scraper.get_items_for_bib(record["bib_number"])
+        if items is None:
+            items = scraper.get_items_for_bib(record["bib_number"])
+
+        # failed get_items_for_bibs lookup
+        if isinstance(items, Exception):
+            raise items
 
         for item in items:
             loc = item["location"].upper()
@@ -553,22 +608,28 @@ def records_to_xml(records, filename=None):
 
     search_baseurl = "http://%s:%s/search~S%s/,?" % (CATALOG_HOSTNAME, `CATALOG_PORT`, search_id)
 
-    doc = Document()
-    root_node = doc.createElement("paging_list")
-    root_node.setAttribute("location", location)
-    root_node.setAttribute("timestamp", str(datetime.now()))
-    root_node.setAttribute("search_id", search_id)
-    root_node.setAttribute("count", str(len(records)))
-    root_node.setAttribute("search_baseurl", search_baseurl)
-    doc.appendChild(root_node)
+    attrs = {"location"       : location,
+             "timestamp"      : str(datetime.now()),
+             "search_id"      : search_id,
+             "count"          : str(len(records)),
+             "search_baseurl" : search_baseurl}
 
-    for row in sorted(sorted(sorted(data, key=operator.itemgetter("call_number")), key=operator.itemgetter("location")), key=operator.itemgetter("flags")):
-        record_to_xml(doc, root_node, row)
+    rows = sorted(sorted(sorted(data, key=operator.itemgetter("call_number")), key=operator.itemgetter("location")), key=operator.itemgetter("flags"))
 
     if filename:
         try:
             file = open(filename, "w")
-            doc.writexml(file)
+
+        except IOError:
+            sys.stderr.write("Error: records_to_xml: unable to write to file: %s\n" % (filename))
+            sys.exit(1)
+
+        try:
+            # stream records straight to file
+            writer = PagingListXMLWriter(file, attrs)
+            for row in rows:
+                writer.write_record(row)
+            writer.close()
 
         except:
             sys.stderr.write("Error: records_to_xml: unable to write to file: %s\n" % (filename))
@@ -578,44 +639,133 @@ def records_to_xml(records, filename=None):
             file.close()
 
     else:
-        print doc.toprettyxml(indent="   ")
+        writer = PagingListXMLWriter(sys.stdout, attrs, indent="   ")
+        for row in rows:
+            writer.write_record(row)
+        writer.close()
         
-    # log to redis
-    try:
-        plc = PagingListStatistics(REDIS_SERVER, REDIS_PORT, REDIS_KEY)
-        plc.setBranchCount(location, datetime.now().strftime('%A'), str(len(records)))
-    except Exception, e:
-        sys.stderr.write('Error: redis:updateBranchCount failed: %s' % str(e))
+    # log to redis, sent by close()
+    stats["location"] = location
+    if open_statistics():
+        statistics.recordBranchCount(location, datetime.now().date(), len(records))
+
 
+def open_cache():
+    """Opens the shared item lookup cache, if configured."""
 
+    global cache
 
-def record_to_xml(doc, parent, record):
-    """Adds <record /> node."""
+    if WEBPAC_CACHE_FILE and not cache:
+        try:
+            cache = WebPACCache(WEBPAC_CACHE_FILE, WEBPAC_CACHE_TTL, WEBPAC_CACHE_MAX_ENTRIES)
+        except Exception, e:
+            sys.stderr.write("Error: unable to open cache, continuing without it: %s [%s]\n" % (e, WEBPAC_CACHE_FILE))
 
-    elem = doc.createElement("record")
+    return cache
 
- 
-    for key in record:
-        v = escape(str(record[key]).strip())
-        v = v.replace("'", "&#39;")
-        v = v.replace('"', "&quot;")
 
-        v = v.replace(",", "&#44;")
+def open_statistics(backend=None):
+    """Opens the shared redis statistics writer, backend as for PagingListStatistics."""
+
+    global statistics
+
+    if REDIS_SERVER and not statistics:
+        try:
+            statistics = PagingListStatistics(REDIS_SERVER, REDIS_PORT, REDIS_KEY, backend)
+        except Exception, e:
+            sys.stderr.write("Error: redis: unable to open statistics: %s\n" % (e))
+
+    return statistics
+
+
+def flush_statistics():
+    """Sends buffered statistics to redis in one pipeline."""
+
+    if statistics:
+        try:
+            statistics.flush()
+        except Exception, e:
+            sys.stderr.write("Error: redis: statistics flush failed: %s\n" % (e))
+
+
+def close():
+    """Stops the shared scraper, flushes statistics and closes the cache."""
+
+    global scraper, cache
+
+    if scraper:
+        scraper.close()
+        scraper = None
+
+    flush_statistics()
+
+    if cache:
+        sys.stderr.write("WebPAC cache: %d hits, %d misses\n" % (cache.hits, cache.misses))
+        cache.close()
+        cache = None
+
+
+def report_stats(filename, records):
+    sys.stderr.write("Records: %d blocks, %d bibs, %d duplicate lookups saved [%s]\n" % (stats["blocks"], len(records), stats["lookups_saved"], filename))
 
-        e = doc.createElement(key)
-        t = doc.createTextNode(v)
+    if stats["location"] and statistics:
+        statistics.addBranchMetrics(stats["location"],
+                                    duration=time() - stats["started_at"],
+                                    records=stats["blocks"],
+                                    bibs=len(records),
+                                    lookups_saved=stats["lookups_saved"],
+                                    cache_hits=stats["cache_hits"],
+                                    cache_misses=stats["cache_misses"])
+
+
+def process_title_list(filename, csv_filename=None, xml_filename=None):
+    """Processes one Title Paging List into CSV and/or XML files.
+
+    The location matcher, scraper and cache are shared by every call, so a
+    library caller can process many lists in one warm process.
+    """
+
+    records = load_records(filename)
+
+    if xml_filename:
+        records_to_xml(records, xml_filename)
+
+    if csv_filename:
+        records_to_csv(records, csv_filename)
+
+    report_stats(filename, records)
+
+    return records
 
-        e.appendChild(t)
-        elem.appendChild(e)
 
-    parent.appendChild(elem)
+def process_title_lists(jobs):
+    """Processes (filename, csv_filename, xml_filename) jobs, returns filenames that failed."""
+
+    failed = []
+
+    for filename, csv_filename, xml_filename in jobs:
+        try:
+            process_title_list(filename, csv_filename, xml_filename)
+
+        except SystemExit:
+            failed.append(filename)
+
+        except Exception, e:
+            sys.stderr.write("Error: process_title_lists: %s [%s]\n" % (e, filename))
+            failed.append(filename)
+
+    return failed
 
 
 def main(argv=None):
+    global WEBPAC_CONCURRENCY, WEBPAC_RATE, WEBPAC_CACHE_FILE
+
     progopts = {"csv" : False,
                 "output-file-csv" : None,
                 "xml" : False,
                 "output-file-xml" : None,
+                "batch" : False,
+                "output-dir" : None,
                 "file" : None}
    
     try:
@@ -624,6 +774,11 @@ def main(argv=None):
                                                                    "csv",
                                                                    'output-file-csv=',
                                                                    'output-file-xml=',
+                                                                   'batch',
+                                                                   'output-dir=',
+                                                                   'concurrency=',
+                                                                   'rate=',
+                                                                   'no-cache',
                                                                    'version',
                                                                    'help',
                                                                    'usage'])
@@ -632,11 +787,6 @@ def main(argv=None):
         sys.stderr.write(__doc__)
         sys.exit(1)
 
-    if remainder:
-        sys.stderr.write("Error: invalid options: %s\n\n" % (", ".join(remainder)))
-        sys.stderr.write(__doc__)
-        sys.exit(1)
-
     for opt, arg in options:
         if opt in ("--version"):
             print "squire v%s, by %s<%s>\n" % (__version__, __author__, __email__)
@@ -654,17 +804,75 @@ def main(argv=None):
             progopts["output-file-xml"] = arg
         elif opt in ("--file"):
             progopts["file"] = arg
+        elif opt in ("--batch"):
+            progopts["batch"] = True
+        elif opt in ("--output-dir"):
+            progopts["output-dir"] = arg
+        elif opt in ("--concurrency"):
+            try:
+                WEBPAC_CONCURRENCY = int(arg)
+            except ValueError:
+                sys.stderr.write("Error: invalid concurrency: %s\n" % (arg))
+                sys.exit(1)
+        elif opt in ("--rate"):
+            try:
+                WEBPAC_RATE = float(arg)
+            except ValueError:
+                sys.stderr.write("Error: invalid rate: %s\n" % (arg))
+                sys.exit(1)
+        elif opt in ("--no-cache"):
+            WEBPAC_CACHE_FILE = None
+
+    if remainder and not progopts["batch"]:
+        sys.stderr.write("Error: invalid options: %s\n\n" % (", ".join(remainder)))
+        sys.stderr.write(__doc__)
+        sys.exit(1)
    
     if not progopts["csv"] and not progopts["xml"]:
         sys.stderr.write("Error: no output mode selected (use '--csv' or '--xml')\n")
         sys.stderr.write(__doc__)
         sys.exit(1)
 
+    if progopts["batch"]:
+        if not remainder:
+            sys.stderr.write("Error: no input files specified\n")
+            sys.stderr.write(__doc__)
+            sys.exit(1)
+
+        jobs = []
+        names = {}
+        for filename in remainder:
+            output_dir = progopts["output-dir"] or os.path.dirname(filename)
+            name = os.path.join(output_dir, os.path.basename(filename).replace(PAGING_LIST_EXT, "", 1))
+
+            # e.g. the same branch's lists from two days, or two dirs into one --output-dir
+            if name in names:
+                sys.stderr.write("Error: %s and %s would both be written to %s.*\n" % (names[name], filename, name))
+                sys.exit(1)
+            names[name] = filename
+
+            jobs.append((filename,
+                         progopts["csv"] and "%s.csv" % (name) or None,
+                         progopts["xml"] and "%s.xml" % (name) or None))
+
+        open_cache()
+        failed = process_title_lists(jobs)
+        close()
+
+        if failed:
+            sys.stderr.write("Error: %d of %d lists failed: %s\n" % (len(failed), len(jobs), ", ".join(failed)))
+            sys.exit(1)
+
+        return
+
     if not progopts["file"]:
         sys.stderr.write("Error: no input file specified (use '--file=[FILENAME]')\n")
         sys.stderr.write(__doc__)
         sys.exit(1)
 
+    # open item lookup cache
+    open_cache()
+
     # start processing records
     records = load_records(progopts["file"])
 
@@ -676,6 +884,10 @@ def main(argv=None):
         # CSV output
         records_to_csv(records, progopts["output-file-csv"])
 
+    report_stats(progopts["file"], records)
+
+    close()
+
 
 if __name__ == "__main__":
     main()
@@ -2,30 +2,33 @@
 
 import os
 import sys
+import imp
+import re
 import errno
+import stat
 import logging
 import csv
-import smtplib
 import codecs
 import operator
 import mmap
-import re
-from signal import SIGINT,SIGTERM
+import thread
+import threading
+import Queue
+import multiprocessing
+import select
+import fcntl
+import signal
+from cStringIO import StringIO
+from signal import SIGINT,SIGTERM,SIGCHLD,SIGUSR1
 from time import sleep,time
 from subprocess import Popen, PIPE
 from shutil import move
 from grp import getgrnam
 from pwd import getpwnam
-from datetime import datetime
+from datetime import datetime, timedelta
 from subprocess import Popen
-from email import encoders
-from email.MIMEBase import MIMEBase
-from email.MIMEText import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email import Encoders
+from multiprocessing.util import Finalize
 from email import Charset
-from xml.dom.minidom import Document
-from cgi import escape
 
 # http://pypi.python.org/pypi/python-daemon/1.5.5 (PEP 3143 reference)
 # NOTE: requires patches/python-daemon-1.5.5_lockfile_0.9.1_fix.patch
@@ -38,6 +41,30 @@ from lockfile import LockTimeout
 # src/squiredmodule.c extension
 import squired
 
+from PagingListXML import PagingListXMLWriter
+from ItemPagingList import iter_items
+from PagingListJobs import JobTable, JobStates
+from PagingListScheduler import PagingListScheduler
+from PagingListIndex import PagingListIndex
+from ArchiveStore import ArchiveStore
+from MailQueue import MailQueue
+from MultipartWriter import MultipartWriter
+
+# http://lxml.de (optional) renders HTML in-process instead of running XSLTPROC_CMD
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# SQUIRE_CMD imported by load_squire(), for title list workers
+squire = None
+
+# pool workers report the tasks they start here, see WorkerTasks
+worker_task_fd = None
+
+# running title lists' share of WEBPAC_REQUEST_BUDGET, 0 for no limit, shared with title list workers
+title_list_rate = None
+
 
 ################################################################################
 # config
@@ -53,10 +80,15 @@ DIR_RUN     = "/var/run/squired"
 
 DIR_OUTPUT  = os.path.join(DIR_VAR, "output")  # where CSV & XML files are saved
 DIR_ARCHIVE = os.path.join(DIR_VAR, "archive") # where paging lists are archived
+DIR_SPOOL   = os.path.join(DIR_VAR, "spool")   # where outgoing mail waits for SMTP_SERVER
+DIR_INDEX   = os.path.join(DIR_VAR, "index")   # where each branch's manifest of published lists is kept
+DIR_STORE   = os.path.join(DIR_VAR, "store")   # where old lists are kept compressed, see ARCHIVE_COMPRESS_AGE
 
 SQUIRE_CMD   = "/opt/squired/squire.py"
 XSLTPROC_CMD = "/usr/bin/xsltproc"
 
+XSLT_IN_PROCESS = True  # render with lxml when available, otherwise XSLTPROC_CMD
+
 LOG_FILE    = os.path.join(DIR_LOG, "squired.log")
 LOG_LEVEL   = logging.INFO
 LOG_FORMAT  = "%(asctime)s %(levelname)s (%(funcName)s:%(lineno)d) %(message)s"
@@ -66,6 +98,12 @@ SEND_EMAIL_AS = "squired@catalog.yourlibrary.org"
 SMTP_SERVER = "localhost"
 SMTP_PORT   = 25
 
+SMTP_RETRY_DELAY     = 30  # in seconds, doubled after each failed delivery up to SMTP_RETRY_MAX_DELAY
+SMTP_RETRY_MAX_DELAY = 900
+SMTP_IDLE_TIMEOUT    = 60  # in seconds, how long to keep the SMTP session open for more mail
+
+EMAIL_GZIP_HTML_SIZE = 1024 * 1024  # in bytes, HTML attachments larger than this are sent gzipped
+
 LOCATION_EMAILS_FILE  = os.path.join(DIR_CONFIG, "locationemails.cfg")
 SQUIRE_T_2XHTML_XSL_FILE = os.path.join(DIR_CONFIG, "squiret2xhtml.xsl")
 SQUIRE_I_2XHTML_XSL_FILE = os.path.join(DIR_CONFIG, "squirei2xhtml.xsl")
@@ -86,7 +124,7 @@ DAEMON_UMASK        = 0o002
 # DANGER!!!!!!!!!!!!!!!!!!!
 #
 # WARNING: squired.py will automatically move any files with names ending with
-# PAGING_LIST_EXT from DIR_DROPBOX into DIR_ARCHIVE.  At this time, Millennium's
+# PAGING_LIST_EXT from DIR_DROPBOXES into DIR_ARCHIVE.  At this time, Millennium's
 # Auto Notice "FTS file save" will save files to '/iiidb/circ/autonotices'.
 #
 # It is recommended you leave these settings alone, and configure all jobs to
@@ -96,9 +134,14 @@ DAEMON_UMASK        = 0o002
 #
 
 DIR_DROPBOX     = "/iiidb/circ/autonotices" # where paging lists appear
+DIR_DROPBOXES   = [DIR_DROPBOX]   # all watched directories, e.g. add per-server FTS dumps, manual uploads
 PAGING_LIST_EXT = ".paginglist"   # file extension used for FTS notices
 ITEM_LIST_EXT   = ".itemlist" 
-IGNORE_DOTFILES = True            # ignore dotfiles in DIR_DROPBOX
+IGNORE_DOTFILES = True            # ignore dotfiles in DIR_DROPBOXES
+
+DROPBOX_SETTLE_TIME = 30          # in seconds, files changed more recently are left out of rescans
+DROPBOX_RESCAN_INTERVAL = 15 * 60 # in seconds, between rescans for lists whose events were lost, None to only rescan at startup
+DROPBOX_CATCHUP_DAYS = 1          # lists dated this many days back are still processed, e.g. after squired was down overnight
 
 TIMESTAMP_FORMAT = "%Y-%m-%d"     # add h,m,s if running multiple times per day
 TIMESTAMP_ACTIVE = True
@@ -112,6 +155,26 @@ NO_TITLE_HTML_FILENAME = os.path.join(LISTS_DIR, "no_title_list.html")
 NO_TITLE_RAW_FILENAME  = os.path.join(LISTS_DIR, "no_title_list.txt")
 
 ITEM_LIST_TIMEOUT = 900          # in seconds, how long to wait for item lists
+ITEM_LIST_TTL     = 86400        # in seconds, how long to keep item lists without a title list
+EARLY_PUBLISH     = True         # publish title lists without waiting for item lists, email once both are in
+
+POST_PROCESSING_WORKERS = 4      # max branches rendered/emailed at once
+ITEM_LIST_WORKERS       = 2      # max item lists parsed at once, in worker processes
+TITLE_LIST_MAX_JOBS     = 4      # max title lists processed at once across all branches, smallest lists first
+TITLE_LIST_WORKERS      = True   # process title lists in warm workers with SQUIRE_CMD imported, False runs SQUIRE_CMD per list
+TITLE_LIST_WORKER_JOBS  = 50     # lists a title list worker processes before it's replaced, bounds its memory
+LOST_TASK_CHECK_INTERVAL = 5    # in seconds, how often workers busy with a list are checked for having died
+WEBPAC_REQUEST_BUDGET   = 40     # WebPAC requests per second for all title lists together, split evenly between running lists (None for no limit)
+TITLE_LIST_RATE_CHECK_INTERVAL = 1  # in seconds, how often title list workers pick up their current share of WEBPAC_REQUEST_BUDGET
+
+INDEX_RUNS = 30                  # runs listed (and linked) in each branch's index.html
+
+ARCHIVE_COMPRESS_AGE    = 7 * 86400    # in seconds, DIR_ARCHIVE and DIR_OUTPUT files older than this move to DIR_STORE
+ARCHIVE_RETENTION       = 365 * 86400  # in seconds, how long DIR_STORE keeps them (None keeps them forever)
+ARCHIVE_ROTATE_INTERVAL = 86400        # in seconds, how often the above is done
+
+# the branch web directory links publish_title/publish_items keep current
+LATEST_LINKS = ("latest_title.html", "latest_title_raw.txt", "latest_item.html", "latest_item_raw.txt")
 
 ################################################################################
 
@@ -131,7 +194,7 @@ class ListTypes:
             return "INVALID"
 
 class INotify:
-    """Linux kernel inotify API wrapper"""
+    """Linux kernel inotify API wrapper, watching any number of paths"""
 
     # inotify_event masks
     IN_ACCESS        = 0x00000001 # File was accessed
@@ -146,29 +209,285 @@ class INotify:
     IN_DELETE        = 0x00000200 # Subfile was deleted
     IN_DELETE_SELF   = 0x00000400 # Self was deleted
     IN_MOVE_SELF     = 0x00000800 # Self was moved
+    IN_Q_OVERFLOW    = 0x00004000 # Event queue overflowed, events were lost
+    IN_IGNORED       = 0x00008000 # Watch was removed
 
-    __wd    = None
-    __procs = None
+    __inotify = None
 
 
-    def __init__(self, path, opts):
-        squired.inotify_init()
-        self.__wd = squired.add_watch(path, opts)
-        if self.__wd < 0:
-            sys.stderr.write("Error: inotify_add_watch failed for '%s' [%s]\n" % (path, errno.errorcode[squired.errno()]))
-            sys.exit(1)
+    def __init__(self, paths, opts):
+        self.__inotify = squired.Inotify()
+
+        for path in paths:
+            try:
+                self.__inotify.add_watch(path, opts)
+            except OSError, e:
+                sys.stderr.write("Error: inotify_add_watch failed for '%s' [%s]\n" % (path, errno.errorcode[e.errno]))
+                sys.exit(1)
 
 
     def __del__(self):
-        if self.__wd is not None:
-            squired.rm_watch(self.__wd)
-            squired.shutdown()
+        if self.__inotify is not None:
+            self.__inotify.close()
+
+
+    def fileno(self):
+        """inotify fd, readable when events are pending."""
+
+        return self.__inotify.fileno()
+
+
+    def read_events(self):
+        """Returns pending events as a list of squired.event (wd, mask, cookie, name, path), without blocking."""
+
+        return self.__inotify.read_events()
+
+
+    def watches(self):
+        """Returns {wd : path} of the paths still watched."""
+
+        return self.__inotify.watches()
+
+
+class XSLTRenderer:
+    """Renders paging list XML to HTML with a stylesheet compiled once."""
+
+    def __init__(self, xsl_filename, in_process=XSLT_IN_PROCESS):
+        self.__xsl_filename = xsl_filename
+        self.__transform = None
+        self.__lock = threading.Lock()
+
+        if etree is not None and in_process:
+            self.__transform = etree.XSLT(etree.parse(xsl_filename))
+
+
+    def render(self, html_filename, xml_filename, xml_data=None):
+        """Writes HTML for xml_data if given, otherwise for xml_filename."""
+
+        if self.__transform is None:
+            # blocking is probably okay here...maybe...
+            p = Popen("%s -o %s %s %s" % (XSLTPROC_CMD, html_filename, self.__xsl_filename, xml_filename), shell=True)
+
+            # the daemon's signal handlers can interrupt the wait, on this thread too
+            while 1:
+                try:
+                    return os.waitpid(p.pid, 0)[1]
+                except OSError, e:
+                    if e.errno != errno.EINTR:
+                        raise
+
+        if xml_data is not None:
+            doc = etree.fromstring(xml_data)
+        else:
+            doc = etree.parse(xml_filename)
+
+        # one transform at a time per stylesheet
+        self.__lock.acquire()
+        try:
+            html = str(self.__transform(doc))
+        finally:
+            self.__lock.release()
+
+        html_file = open(html_filename, "wb")
+        try:
+            html_file.write(html)
+        finally:
+            html_file.close()
+
+        return 0
+
+
+class PostProcessingPool:
+    """Runs post processing jobs on worker threads so the daemon loop only dispatches."""
+
+    def __init__(self, workers, logger, wakeup=None):
+        self.__logger = logger
+        self.__wakeup = wakeup
+        self.__jobs = Queue.Queue()
+        self.__done = Queue.Queue()
+        self.__workers = []
+
+        for i in range(workers):
+            worker = threading.Thread(target=self.__worker)
+            worker.setDaemon(True)
+            worker.start()
+            self.__workers.append(worker)
+
+
+    def __worker(self):
+        while 1:
+            job = self.__jobs.get()
+
+            if job is None:
+                break
+
+            name, func, args, callback, queued_at = job
+            started_at = time()
+
+            try:
+                result = func(*args)
+                error = None
+            except Exception, e:
+                result = None
+                error = e
+
+            self.__done.put((name, callback, result, error, queued_at, started_at, time()))
+
+            # let the daemon loop know there's a callback to run
+            if self.__wakeup:
+                self.__wakeup()
 
 
-    def get_events(self):
-        """Returns list of events if available, otherwise a message dict is returned."""
+    def submit(self, name, func, args=(), callback=None):
+        """Queues func(*args), callback(result, error) runs from run_callbacks once it's done."""
 
-        return squired.select()
+        self.__jobs.put((name, func, args, callback, time()))
+        self.__logger.info("Queued post processing for %s [queue depth: %d]" % (name, self.__jobs.qsize()))
+
+
+    def run_callbacks(self):
+        """Runs callbacks of finished jobs on the calling thread."""
+
+        while 1:
+            try:
+                name, callback, result, error, queued_at, started_at, finished_at = self.__done.get_nowait()
+            except Queue.Empty:
+                break
+
+            self.__logger.info("Post processing for %s finished [waited: %.2fs, ran: %.2fs, queue depth: %d]" % (name, started_at - queued_at, finished_at - started_at, self.__jobs.qsize()))
+
+            if error:
+                self.__logger.info("Error: post processing for %s failed: %s" % (name, error))
+
+            if callback:
+                callback(result, error)
+
+
+    def shutdown(self):
+        """Waits for queued jobs to finish, then stops the workers."""
+
+        for worker in self.__workers:
+            self.__jobs.put(None)
+
+        for worker in self.__workers:
+            worker.join()
+
+        self.run_callbacks()
+
+
+class WorkerTasks:
+    """Notices multiprocessing.Pool tasks lost with their worker process.
+
+    Python 2.7's pools never call back for a task whose worker died (OOM
+    killer, a crash in lxml or sqlite), it's just gone.  Workers report each
+    task's start on a pipe, lost() returns tasks whose worker is gone with no
+    result.  A worker has to be found gone twice LOST_TASK_CHECK_INTERVAL
+    apart, its result may still be on the way back.
+    """
+
+    def __init__(self):
+        global worker_task_fd
+
+        self.__fds = os.pipe()
+        for fd in self.__fds:
+            set_cloexec(fd)
+        fcntl.fcntl(self.__fds[0], fcntl.F_SETFL, fcntl.fcntl(self.__fds[0], fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        # workers forked from now on report here
+        worker_task_fd = self.__fds[1]
+
+        self.__tasks = {}
+        self.__last_id = 0
+        self.__buffer = ""
+        self.__next_check = None
+        self.__broken_pools = []
+
+
+    def __len__(self):
+        return len(self.__tasks)
+
+
+    def apply_async(self, pool, func, args, callback, lost):
+        """Runs func(*args) in pool like pool.apply_async(), lost(pid) is called by check() if its worker dies."""
+
+        self.__last_id += 1
+
+        result = pool.apply_async(run_worker_task, (self.__last_id, func, args), callback=callback)
+        self.__tasks[self.__last_id] = [result, None, 0, lost, pool]
+
+        if self.__next_check is None:
+            self.__next_check = time() + LOST_TASK_CHECK_INTERVAL
+
+
+    def next_check(self):
+        return self.__next_check
+
+
+    def check(self):
+        """Calls lost(pid) for tasks lost with their worker, forgets finished ones."""
+
+        self.__read_starts()
+
+        lost = []
+
+        for task_id, task in self.__tasks.items():
+            result, pid, misses, callback, pool = task
+
+            if result.ready():
+                del self.__tasks[task_id]
+
+            elif pid is None:
+                # not started yet
+                continue
+
+            elif process_exists(pid):
+                task[2] = 0
+
+            elif misses:
+                del self.__tasks[task_id]
+                lost.append((pid, callback))
+
+                if pool not in self.__broken_pools:
+                    self.__broken_pools.append(pool)
+
+            else:
+                task[2] = 1
+
+        self.__next_check = self.__tasks and time() + LOST_TASK_CHECK_INTERVAL or None
+
+        for pid, callback in lost:
+            callback(pid)
+
+
+    def stop_pool(self, pool):
+        """Waits for pool's tasks, then stops it.  A pool that lost a task would wait forever, it's terminated."""
+
+        pool.close()
+
+        if pool in self.__broken_pools:
+            pool.terminate()
+        else:
+            pool.join()
+
+
+    def __read_starts(self):
+        try:
+            while True:
+                data = os.read(self.__fds[0], 65536)
+                if not data:
+                    break
+                self.__buffer += data
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+        lines = self.__buffer.split("\n")
+        self.__buffer = lines.pop()
+
+        for line in lines:
+            task_id, pid = [int(i) for i in line.split()]
+            if task_id in self.__tasks:
+                self.__tasks[task_id][1] = pid
 
 
 class SquireDaemon:
@@ -177,7 +496,22 @@ class SquireDaemon:
     __logger            = None
     __is_running        = False
     __location_emails   = {}
-    __item_list_infos   = {}
+    __jobs              = None
+    __title_renderer    = None
+    __item_renderer     = None
+    __post_pool         = None
+    __mail_queue        = None
+    __item_pool         = None
+    __item_results      = None
+    __title_pool        = None
+    __title_results     = None
+    __scheduler         = None
+    __worker_tasks      = None
+    __status_requested  = False
+    __procs             = []
+    __epoll             = None
+    __wakeup_fds        = None
+    __stderr_procs      = {}
 
 
     def __init__(self):
@@ -211,6 +545,19 @@ class SquireDaemon:
             self.__logger.info(sys.exc_info()[1])
 
 
+    def init_renderers(self):
+        """Compile XSL stylesheets once for all paging lists."""
+
+        try:
+            self.__title_renderer = XSLTRenderer(SQUIRE_T_2XHTML_XSL_FILE)
+            self.__item_renderer  = XSLTRenderer(SQUIRE_I_2XHTML_XSL_FILE)
+
+        except Exception, e:
+            self.__logger.info("Error: unable to compile stylesheets, falling back to %s: %s" % (XSLTPROC_CMD, e))
+            self.__title_renderer = XSLTRenderer(SQUIRE_T_2XHTML_XSL_FILE, in_process=False)
+            self.__item_renderer  = XSLTRenderer(SQUIRE_I_2XHTML_XSL_FILE, in_process=False)
+
+
     def shutdown(self):
         """The candle that burns twice as bright burns half as long."""
 
@@ -225,8 +572,22 @@ class SquireDaemon:
         self.__is_running = False
 
 
-    def process_file(self, filename=None):
-        """Moves new paging list file to DIR_ARCHIVE and processes with SQUIRE_CMD."""
+    def request_status(self, signal=None, frame=None):
+        """Has the daemon loop log its status (SIGUSR1)."""
+
+        self.__status_requested = True
+
+
+    def log_status(self):
+        """Logs queued and running title lists, jobs waiting to be paired or emailed, and mail."""
+
+        self.__logger.info("Status: title lists %s" % (self.__scheduler.status()))
+        self.__logger.info("Status: %d jobs: %s" % (len(self.__jobs), ", ".join(sorted([repr(job) for job in self.__jobs.jobs()])) or "none"))
+        self.__logger.info("Status: mail queue depth %d" % (self.__mail_queue.queue_depth()))
+
+
+    def process_file(self, filename=None, dir=DIR_DROPBOX):
+        """Moves new paging list file in dir to DIR_ARCHIVE and processes with SQUIRE_CMD."""
 
         if not PAGING_LIST_EXT:
             self.__logger.info("Error: PAGING_LIST_EXT not defined!")
@@ -239,40 +600,38 @@ class SquireDaemon:
         if IGNORE_DOTFILES and filename[0] == '.':
             return
        
-        ext_timestamp = datetime.now().strftime("%y%m%d")
-
-        # ONLY process files with names ending in PAGING_LIST_EXT
-        title_list_ext = "%s.t%s.auton" % (PAGING_LIST_EXT, ext_timestamp)
-        item_list_ext  = "%s.t%s.auton" % (ITEM_LIST_EXT, ext_timestamp)
-
-        # title list or item list?
-        if filename.endswith(title_list_ext):
-            paging_list_ext = title_list_ext
-            list_type = ListTypes.TITLE_PAGING_LIST
-
-        elif filename.endswith(item_list_ext):
-            paging_list_ext = item_list_ext
-            list_type = ListTypes.ITEM_PAGING_LIST
-
-        else:
+        # ONLY process files with names ending in PAGING_LIST_EXT or ITEM_LIST_EXT, title list or item list?
+        file_type = list_file_type(filename)
+        if file_type is None:
             # ignore unknown file type
             return
 
+        list_type, paging_list_ext, days_old = file_type
+
         basename  = filename[:-len(paging_list_ext)]
         extension = paging_list_ext
 
         if TIMESTAMP_ACTIVE:
             timestamp = datetime.now().strftime(TIMESTAMP_FORMAT)
             timestamp_spacer = "_"
+
+            # caught up from an earlier day, keep its date: its own outputs, job and index run
+            if days_old:
+                list_day = datetime.combine(datetime.now().date() - timedelta(days=days_old), datetime.min.time())
+                timestamp = list_day.strftime(TIMESTAMP_FORMAT)
         else:
             timestamp = ""
             timestamp_spacer = ""
 
-        fullpath_file    = os.path.normpath(os.path.join(DIR_DROPBOX, filename))
+        fullpath_file    = os.path.normpath(os.path.join(dir, filename))
         fullpath_archive = os.path.normpath(os.path.join(DIR_ARCHIVE, filename))
         fullpath_csv     = os.path.normpath(os.path.join(DIR_OUTPUT, "%s%s%s%s.csv" % (basename, ListTypes.gettypestr(list_type), timestamp_spacer, timestamp)))
         fullpath_xml     = os.path.normpath(os.path.join(DIR_OUTPUT, "%s%s%s%s.xml" % (basename, ListTypes.gettypestr(list_type), timestamp_spacer, timestamp)))
 
+        # already picked up, by a rescan or an earlier event
+        if not os.path.exists(fullpath_file):
+            return
+
         self.__logger.info("A wild paging list approaches! [%s]" % (fullpath_file))
 
         if list_type == ListTypes.TITLE_PAGING_LIST:
@@ -300,14 +659,69 @@ class SquireDaemon:
         except Exception, e:
             self.__logger.info("Error: %s" % (sys.exc_info()))
 
+        # wait for a slot, smallest lists first
+        try:
+            size = os.path.getsize(fullpath_archive)
+        except OSError:
+            size = 0
+
+        self.__scheduler.submit(basename, size, (basename, timestamp, fullpath_file, fullpath_archive, fullpath_csv, fullpath_xml))
+        self.__logger.info("Queued title list %s [%s]" % (fullpath_archive, self.__scheduler.status()))
+
+        self.start_title_lists()
+
+
+    def start_title_lists(self):
+        """Starts queued title lists while TITLE_LIST_MAX_JOBS allows."""
+
+        started = self.__scheduler.start()
+        self.share_webpac_budget()
+
+        for scheduled in started:
+            self.run_title_list(scheduled)
+
+
+    def share_webpac_budget(self):
+        """Hands title list workers their current share of WEBPAC_REQUEST_BUDGET."""
+
+        if title_list_rate is not None:
+            title_list_rate.value = self.__scheduler.share() or 0
+
+
+    def run_title_list(self, scheduled, in_worker=True):
+        """Processes a started title list in a warm worker, or with SQUIRE_CMD."""
+
+        basename, timestamp, fullpath_file, fullpath_archive, fullpath_csv, fullpath_xml = scheduled.args
+
+        # hand to a warm worker
+        if self.__title_pool and in_worker:
+            def done(result):
+                # runs on the pool's result thread, hand off to the daemon loop
+                self.__title_results.put((scheduled, result))
+                self.wakeup()
+
+            self.__worker_tasks.apply_async(self.__title_pool, build_title_list, (fullpath_archive, fullpath_csv, fullpath_xml, scheduled.rate), done,
+                                            lambda pid: self.title_list_lost(scheduled, pid))
+            return
+
+        # --rate can't be changed once SQUIRE_CMD runs, it keeps a whole slot's share
+        self.__scheduler.fix_rate(scheduled)
+        self.share_webpac_budget()
+
+        args = [SQUIRE_CMD,
+                "--file=%s" % (fullpath_archive),
+                "--csv",
+                "--output-file-csv=%s" % (fullpath_csv),
+                "--xml",
+                "--output-file-xml=%s" % (fullpath_xml)]
+
+        # this list's share of WEBPAC_REQUEST_BUDGET
+        if scheduled.rate:
+            args.append("--rate=%g" % (scheduled.rate))
+
         # run subprocess to process paging list
         try:
-            proc = Popen([SQUIRE_CMD,
-                         "--file=%s" % (fullpath_archive),
-                         "--csv",
-                         "--output-file-csv=%s" % (fullpath_csv),
-                         "--xml",
-                         "--output-file-xml=%s" % (fullpath_xml)],
+            proc = Popen(args,
                          close_fds=False,
                          stderr=PIPE)
 
@@ -318,12 +732,18 @@ class SquireDaemon:
             proc.paging_list_fullpath_xml      = fullpath_xml
             proc.paging_list_basename          = basename
             proc.paging_list_timestamp         = timestamp
-            proc.paging_list_waiting_for_items = False
-            proc.paging_list_info_key          = "%s%s" % (basename, timestamp)
+            proc.paging_list_scheduled         = scheduled
+            proc.paging_list_stderr_buffer     = ""
 
             # add to process list
             self.__procs.append(proc)
 
+            # log stderr as it arrives
+            self.__stderr_procs[proc.stderr.fileno()] = proc
+            self.__epoll.register(proc.stderr.fileno(), select.EPOLLIN)
+
+            return
+
         except IOError, e:
             self.__logger.info("Error: %s" % (e.strerror))
         except OSError, e:
@@ -331,10 +751,11 @@ class SquireDaemon:
         except Exception, e:
             self.__logger.info("Error: %s" % (sys.exc_info()))
 
+        # never started, free its slot
+        self.title_list_finished(scheduled)
+
     
     def process_item_list(self, basename, timestamp, fullpath_file, fullpath_archive, fullpath_csv, fullpath_xml):
-        records = []
-
         try:
             # move new item list to archive directory
             move(fullpath_file, fullpath_archive)
@@ -353,171 +774,232 @@ class SquireDaemon:
         except Exception, e:
             self.__logger.info("Error: %s" % (sys.exc_info()))
 
+        def done(result):
+            # runs on the pool's result thread, hand off to the daemon loop
+            self.__item_results.put((basename, timestamp, fullpath_archive, fullpath_csv, fullpath_xml, result))
+            self.wakeup()
 
-        try:
-            # load items from Item Paging List
-            f = os.open(fullpath_archive, os.O_RDONLY)
-            map = mmap.mmap(f, 0, prot=mmap.PROT_READ)
-
-            item_regex = r"(^\s*AUTHOR:|^\s*Please\ pull\ this\ item\ and\ check\ it\ in\ to\ place\ in\ transit:\s*)(\s*AUTHOR:|)(.*?)^(\s*TITLE:|\s*)(.*?)^(\s*IMPRINT:|\s*)(.*?)^(\s*PUB\ DATE:|\s*)(.*?)^(\s*DESC:|\s*)(.*?)^(\s*CALL\ NO:|\s*)(.*?)^(\s*VOLUME:|\s*)(.*?)^(\s*BARCODE:|\s*)(.*?)^(\s*STATUS:|\s*)(.*?)^(\s*REC\ NO:|\s*)(.*?)^(\s*LOCATION:|\s*)(.*?)^(\s*PICKUP AT:|\s*)(.*?)^(\s*OPACMSG:|\s*)(.*?)$"
-            
-            m = re.findall(item_regex, map, re.DOTALL|re.MULTILINE)
-
-            for l in m:
-                record = {}
-                record["author"]          = l[2].strip()  # AUTHOR:
-                record["title"]           = l[4].strip()  # TITLE:
-                record["call_number"]     = l[12].strip() # CALL NO:
-                barcode                   = l[16].strip()  # BARCODE:
-                record["location"]        = l[22].strip() # LOCATION:
-       
-                # format barcode
-                if len(barcode) > 13: 
-                    record["barcode"] = "%s %s %s %s" % (barcode[0], barcode[1:5], barcode[5:10], barcode[10:])
-                else:
-                    record["barcode"] = barcode
-                records.append(record)
+        def lost(pid):
+            # the title list goes out without items once the job times out
+            self.__logger.info("[%d] Error: item list worker died [%s]" % (pid, fullpath_archive))
 
-            map.close()
-            os.close(f)
+        # parse and serialize in a worker process
+        self.__worker_tasks.apply_async(self.__item_pool, build_item_list, (basename.replace("_"," "), fullpath_archive, fullpath_csv, fullpath_xml), done, lost)
+        self.__logger.info("Queued item list %s" % (fullpath_archive))
 
-        except Exception, e:
-            self.__logger.info("Error: %s" % (sys.exc_info()))
 
-        # dump to csv
-        fields = ["location", "call_number", "author", "title", "barcode"]
+    def run_item_list_results(self):
+        """Hands finished item lists to the job table."""
 
-        headers = {"location" : "Location", "call_number" : "Call #", "author" : "Author", "title" : "Title", "barcode" : "Barcode"}
+        while 1:
+            try:
+                basename, timestamp, fullpath_archive, fullpath_csv, fullpath_xml, result = self.__item_results.get_nowait()
+            except Queue.Empty:
+                break
 
-        # output csv
-        try:
-            csv_file = open(fullpath_csv, "wb")
-            csv_file.write(codecs.BOM_UTF8)
-            
-            writer = csv.DictWriter(csv_file, fieldnames=fields, delimiter=',', dialect=csv.excel, quoting=csv.QUOTE_ALL)
-            writer.writerow(headers)
+            xml_data, count, errors = result
 
-            # write rows sorted by "call_number"
-            for row in sorted(records, key=operator.itemgetter("call_number")):
-                writer.writerow(row)
+            for error in errors:
+                self.__logger.info(error)
 
-        except Exception, e:
-            self.__logger.info("Error writing item csv : %s [%s]" % (sys.exc_info(), fullpath_csv))
+            self.__logger.info("Item list %s processed [%d items]" % (fullpath_archive, count))
 
-        finally:
-            if csv_file:
-               csv_file.close()
+            item_info = {}
+            item_info["fullpath_archive"] = fullpath_archive
+            item_info["fullpath_csv"]     = fullpath_csv
+            item_info["fullpath_xml"]     = fullpath_xml
+            item_info["xml_data"]         = xml_data
+            item_info["count"]            = count
+
+            job = self.__jobs.item_parsed(basename, timestamp, item_info)
+
+            if job:
+                self.render(job)
+            else:
+                self.__logger.info("Waiting for title list... [%s]" % (basename))
 
-        # dump to xml
-        branch_name = basename.replace("_"," ")
 
-        doc = Document()
-        root_node = doc.createElement("paging_list")
-        root_node.setAttribute("location", branch_name)
-        root_node.setAttribute("timestamp", str(datetime.now()))
-        root_node.setAttribute("count", str(len(records)))
-        doc.appendChild(root_node)
+    def run_title_list_results(self):
+        """Logs title lists finished by the warm workers and hands them to the job table."""
 
-        for record in sorted(records, key=operator.itemgetter("call_number")):
-            elem = doc.createElement("record")
+        while True:
+            try:
+                scheduled, result = self.__title_results.get_nowait()
+            except Queue.Empty:
+                return
 
-            for key in record:
-                v = escape(str(record[key]).strip())
-                v = v.replace("'", "&#39;")
-                v = v.replace('"', "&quot;")
+            basename, timestamp, fullpath_file, fullpath_archive, fullpath_csv, fullpath_xml = scheduled.args
+            pid, ok, messages = result
 
-                v = v.replace(",", "&#44;")
+            self.title_list_finished(scheduled)
 
-                e = doc.createElement(key)
-                t = doc.createTextNode(v)
+            for line in messages:
+                self.__logger.info("[%d] [%s] %s" % (pid, basename, line))
 
-                e.appendChild(t)
-                elem.appendChild(e)
+            if not ok:
+                self.__logger.info("[%d] Error: SQUIRE_CMD failed [%s]" % (pid, fullpath_archive))
+                continue
 
-            root_node.appendChild(elem)
+            self.title_list_parsed(pid, basename, timestamp, fullpath_file, fullpath_archive, fullpath_csv, fullpath_xml)
 
-        try:
-            xml_file = open(fullpath_xml, "w")
-            doc.writexml(xml_file)
 
-        except Exception, e:
-            self.__logger.info("Error writing item xml : %s [%s]" % (sys.exc_info(), fullpath_xml))
+    def title_list_lost(self, scheduled, pid):
+        """Reruns a title list whose worker died with SQUIRE_CMD, in the same slot."""
 
-        finally:
-            xml_file.close()
+        self.__logger.info("[%d] Error: SQUIRE_CMD failed, title list worker died [%s]" % (pid, scheduled.args[3]))
+        self.__logger.info("Running %s for %s" % (SQUIRE_CMD, scheduled.args[3]))
+
+        self.run_title_list(scheduled, in_worker=False)
+
+
+    def title_list_finished(self, scheduled):
+        """Frees a title list's slot, successful or not."""
+
+        self.__scheduler.finished(scheduled)
+        self.share_webpac_budget()
+
+        now = time()
+        self.__logger.info("Title list %s finished [waited: %.2fs, ran: %.2fs, %s]" % (scheduled.name, scheduled.started_at - scheduled.queued_at,
+                                                                                    now - scheduled.started_at, self.__scheduler.status(now)))
+
+
+    def title_list_parsed(self, pid, basename, timestamp, fullpath_file, fullpath_archive, fullpath_csv, fullpath_xml):
+        """Hands a processed title list to the job table."""
+
+        self.__logger.info("[%d] %s processed successfully" % (pid, fullpath_file))
+
+        title_info = {}
+        title_info["fullpath_archive"] = fullpath_archive
+        title_info["fullpath_csv"]     = fullpath_csv
+        title_info["fullpath_xml"]     = fullpath_xml
+
+        job = self.__jobs.title_parsed(basename, timestamp, title_info)
+
+        if job:
+            self.render(job)
+        else:
+            self.__logger.info("[%d] Waiting for item list..." % (pid))
+
+            if EARLY_PUBLISH:
+                self.publish_early(self.__jobs.get(basename, timestamp))
+
+
+    def render(self, job):
+        """Queues post processing for a job in RENDERING, with or without its item list."""
+
+        # publish_early's callback will call back once the title list is out
+        if job.title_info.get("publishing"):
+            return
+
+        self.__post_pool.submit(job.branch, self.post_processing, (self.processing_info(job),),
+                                lambda result, error: self.__jobs.emailed(job))
+
+
+    def publish_early(self, job):
+        """Queues publishing a job's title list while it waits for the item list."""
+
+        def published(result, error):
+            job.title_info["publishing"] = False
+            job.title_info["html_filename"] = result
+
+            # item list showed up (or timed out) in the meantime
+            if job.state == JobStates.RENDERING:
+                self.render(job)
 
-        # save item list info
-        info_key = "%s%s" % (basename, datetime.now().strftime(TIMESTAMP_FORMAT))
-        self.__item_list_infos[info_key] = {}
-        self.__item_list_infos[info_key]["fullpath_archive"] = fullpath_archive
-        self.__item_list_infos[info_key]["fullpath_csv"] = fullpath_csv
-        self.__item_list_infos[info_key]["fullpath_xml"] = fullpath_xml
-        self.__item_list_infos[info_key]["created_at"]   = time()
+        def publish(p_info):
+            # don't leave the last item list up next to the new title list
+            self.publish_items(p_info)
+            title_html_filename = self.publish_title(p_info)
+            self.update_index(p_info, title_html_filename, None)
+            return title_html_filename
+
+        job.title_info["publishing"] = True
+
+        self.__post_pool.submit("%s title list" % (job.branch), publish, (self.processing_info(job),), published)
+
+
+    def processing_info(self, job):
+        """Collects post processing paths for a job."""
+
+        processing_info = {}
+        processing_info["has_item_list"]               = job.item_info is not None
+        processing_info["basename"]                    = job.branch
+        processing_info["timestamp"]                   = job.date
+        processing_info["title_list_fullpath_archive"] = job.title_info["fullpath_archive"]
+        processing_info["title_list_fullpath_csv"]     = job.title_info["fullpath_csv"]
+        processing_info["title_list_fullpath_xml"]     = job.title_info["fullpath_xml"]
+        processing_info["title_html_filename"]         = job.title_info.get("html_filename")
+
+        if job.item_info:
+            processing_info["item_list_fullpath_archive"] = job.item_info["fullpath_archive"]
+            processing_info["item_list_fullpath_csv"]     = job.item_info["fullpath_csv"]
+            processing_info["item_list_fullpath_xml"]     = job.item_info["fullpath_xml"]
+            processing_info["item_list_xml_data"]         = job.item_info["xml_data"]
+            processing_info["item_list_count"]            = job.item_info["count"]
+
+        return processing_info
 
     
     def post_processing(self, p_info):
+        """Publishes whatever hasn't been published yet, then emails the branch."""
+
+        title_html_filename = p_info.get("title_html_filename") or self.publish_title(p_info)
+        item_html_filename  = self.publish_items(p_info)
+
+        self.update_index(p_info, title_html_filename, item_html_filename)
+
+        self.send_email(p_info, title_html_filename, item_html_filename)
 
-        branch_name = p_info["basename"].replace("_"," ")
 
-        # generate title HTML 
+    def publish_title(self, p_info):
+        """Renders title HTML and points the branch's latest_title links at it, returns the HTML filename."""
+
         title_html_filename = os.path.normpath(os.path.join(DIR_OUTPUT, "%s%s_%s.html" % (p_info["basename"], ListTypes.gettypestr(ListTypes.TITLE_PAGING_LIST), p_info["timestamp"])))
 
         try:
             # generate HTML file
-            # blocking is probably okay here...maybe...
-            p = Popen("%s -o %s %s %s" % (XSLTPROC_CMD, title_html_filename, SQUIRE_T_2XHTML_XSL_FILE, p_info["title_list_fullpath_xml"]), shell=True)
-            sts = os.waitpid(p.pid, 0)[1]
+            self.__title_renderer.render(title_html_filename, p_info["title_list_fullpath_xml"])
 
             # create symlink
             latest_title_link     = "%s%s/latest_title.html" % (LISTS_DIR, p_info["basename"])
             latest_raw_title_link = "%s%s/latest_title_raw.txt" % (LISTS_DIR, p_info["basename"])
 
             try:
-                os.remove(latest_title_link)
-            except:
-                pass
-
-            try:
-                os.symlink(title_html_filename, latest_title_link)
+                replace_symlink(title_html_filename, latest_title_link)
             except:
                 self.__logger.info(sys.exc_info()[1])
 
-
             try:
-                os.remove(latest_raw_title_link)
-            except:
-                pass
-
-            try:
-                os.symlink(p_info["title_list_fullpath_archive"], latest_raw_title_link)
+                replace_symlink(p_info["title_list_fullpath_archive"], latest_raw_title_link)
             except:
                 self.__logger.info(sys.exc_info()[1])
 
         except:
             self.__logger.info(sys.exc_info()[1])
 
+        return title_html_filename
+
+
+    def publish_items(self, p_info):
+        """Renders item HTML and points the branch's latest_item links at it, or at the
+        NO_ITEM files without an item list.  Returns the HTML filename or None."""
+
         latest_item_link = "%s%s/latest_item.html" % (LISTS_DIR, p_info["basename"])
         latest_raw_item_link = "%s%s/latest_item_raw.txt" % (LISTS_DIR, p_info["basename"])
 
+        item_html_filename = None
+
         if p_info["has_item_list"]:
             # generate item HTML, if available
             item_html_filename = os.path.normpath(os.path.join(DIR_OUTPUT, "%s%s_%s.html" % (p_info["basename"], ListTypes.gettypestr(ListTypes.ITEM_PAGING_LIST), p_info["timestamp"])))
 
             try:
-                # generate HTML file
-                # blocking is probably okay here...maybe...
-                p = Popen("%s -o %s %s %s" % (XSLTPROC_CMD, item_html_filename, SQUIRE_I_2XHTML_XSL_FILE, p_info["item_list_fullpath_xml"]), shell=True)
-                sts = os.waitpid(p.pid, 0)[1]
-
-                try:
-                    os.remove(latest_item_link)
-                    os.remove(latest_raw_item_link)
-                except:
-                    pass
+                # generate HTML file from the item list worker's in-memory XML (None if it failed to serialize, then from the file)
+                self.__item_renderer.render(item_html_filename, p_info["item_list_fullpath_xml"], p_info["item_list_xml_data"])
 
                 try:
-                    os.symlink(item_html_filename, latest_item_link)
-                    os.symlink(p_info["item_list_fullpath_archive"], latest_raw_item_link)
+                    replace_symlink(item_html_filename, latest_item_link)
+                    replace_symlink(p_info["item_list_fullpath_archive"], latest_raw_item_link)
                 except:
                     self.__logger.info(sys.exc_info()[1])
 
@@ -525,28 +1007,124 @@ class SquireDaemon:
                 self.__logger.info(sys.exc_info()[1])
         else:
             try:
-                os.remove(latest_item_link)
-                os.remove(latest_raw_item_link)
+                replace_symlink(NO_ITEM_HTML_FILENAME, latest_item_link)
+                replace_symlink(NO_ITEM_RAW_FILENAME, latest_raw_item_link)
             except:
-                pass
+                self.__logger.info(sys.exc_info()[1])
+
+        return item_html_filename
+
+
+    def update_index(self, p_info, title_html_filename, item_html_filename):
+        """Records the run's published files in the branch's manifest and index.html."""
 
+        fields = {"title_html"  : title_html_filename,
+                  "title_csv"   : p_info["title_list_fullpath_csv"],
+                  "title_raw"   : p_info["title_list_fullpath_archive"],
+                  "title_count" : read_list_count(p_info["title_list_fullpath_xml"])}
+
+        if item_html_filename:
+            fields.update({"item_html"  : item_html_filename,
+                           "item_csv"   : p_info["item_list_fullpath_csv"],
+                           "item_raw"   : p_info["item_list_fullpath_archive"],
+                           "item_count" : p_info["item_list_count"]})
+
+        # leave out whatever failed to render or write
+        for column in fields.keys():
+            if column.endswith("_count"):
+                continue
+            if not fields[column] or not os.path.exists(fields[column]):
+                del fields[column]
+
+        try:
+            index = PagingListIndex(os.path.join(DIR_INDEX, "%s.db" % (p_info["basename"])),
+                                    "%s%s" % (LISTS_DIR, p_info["basename"]),
+                                    p_info["basename"].replace("_"," "),
+                                    INDEX_RUNS)
             try:
-                os.symlink(NO_ITEM_HTML_FILENAME, latest_item_link)
-                os.symlink(NO_ITEM_RAW_FILENAME, latest_raw_item_link)
-            except:
-                self.__logger.info(sys.exc_info()[1])
+                index.update(p_info["timestamp"], **fields)
+            finally:
+                index.close()
+
+        except:
+            self.__logger.info("Error: unable to update index: %s [%s]" % (sys.exc_info()[1], p_info["basename"]))
+
+
+    def rotate_archive(self):
+        """Moves lists older than ARCHIVE_COMPRESS_AGE into DIR_STORE, expires those past ARCHIVE_RETENTION.
+
+        Files a branch's latest_* links point at are left alone, manifests are
+        updated to point at the files' new home.
+        """
+
+        now = time()
+
+        latest = set()
+        for branch in os.listdir(LISTS_DIR):
+            for link in LATEST_LINKS:
+                try:
+                    latest.add(os.readlink(os.path.join(LISTS_DIR, branch, link)))
+                except OSError:
+                    pass
+
+        moves = {}
+        size = 0
+
+        for dir in (DIR_ARCHIVE, DIR_OUTPUT):
+            for filename in os.listdir(dir):
+                fullpath = os.path.normpath(os.path.join(dir, filename))
+
+                if filename[0] == '.' or fullpath in latest:
+                    continue
+
+                try:
+                    st = os.lstat(fullpath)
+                    if not stat.S_ISREG(st.st_mode) or now - st.st_mtime < ARCHIVE_COMPRESS_AGE:
+                        continue
+
+                    moves[fullpath] = self.__store.put(fullpath)
+                    size += st.st_size
+
+                except (IOError, OSError), e:
+                    self.__logger.info("Error: unable to archive %s: %s" % (fullpath, e))
+
+        if moves:
+            for filename in os.listdir(DIR_INDEX):
+                if not filename.endswith(".db"):
+                    continue
+
+                basename = filename[:-len(".db")]
+                try:
+                    index = PagingListIndex(os.path.join(DIR_INDEX, filename), "%s%s" % (LISTS_DIR, basename), basename.replace("_"," "), INDEX_RUNS)
+                    try:
+                        index.relocate(moves)
+                    finally:
+                        index.close()
+
+                except:
+                    self.__logger.info("Error: unable to update index: %s [%s]" % (sys.exc_info()[1], basename))
+
+        expired = []
+        if ARCHIVE_RETENTION:
+            expired = self.__store.expire(ARCHIVE_RETENTION, now)
+
+        objects, stored_size = self.__store.usage()
+
+        self.__logger.info("Archived %d files [%d KB], expired %d days [store: %d objects, %d KB]" % (len(moves), size / 1024, len(expired), objects, stored_size / 1024))
+
+
+    def send_email(self, p_info, title_html_filename, item_html_filename):
+        """Sends one email with the branch's title and item attachments."""
+
+        branch_name = p_info["basename"].replace("_"," ")
 
-        # send email
         if branch_name in self.__location_emails:
 
-            msg = MIMEMultipart("alternative")
             Charset.add_charset("utf-8", Charset.QP, Charset.QP, "utf-8")
 
-            msg["Subject"]  = "%s Paging Lists for %s" % (branch_name, p_info["timestamp"])
-            msg["From"]     = SEND_EMAIL_AS
-            msg["To"]       = ", ".join(self.__location_emails[branch_name])
-            msg["Preamble"] = msg["Subject"]
-            branch_url  = "%s/%s/index.html" % (LISTS_URL, p_info["basename"])
+            subject    = "%s Paging Lists for %s" % (branch_name, p_info["timestamp"])
+            recipients = self.__location_emails[branch_name]
+            branch_url = "%s/%s/index.html" % (LISTS_URL, p_info["basename"])
             # TODO: replace these with external templates
             body_text = "\n Please visit %s to access the %s Library paging lists.\n\nSpreadsheet versions of your paging lists are also attached to this email.\n\nIf there is a problem with your paging lists, please contact the Help Desk at %s or %s." % (branch_url, branch_name, HELP_DESK_EMAIL, HELP_DESK_PHONE)
             body_html = """\
@@ -559,185 +1137,611 @@ class SquireDaemon:
                         </body>
                         </html>
                         """ % (branch_url, branch_name, HELP_DESK_EMAIL, HELP_DESK_EMAIL, HELP_DESK_PHONE)
-          
-            try:
-                # load and encode Title csv file
-                title_csv_attachment_file = open(p_info["title_list_fullpath_csv"], "rb")
-                title_csv_attachment = MIMEBase("text","csv")
-                title_csv_attachment.set_payload(title_csv_attachment_file.read())
-                Encoders.encode_7or8bit(title_csv_attachment)
-                title_csv_attachment.add_header('Content-Disposition', 'attachment', filename=os.path.basename(p_info["title_list_fullpath_csv"]))
-                msg.attach(title_csv_attachment)
-                title_csv_attachment_file.close()
-
-                # load and encode Title html file
-                title_html_attachment_file = open(title_html_filename, "rb")
-                title_html_attachment = MIMEBase('application', 'octet-stream')
-                title_html_attachment.set_payload(title_html_attachment_file.read())
-                Encoders.encode_base64(title_html_attachment)
-                title_html_attachment.add_header('Content-Disposition', 'attachment', filename=os.path.basename(title_html_filename))
-                msg.attach(title_html_attachment)
-                title_html_attachment_file.close()
 
-            except:
-                self.__logger.info(sys.exc_info()[1])
+            # attachments are encoded straight from disk into the spool file
+            message = self.__mail_queue.open_message(SEND_EMAIL_AS, recipients, "%s paging list" % (branch_name))
 
-            # add Item attachements, if available
-            if p_info["has_item_list"]:
-                try:
-                    # load and encode Item csv file
-                    item_csv_attachment_file = open(p_info["item_list_fullpath_csv"], "rb")
-                    item_csv_attachment = MIMEBase("text","csv")
-                    item_csv_attachment.set_payload(item_csv_attachment_file.read())
-                    Encoders.encode_7or8bit(item_csv_attachment)
-                    item_csv_attachment.add_header('Content-Disposition', 'attachment', filename=os.path.basename(p_info["item_list_fullpath_csv"]))
-                    msg.attach(item_csv_attachment)
-                    item_csv_attachment_file.close()
-
-                    # load and encode Item html file
-                    item_html_attachment_file = open(item_html_filename, "rb")
-                    item_html_attachment = MIMEBase('application', 'octet-stream')
-                    item_html_attachment.set_payload(item_html_attachment_file.read())
-                    Encoders.encode_base64(item_html_attachment)
-                    item_html_attachment.add_header('Content-Disposition', 'attachment', filename=os.path.basename(item_html_filename))
-                    msg.attach(item_html_attachment)
-                    item_html_attachment_file.close()
+            try:
+                msg = MultipartWriter(message, "alternative", [("Subject", subject),
+                                                               ("From", SEND_EMAIL_AS),
+                                                               ("To", ", ".join(recipients)),
+                                                               ("Preamble", subject)])
 
+                try:
+                    # Title csv and html files
+                    msg.attach_file(p_info["title_list_fullpath_csv"], "text", "csv", encoding="7or8bit")
+                    msg.attach_file(title_html_filename, "application", "octet-stream",
+                                    gzip=os.path.getsize(title_html_filename) > EMAIL_GZIP_HTML_SIZE)
                 except:
-                 self.__logger.info(sys.exc_info()[1])
+                    self.__logger.info(sys.exc_info()[1])
 
-            # attach body
-            msg.attach(MIMEText(body_text, "plain"))
-            msg.attach(MIMEText(body_html, "html"))
+                # add Item attachements, if available
+                if p_info["has_item_list"]:
+                    try:
+                        msg.attach_file(p_info["item_list_fullpath_csv"], "text", "csv", encoding="7or8bit")
+                        msg.attach_file(item_html_filename, "application", "octet-stream",
+                                        gzip=os.path.getsize(item_html_filename) > EMAIL_GZIP_HTML_SIZE)
+                    except:
+                        self.__logger.info(sys.exc_info()[1])
 
-            # send mail
-            s = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-            s.sendmail(SEND_EMAIL_AS, self.__location_emails[branch_name], msg.as_string())
-            s.quit()
+                # attach body
+                msg.attach_text(body_text, "plain")
+                msg.attach_text(body_html, "html")
+                msg.close()
+
+            except:
+                message.discard()
+                raise
 
-            self.__logger.info("%s paging list emailed to %s" % (branch_name, msg["To"]))
+            # spool for delivery
+            message.close()
+
+            self.__logger.info("%s paging list queued for %s [mail queue depth: %d]" % (branch_name, ", ".join(recipients), self.__mail_queue.queue_depth()))
 
 
     def start(self):
         """Starts SquireDaemon service."""
 
+        global title_list_rate
+
         # initialize logging
         self.init_logger()
 
         # load location -> email table
         self.load_location_emails()
 
+        # compile stylesheets
+        self.init_renderers()
+
+        # workers report the tasks they start to the daemon
+        self.__worker_tasks = WorkerTasks()
+
+        # fork item list workers before any of the loop's fds exist
+        self.__item_pool = multiprocessing.Pool(ITEM_LIST_WORKERS, init_item_list_worker)
+        self.__item_results = Queue.Queue()
+
+        # and title list workers with SQUIRE_CMD imported, one per slot, replacements fork from here later
+        self.__scheduler = PagingListScheduler(TITLE_LIST_MAX_JOBS, WEBPAC_REQUEST_BUDGET)
+        self.__title_results = Queue.Queue()
+        if TITLE_LIST_WORKERS:
+            try:
+                load_squire()
+                title_list_rate = multiprocessing.RawValue("d", 0)
+                self.__title_pool = multiprocessing.Pool(TITLE_LIST_MAX_JOBS, init_title_list_worker, maxtasksperchild=TITLE_LIST_WORKER_JOBS)
+            except Exception, e:
+                self.__logger.info("Error: unable to import %s, running it for each list: %s" % (SQUIRE_CMD, e))
+
+        # self-pipe for waking the daemon loop from signals and worker threads
+        self.__wakeup_fds = os.pipe()
+        for fd in self.__wakeup_fds:
+            set_cloexec(fd)
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        # delivers email over one SMTP session, resends anything left in DIR_SPOOL
+        self.__mail_queue = MailQueue(DIR_SPOOL, SMTP_SERVER, SMTP_PORT, self.__logger,
+                                      SMTP_RETRY_DELAY, SMTP_RETRY_MAX_DELAY, SMTP_IDLE_TIMEOUT)
+
+        # pairs title and item lists
+        self.__jobs = JobTable(ITEM_LIST_TIMEOUT, ITEM_LIST_TTL)
+
+        # render/email off the event loop
+        self.__post_pool = PostProcessingPool(POST_PROCESSING_WORKERS, self.__logger, self.wakeup)
+
+        # compressed storage for old lists, first rotation right away
+        self.__store = ArchiveStore(DIR_STORE)
+        self.__next_rotation = time()
+
         # initialize inotify monitoring
-        inotify = INotify(DIR_DROPBOX, INotify.IN_CLOSE_WRITE)
+        inotify = INotify(DIR_DROPBOXES, INotify.IN_CLOSE_WRITE | INotify.IN_MOVED_TO)
+
+        # catch up on lists that arrived while squired was down, once the watches can't miss any more
+        self.__rescan_at = time()
 
         self.__procs = list()
 
-        # poll for inotify events
-        while self.__is_running:
+        # wait on inotify, child stderr pipes and the wakeup pipe together
+        self.__epoll = select.epoll()
+        set_cloexec(self.__epoll.fileno())
+        self.__epoll.register(inotify.fileno(), select.EPOLLIN)
+        self.__epoll.register(self.__wakeup_fds[0], select.EPOLLIN)
 
-            events = inotify.get_events()
-
-            # events were found
-            if type(events) is list:
-                for event in events:
-                    # IN_CLOSE_WRITE event?
-                    if (event["mask"] & INotify.IN_CLOSE_WRITE):
-                        self.process_file(event["name"])
-
-            # message dict returned
-            elif type(events) is dict:
-                if "ERROR" in events:
-                    self.__logger.info("Error: %s" % (events["ERROR"]))
-                elif "OKAY" in events:
-                    # TIMEOUT or BUSY
-                    pass
-                else:
-                    self.__logger.info("Error: unknown message dict returned")
+        # wake up on SIGCHLD and other signals
+        signal.set_wakeup_fd(self.__wakeup_fds[1])
+        signal.signal(SIGCHLD, lambda signum, frame: None)
 
-            # unknown type returned
-            else:
-                self.__logger.info("Error: unknown type: %s\n" % (str(type(events))))
+        # but restart whatever system calls it lands in (post processing threads' reads and waits), epoll returns anyway
+        signal.siginterrupt(SIGCHLD, False)
+
+        # sleep until something happens
+        while self.__is_running:
+
+            try:
+                ready = self.__epoll.poll(self.next_timeout())
+            except IOError, e:
+                if e.errno != errno.EINTR:
+                    raise
+                ready = []
+
+            for fd, mask in ready:
+                if fd == inotify.fileno():
+                    try:
+                        self.handle_events(inotify.read_events())
+                    except OSError, e:
+                        self.__logger.info("Error: reading inotify events failed: %s" % (e))
+
+                elif fd == self.__wakeup_fds[0]:
+                    try:
+                        os.read(fd, 4096)
+                    except OSError:
+                        pass
+
+                elif fd in self.__stderr_procs:
+                    self.read_stderr(self.__stderr_procs[fd])
+
+            # pick up finished title and item lists
+            self.run_title_list_results()
+            self.run_item_list_results()
+
+            # log finished post processing
+            self.__post_pool.run_callbacks()
+
+            # ITEM_LIST_TIMEOUT and ITEM_LIST_TTL
+            self.expire_jobs()
+
+            # rescan for lists whose events were lost
+            if self.__rescan_at is not None and time() >= self.__rescan_at:
+                self.rescan_dropboxes()
+
+            # ARCHIVE_ROTATE_INTERVAL
+            if time() >= self.__next_rotation:
+                self.__next_rotation = time() + ARCHIVE_ROTATE_INTERVAL
+                self.__post_pool.submit("archive rotation", self.rotate_archive)
 
             # query procs
-            for proc in self.__procs:
-                proc.poll()
-
-                # process finished?
-                if proc.returncode is not None:
-                    # cleanup any stale items infos (will happen if a day's item list is processed after title proc's ITEM_LIST_TIMEOUT)
-                    for k in self.__item_list_infos:
-                        if time() - self.__item_list_infos[k]["created_at"] > 86400: # 24 hours
-                            self.__logger.info("Removed stale item info [%s]!" % k)
-                            del self.__items_list_infos[k]
-
-                    if proc.returncode == 0:
-                        if proc.paging_list_waiting_for_items == False:
-                            # log any errors
-                            for line in proc.stderr:
-                                self.__logger.info("[%d] %s" % (proc.pid, line.rstrip()))
- 
-                            # start waiting for item list
-                            self.__logger.info("[%d] %s processed successfully" % (proc.pid, proc.paging_list_fullpath_file))
-                            self.__logger.info("[%d] Waiting for item list..." % (proc.pid))
-                            proc.paging_list_waiting_for_items = True
-                            proc.paging_list_wait_timestamp = time()
-                        
-                        else:
-                            wait_time = time() - proc.paging_list_wait_timestamp
-
-                            if proc.paging_list_info_key in self.__item_list_infos:
-                                # process title list with item list
-                                processing_info = {}
-                                processing_info["has_item_list"]               = True
-                                processing_info["timestamp"]                   = proc.paging_list_timestamp
-                                processing_info["basename"]                    = proc.paging_list_basename
-                                processing_info["title_list_fullpath_archive"] = proc.paging_list_fullpath_archive
-                                processing_info["title_list_fullpath_csv"]     = proc.paging_list_fullpath_csv
-                                processing_info["title_list_fullpath_xml"]     = proc.paging_list_fullpath_xml
-                                try:
-                                    item_list_fullpath_archive = self.__item_list_infos[proc.paging_list_info_key]["fullpath_archive"]
-                                    item_list_fullpath_csv = self.__item_list_infos[proc.paging_list_info_key]["fullpath_csv"]
-                                    item_list_fullpath_xml = self.__item_list_infos[proc.paging_list_info_key]["fullpath_xml"] 
-                                    processing_info["item_list_fullpath_archive"] = item_list_fullpath_archive
-                                    processing_info["item_list_fullpath_csv"]     = item_list_fullpath_csv
-                                    processing_info["item_list_fullpath_xml"]     = item_list_fullpath_xml
-                                except:
-                                    self.__logger.info("[%d] Errr.. can't find item list for this one.. [%s]" % (proc.pid, proc.paging_list_basename))
-                                    processing_info["has_item_list"] = False
-    
-                                del self.__item_list_infos[proc.paging_list_info_key]
-
-                                self.post_processing(processing_info)
-
-                                self.__procs.remove(proc)
-
-                            elif wait_time > ITEM_LIST_TIMEOUT:
-                                # process title list without item list
-                                processing_info = {}
-                                processing_info["has_item_list"]           = False
-                                processing_info["basename"]                = proc.paging_list_basename
-                                processing_info["timestamp"]               = proc.paging_list_timestamp
-                                processing_info["title_list_fullpath_archive"] = proc.paging_list_fullpath_archive
-                                processing_info["title_list_fullpath_csv"] = proc.paging_list_fullpath_csv
-                                processing_info["title_list_fullpath_xml"] = proc.paging_list_fullpath_xml
-
-                                if proc.paging_list_info_key in self.__item_list_infos:
-                                    del self.__item_list_infos[proc.paging_list_info_key]
-                                
-                                self.post_processing(processing_info)
-
-                                self.__procs.remove(proc)
-                    else:
-                        # log any errors
-                        for line in proc.stderr:
-                            self.__logger.info("[%d] [%s] %s" % (proc.pid, proc.paging_list_basename, line.rstrip()))
- 
-                        self._logger.info("[%d] Error: Non-zero return code on SQUIRE_CMD" % (proc.pid))
-                        self.__procs.remove(proc)
+            self.check_procs()
+
+            # LOST_TASK_CHECK_INTERVAL
+            if self.__worker_tasks.next_check() is not None and time() >= self.__worker_tasks.next_check():
+                self.__worker_tasks.check()
+
+            # fill slots freed above
+            self.start_title_lists()
+
+            # SIGUSR1
+            if self.__status_requested:
+                self.__status_requested = False
+                self.log_status()
         
         # cleanup
+        signal.set_wakeup_fd(-1)
+        self.__epoll.close()
+        self.__worker_tasks.stop_pool(self.__item_pool)
+        if self.__title_pool:
+            self.__worker_tasks.stop_pool(self.__title_pool)
+        self.__post_pool.shutdown()
+        self.__mail_queue.shutdown()
         self.shutdown()
 
+
+    def wakeup(self):
+        """Wakes the daemon loop, safe to call from any thread."""
+
+        try:
+            os.write(self.__wakeup_fds[1], "\0")
+        except OSError:
+            # pipe full, loop is waking up anyway
+            pass
+
+
+    def next_timeout(self):
+        """Seconds until the next job timeout, dropbox rescan, worker check or archive rotation."""
+
+        deadlines = [d for d in (self.__jobs.next_deadline(), self.__rescan_at, self.__worker_tasks.next_check()) if d is not None]
+
+        return max(0, min(deadlines + [self.__next_rotation]) - time())
+
+
+    def expire_jobs(self):
+        ready, stale = self.__jobs.expire()
+
+        for job in ready:
+            self.__logger.info("No item list after %d seconds [%s]" % (ITEM_LIST_TIMEOUT, job.branch))
+            self.render(job)
+
+        for job in stale:
+            self.__logger.info("Removed stale item info [%s%s]!" % (job.branch, job.date))
+
+
+    def handle_events(self, events):
+        """Dispatches inotify events."""
+
+        overflow = False
+
+        for event in events:
+            if (event.mask & INotify.IN_Q_OVERFLOW):
+                overflow = True
+
+            # closed after writing, or renamed into place
+            elif (event.mask & (INotify.IN_CLOSE_WRITE | INotify.IN_MOVED_TO)):
+                self.process_file(event.name, event.path)
+
+            elif (event.mask & INotify.IN_IGNORED):
+                self.__logger.info("Error: no longer watching %s, was it removed?" % (event.path))
+
+        if overflow:
+            self.__logger.info("Error: inotify queue overflowed, rescanning dropboxes")
+            self.rescan_dropboxes()
+
+
+    def rescan_dropboxes(self):
+        """Processes lists left in DIR_DROPBOXES, oldest first, for when inotify events were lost.
+
+        Runs at startup, every DROPBOX_RESCAN_INTERVAL and after a queue overflow.
+        Files changed in the last DROPBOX_SETTLE_TIME seconds may still be being
+        written, they're left for their own event or another rescan.  Lists an
+        event already picked up are gone from the dropbox by the time they'd be
+        processed again, see process_file().
+        """
+
+        now = time()
+        self.__rescan_at = DROPBOX_RESCAN_INTERVAL and now + DROPBOX_RESCAN_INTERVAL or None
+
+        found = []
+
+        for dir in DIR_DROPBOXES:
+            try:
+                filenames = os.listdir(dir)
+            except OSError, e:
+                self.__logger.info("Error: unable to rescan %s: %s" % (dir, e))
+                continue
+
+            for filename in filenames:
+                # only stat lists, dropboxes also collect other FTS output
+                if (IGNORE_DOTFILES and filename[0] == '.') or list_file_type(filename) is None:
+                    continue
+
+                try:
+                    st = os.lstat(os.path.join(dir, filename))
+                except OSError:
+                    continue
+
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+
+                if now - st.st_mtime < DROPBOX_SETTLE_TIME:
+                    self.__rescan_at = min(self.__rescan_at or now + DROPBOX_SETTLE_TIME, now + DROPBOX_SETTLE_TIME)
+                    continue
+
+                found.append((st.st_mtime, filename, dir))
+
+        if found:
+            self.__logger.info("Found %d unprocessed lists in dropboxes" % (len(found)))
+
+        for mtime, filename, dir in sorted(found):
+            self.process_file(filename, dir)
+
+
+    def read_stderr(self, proc):
+        """Logs complete lines from a title proc's stderr, unregisters the pipe at EOF."""
+
+        fd = proc.stderr.fileno()
+        data = os.read(fd, 65536)
+
+        if data:
+            lines = (proc.paging_list_stderr_buffer + data).split("\n")
+            proc.paging_list_stderr_buffer = lines.pop()
+        else:
+            self.__epoll.unregister(fd)
+            del self.__stderr_procs[fd]
+            lines = [proc.paging_list_stderr_buffer]
+            proc.paging_list_stderr_buffer = ""
+
+        for line in lines:
+            if line.rstrip():
+                self.__logger.info("[%d] [%s] %s" % (proc.pid, proc.paging_list_basename, line.rstrip()))
+
+
+    def check_procs(self):
+        """Hands finished title procs to the job table."""
+
+        for proc in self.__procs[:]:
+            proc.poll()
+
+            # process finished?
+            if proc.returncode is None:
+                continue
+
+            # log anything left on stderr
+            if proc.stderr.fileno() in self.__stderr_procs:
+                self.read_stderr(proc)
+
+            self.__procs.remove(proc)
+            self.title_list_finished(proc.paging_list_scheduled)
+
+            if proc.returncode != 0:
+                self.__logger.info("[%d] Error: Non-zero return code on SQUIRE_CMD" % (proc.pid))
+                continue
+
+            self.title_list_parsed(proc.pid, proc.paging_list_basename, proc.paging_list_timestamp, proc.paging_list_fullpath_file,
+                                   proc.paging_list_fullpath_archive, proc.paging_list_fullpath_csv, proc.paging_list_fullpath_xml)
+
+
+def init_item_list_worker():
+    """Item list workers are forked from the daemon, drop its signal handling."""
+
+    signal.set_wakeup_fd(-1)
+    signal.signal(SIGTERM, signal.SIG_DFL)
+    signal.signal(SIGINT, signal.SIG_IGN)
+    signal.signal(SIGCHLD, signal.SIG_DFL)
+
+
+def run_worker_task(task_id, func, args):
+    """Reports the task to WorkerTasks, then runs it, in a pool worker."""
+
+    os.write(worker_task_fd, "%d %d\n" % (task_id, os.getpid()))
+
+    return func(*args)
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno != errno.ESRCH
+
+    return True
+
+
+def load_squire():
+    """Imports SQUIRE_CMD as the squire module, for title list workers to inherit."""
+
+    global squire
+
+    if not squire:
+        squire_dir = os.path.dirname(os.path.abspath(SQUIRE_CMD))
+        if squire_dir not in sys.path:
+            sys.path.append(squire_dir)
+
+        squire = imp.load_source("squire", SQUIRE_CMD)
+
+    return squire
+
+
+def init_title_list_worker():
+    """Warms a title list worker: location matcher, cache, statistics and WebPAC scraper.
+
+    Problems are left for the first list to report.  squire.close() runs as
+    the worker exits, flushing statistics and the cache.
+    """
+
+    init_item_list_worker()
+
+    try:
+        squire.LocationBorg()
+        squire.open_cache()
+        squire.open_statistics()
+        squire.scraper = squire.WebPACScraper(squire.CATALOG_HOSTNAME, squire.CATALOG_PORT, squire.WEBPAC_CONCURRENCY, squire.WEBPAC_RETRIES, squire.cache)
+
+    except (SystemExit, Exception):
+        pass
+
+    Finalize(None, squire.close, exitpriority=10)
+
+
+def build_title_list(fullpath_archive, fullpath_csv, fullpath_xml, rate=None):
+    """Processes an archived Title Paging List with squire, runs in a title list worker.
+
+    rate is the list's share of WEBPAC_REQUEST_BUDGET as it starts, it's
+    updated from title_list_rate as other lists start and finish.  Returns
+    (pid, success, stderr lines), the daemon does the logging.
+    """
+
+    set_title_list_rate(rate)
+
+    stopped = threading.Event()
+    follower = threading.Thread(target=follow_title_list_rate, args=(rate, stopped))
+    follower.setDaemon(True)
+    follower.start()
+
+    stderr = sys.stderr
+    sys.stderr = StringIO()
+
+    ok = False
+    try:
+        try:
+            squire.process_title_list(fullpath_archive, fullpath_csv, fullpath_xml)
+
+            # SQUIRE_CMD would have flushed as it exited
+            squire.flush_statistics()
+            ok = True
+
+        except SystemExit:
+            pass
+
+        except Exception, e:
+            sys.stderr.write("Error: %s\n" % (e))
+
+        messages = [line.rstrip() for line in sys.stderr.getvalue().split("\n") if line.rstrip()]
+
+    finally:
+        sys.stderr = stderr
+        stopped.set()
+        follower.join()
+
+    return (os.getpid(), ok, messages)
+
+
+def set_title_list_rate(rate):
+    """Limits squire's WebPAC requests to rate per second, in a title list worker."""
+
+    squire.WEBPAC_RATE = rate
+    if squire.scraper:
+        squire.scraper.set_rate(rate)
+
+
+def follow_title_list_rate(rate, stopped):
+    """Keeps squire at the daemon's title_list_rate until stopped is set, in a title list worker."""
+
+    while not stopped.isSet():
+        current = title_list_rate.value or None
+        if current != rate:
+            rate = current
+            set_title_list_rate(rate)
+
+        stopped.wait(TITLE_LIST_RATE_CHECK_INTERVAL)
+
+
+def build_item_list(branch_name, fullpath_archive, fullpath_csv, fullpath_xml):
+    """Parses an archived Item Paging List and writes its CSV and XML, runs in an item list worker.
+
+    Returns (xml_data, item count, error messages), the daemon does the logging.
+    """
+
+    records = []
+    errors = []
+    csv_file = None
+
+    try:
+        # load items from Item Paging List
+        f = os.open(fullpath_archive, os.O_RDONLY)
+        map = mmap.mmap(f, 0, prot=mmap.PROT_READ)
+
+        for item in iter_items(map):
+            record = {}
+            record["author"]          = item["author"]
+            record["title"]           = item["title"]
+            record["call_number"]     = item["call_number"]
+            barcode                   = item["barcode"]
+            record["location"]        = item["location"]
+
+            # format barcode
+            if len(barcode) > 13: 
+                record["barcode"] = "%s %s %s %s" % (barcode[0], barcode[1:5], barcode[5:10], barcode[10:])
+            else:
+                record["barcode"] = barcode
+            records.append(record)
+
+        map.close()
+        os.close(f)
+
+    except Exception, e:
+        errors.append("Error: %s [%s]" % (e, fullpath_archive))
+
+    records.sort(key=operator.itemgetter("call_number"))
+
+    # dump to csv
+    fields = ["location", "call_number", "author", "title", "barcode"]
+
+    headers = {"location" : "Location", "call_number" : "Call #", "author" : "Author", "title" : "Title", "barcode" : "Barcode"}
+
+    # output csv
+    try:
+        csv_file = open(fullpath_csv, "wb")
+        csv_file.write(codecs.BOM_UTF8)
+        
+        writer = csv.DictWriter(csv_file, fieldnames=fields, delimiter=',', dialect=csv.excel, quoting=csv.QUOTE_ALL)
+        writer.writerow(headers)
+
+        # rows are sorted by "call_number"
+        for row in records:
+            writer.writerow(row)
+
+    except Exception, e:
+        errors.append("Error writing item csv : %s [%s]" % (sys.exc_info(), fullpath_csv))
+
+    finally:
+        if csv_file:
+           csv_file.close()
+
+    # dump to xml
+    attrs = {"location"  : branch_name,
+             "timestamp" : str(datetime.now()),
+             "count"     : str(len(records))}
+
+    xml_file = None
+    xml_data = None
+
+    try:
+        # keep a copy in memory for rendering
+        xml_buffer = StringIO()
+
+        writer = PagingListXMLWriter(xml_buffer, attrs)
+        for record in records:
+            writer.write_record(record)
+        writer.close()
+
+        xml_data = xml_buffer.getvalue()
+
+        xml_file = open(fullpath_xml, "w")
+        xml_file.write(xml_data)
+
+    except Exception, e:
+        errors.append("Error writing item xml : %s [%s]" % (sys.exc_info(), fullpath_xml))
+
+    finally:
+        if xml_file:
+            xml_file.close()
+
+    return (xml_data, len(records), errors)
+
+
+def list_file_type(filename):
+    """Returns (ListTypes type, extension, days old) for title and item list filenames
+    dated today or in the last DROPBOX_CATCHUP_DAYS, None for anything else."""
+
+    today = datetime.now()
+
+    # without timestamps an earlier day's list would overwrite and pair with today's
+    catchup_days = TIMESTAMP_ACTIVE and DROPBOX_CATCHUP_DAYS or 0
+
+    for days in xrange(catchup_days + 1):
+        ext_timestamp = (today - timedelta(days=days)).strftime("%y%m%d")
+
+        for list_type, list_ext in ((ListTypes.TITLE_PAGING_LIST, PAGING_LIST_EXT), (ListTypes.ITEM_PAGING_LIST, ITEM_LIST_EXT)):
+            extension = "%s.t%s.auton" % (list_ext, ext_timestamp)
+            if filename.endswith(extension):
+                return (list_type, extension, days)
+
+    return None
+
+
+def read_list_count(xml_filename):
+    """Returns the count attribute of a paging list XML file, or None."""
+
+    try:
+        f = open(xml_filename)
+        try:
+            match = re.search(r'<paging_list[^>]* count="(\d+)"', f.read(4096))
+        finally:
+            f.close()
+    except IOError:
+        return None
+
+    if not match:
+        return None
+
+    return int(match.group(1))
+
+
+def replace_symlink(target, link):
+    """Points link at target, without a moment where link is missing."""
+
+    tmp_link = "%s.%d.tmp" % (link, thread.get_ident())
+
+    try:
+        os.remove(tmp_link)
+    except OSError:
+        pass
+
+    os.symlink(target, tmp_link)
+    os.rename(tmp_link, link)
+
+
+def set_cloexec(fd):
+    """Keeps fd out of SQUIRE_CMD subprocesses."""
+
+    fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
  
 if __name__ == "__main__":
 
@@ -746,7 +1750,7 @@ if __name__ == "__main__":
     daemon_gid = getgrnam(DAEMON_GROUP).gr_gid
 
     # create required directories if they don't exist
-    for dir in DIR_VAR, DIR_RUN, DIR_LOG, DIR_OUTPUT, DIR_ARCHIVE, DAEMON_WORKING_DIR:
+    for dir in DIR_VAR, DIR_RUN, DIR_LOG, DIR_OUTPUT, DIR_ARCHIVE, DIR_SPOOL, DIR_INDEX, DIR_STORE, DAEMON_WORKING_DIR:
         try:
             os.makedirs(dir)
         except OSError:
@@ -771,7 +1775,8 @@ if __name__ == "__main__":
 
 
     context.signal_map = {SIGTERM : sd.stop,
-                          SIGINT  : sd.stop}
+                          SIGINT  : sd.stop,
+                          SIGUSR1 : sd.request_status}
 
     try:
         with context:
@@ -1,6 +1,10 @@
 #include <Python.h>
 #include <stdio.h>
 #include <sys/types.h>
+#include <structseq.h>
+#include <errno.h>
+#include <unistd.h>
+#include <sys/select.h>
 #include <sys/inotify.h>
 #include <error.h>
 
@@ -10,21 +14,55 @@
  *
  * Provides lightweight inotify API interface for squired.py
  *
+ * squired.Inotify instances watch any number of paths, the module level
+ * functions work on a single global instance.
+ *
  */
 
-#define MAX_EVENTS         1024
 #define INOTIFY_EVENT_SIZE (sizeof(struct inotify_event))
-#define INOTIFY_BUF_LEN    (MAX_EVENTS * (INOTIFY_EVENT_SIZE + 16))
+#define INOTIFY_BUF_LEN    (64 * 1024)
 
 int inotify_fd = -1;
 
-/* inotify_init */
+/* read() buffer, reused by every call (the GIL is held while it's in use) */
+static char event_buf[INOTIFY_BUF_LEN] __attribute__ ((aligned(__alignof__(struct inotify_event))));
+
+/* squired.event, a (wd, mask, cookie, name, path) struct sequence */
+static PyTypeObject EventType;
+
+static PyStructSequence_Field event_fields[] = {
+    { "wd",     "watch descriptor"                   },
+    { "mask",   "IN_* event mask"                    },
+    { "cookie", "pairs IN_MOVED_FROM and IN_MOVED_TO" },
+    { "name",   "file name, '' for the watch itself" },
+    { "path",   "watched path, None if unknown"      },
+    { NULL }
+};
+
+static PyStructSequence_Desc event_desc = {
+    "squired.event",
+    "inotify event",
+    event_fields,
+    5
+};
+
+/* squired.Inotify, an inotify instance and its watches */
+typedef struct {
+    PyObject_HEAD
+    int fd;
+    PyObject *watches; /* {wd : path} */
+} Inotify;
+
+/* inotify_init, close-on-exec and non-blocking */
 static PyObject *
 squired_inotify_init(PyObject *self, PyObject *args)
 {
-    inotify_fd = inotify_init();
+    inotify_fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC);
+
+    if (inotify_fd == -1)
+        return PyErr_SetFromErrno(PyExc_OSError);
 
-    return Py_None;
+    Py_RETURN_NONE;
 }
 
 /* inotify add_watch */
@@ -36,7 +74,7 @@ squired_add_watch(PyObject *self, PyObject *args)
     int opts = 0;
 
     if (!PyArg_ParseTuple(args, "si", &path, &opts))
-        return Py_None;
+        return NULL;
 
     return Py_BuildValue("i", inotify_add_watch(inotify_fd, path, opts));
 }
@@ -48,121 +86,158 @@ squired_rm_watch(PyObject *self, PyObject *args)
     int wd = 0;
 
     if (!PyArg_ParseTuple(args, "i", &wd))
-        return Py_None;
+        return NULL;
     
     return Py_BuildValue("i", inotify_rm_watch(inotify_fd, wd));
 }
 
-/* inotify select */
+/* inotify fd, for registering with select/poll/epoll */
 static PyObject *
-squired_select(PyObject *self, PyObject *args)
+squired_fileno(PyObject *self, PyObject *args)
 {
-     struct timeval time = {0};
+    return Py_BuildValue("i", inotify_fd);
+}
 
-     int num_events = 0;
-     int count      = 0;
-     int len        = 0;
-     int rtv        = 0;
-     int i          = 0;
+/* appends the events in event_buf[0:len] to events, in one pass, paths from watches (may be NULL) */
+static int
+append_events(PyObject *events, int len, PyObject *watches)
+{
+    struct inotify_event *event = (struct inotify_event *)NULL;
 
-     char buf[INOTIFY_BUF_LEN];
+    PyObject *new_event = (PyObject *)NULL;
+    PyObject *name      = (PyObject *)NULL;
+    PyObject *path      = (PyObject *)NULL;
+    PyObject *wd        = (PyObject *)NULL;
 
-     struct inotify_event* event = (struct inotify_event *)NULL;
+    int i = 0;
 
-     PyObject *events    = (PyObject *)NULL;
-     PyObject *new_event = (PyObject *)NULL;
+    while (i + (int) INOTIFY_EVENT_SIZE <= len) {
+        event = (struct inotify_event *) &event_buf[i];
 
-     fd_set rfds;
+        /* name is NUL padded to len */
+        if (event->len)
+            name = PyString_FromString(event->name);
+        else
+            name = PyString_FromStringAndSize(NULL, 0);
 
-     /* set timeout */
-     time.tv_sec = 1;
+        new_event = PyStructSequence_New(&EventType);
 
-     /* clear set */
-     FD_ZERO(&rfds);
- 
-     /* add inotify_fd to to set */
-     FD_SET(inotify_fd, &rfds);
+        if (!name || !new_event) {
+            Py_XDECREF(name);
+            Py_XDECREF(new_event);
+            return -1;
+        }
 
-     /* poll for events */
-     rtv = select(inotify_fd + 1, &rfds, NULL, NULL, &time);
+        wd = PyInt_FromLong(event->wd);
+
+        path = (wd && watches) ? PyDict_GetItem(watches, wd) : NULL;
+        if (!path)
+            path = Py_None;
+        Py_INCREF(path);
+
+        PyStructSequence_SET_ITEM(new_event, 0, wd);
+        PyStructSequence_SET_ITEM(new_event, 1, PyInt_FromLong((long) event->mask));
+        PyStructSequence_SET_ITEM(new_event, 2, PyInt_FromLong((long) event->cookie));
+        PyStructSequence_SET_ITEM(new_event, 3, name);
+        PyStructSequence_SET_ITEM(new_event, 4, path);
+
+        if (PyErr_Occurred() || PyList_Append(events, new_event) == -1) {
+            Py_DECREF(new_event);
+            return -1;
+        }
+
+        /* the watch is gone (rm_watch, or its path was deleted) */
+        if (watches && (event->mask & IN_IGNORED) && PyDict_DelItem(watches, wd) == -1)
+            PyErr_Clear();
 
-     if (rtv < 0) {
-         if (errno == EINTR) {
-             /* busy */
-             return Py_BuildValue("{s:s}", "OKAY", "BUSY");
-         } else {
-             /* error */
-             return Py_BuildValue("{s:s}", "ERROR", "FD SELECT ERROR");
-         }
+        Py_DECREF(new_event);
 
-     } else if (0 == rtv) {
-         /* timeout */
-         return Py_BuildValue("{s:s}", "OKAY", "TIMEOUT");
+        i += INOTIFY_EVENT_SIZE + event->len;
+    }
+
+    return 0;
+}
 
-     } else if (FD_ISSET(inotify_fd, &rfds)) {
-        /* events available */
+/* reads every pending event on fd without blocking, returns a list of squired.event */
+static PyObject *
+read_events(int fd, PyObject *watches)
+{
+    PyObject *events = PyList_New(0);
 
-        /* read events into buffer */
-        len = read(inotify_fd, buf, INOTIFY_BUF_LEN);
+    int len = 0;
+
+    if (!events)
+        return NULL;
+
+    while (1) {
+        len = read(fd, event_buf, INOTIFY_BUF_LEN);
 
-        /* read() failed? */
         if (len == -1) {
-            return Py_BuildValue("{s:s}", "ERROR", "read() ERROR");
-        }
+            /* drained */
+            if (errno == EAGAIN || errno == EINTR)
+                break;
 
-        /* less than a complete inotify_event in buffer? */
-        if (len < INOTIFY_EVENT_SIZE) {
-            return Py_BuildValue("{s:s}", "ERROR", "len < INOTIFY_EVENT_SIZE");
-        }
-        
-        /* count number of events */
-        num_events = 0;
-        while (i < len) {
-            num_events++;
-            event = (struct inotify_event*) &buf[i];
-            i += INOTIFY_EVENT_SIZE + event->len;
+            Py_DECREF(events);
+            return PyErr_SetFromErrno(PyExc_OSError);
         }
 
-        if (num_events > MAX_EVENTS) {
-            return Py_BuildValue("{s:s}", "ERROR", "num_events > MAX_EVENTS");
-        }
+        if (len == 0)
+            break;
 
-        /* allocate PyList for events */
-        events = PyList_New(num_events);
-        if (!events) {
-            return Py_BuildValue("{s:s}", "ERROR", "PyList_New() FAILED");
-        }
-        
-        /* load events into PyList */
-        i = count = 0;
-
-        while (i < len) {
-            event = (struct inotify_event *) &buf[i];
-            
-            /* create PyObject dict from inotify_event  */
-            new_event = Py_BuildValue("{s:i,s:i,s:i,s:i,s:s}", "watch_descriptor", event->wd,
-                                                               "mask",             event->mask,
-                                                               "cookie",           event->cookie,
-                                                               "len",              event->len,
-                                                               "name",             event->name);
-
-            /* Py_BuildValue failed? */
-            if (!new_event) {
-                Py_DECREF(events);
-                return Py_BuildValue("{s:s}", "ERROR", "Py_BuildValue() FAILED");
-            }
-
-            /* add event to PyList */
-            PyList_SET_ITEM(events, count, new_event);
-
-            i += INOTIFY_EVENT_SIZE + event->len;
-            count++;
+        if (append_events(events, len, watches) == -1) {
+            Py_DECREF(events);
+            return NULL;
         }
+    }
 
-        if (count > 0) return events;
-     }
+    return events;
+}
 
-     return Py_None;
+/* reads every pending event without blocking, returns a list of squired.event */
+static PyObject *
+squired_read_events(PyObject *self, PyObject *args)
+{
+    return read_events(inotify_fd, NULL);
+}
+
+/* inotify select, optional timeout in seconds (default 1), returns read_events() (empty on timeout) */
+static PyObject *
+squired_select(PyObject *self, PyObject *args)
+{
+     struct timeval time = {0};
+
+     double timeout = 1.0;
+
+     int rtv = 0;
+
+     fd_set rfds;
+
+     if (!PyArg_ParseTuple(args, "|d", &timeout))
+         return NULL;
+
+     /* set timeout */
+     time.tv_sec  = (long) timeout;
+     time.tv_usec = (long) ((timeout - time.tv_sec) * 1000000);
+
+     /* clear set */
+     FD_ZERO(&rfds);
+ 
+     /* add inotify_fd to to set */
+     FD_SET(inotify_fd, &rfds);
+
+     /* poll for events, other threads run meanwhile */
+     Py_BEGIN_ALLOW_THREADS
+     rtv = select(inotify_fd + 1, &rfds, NULL, NULL, &time);
+     Py_END_ALLOW_THREADS
+
+     if (rtv < 0 && errno != EINTR)
+         return PyErr_SetFromErrno(PyExc_OSError);
+
+     if (rtv <= 0)
+         /* timeout or interrupted */
+         return PyList_New(0);
+
+     return squired_read_events(self, NULL);
 }
 
 /* provide access to errno */
@@ -178,23 +253,229 @@ squired_shutdown(PyObject *self, PyObject *args)
 {
     if (inotify_fd != -1) {
         close(inotify_fd);
+        inotify_fd = -1;
     }
 
-    return Py_None;
+    Py_RETURN_NONE;
 }
 
+/* squired.Inotify() */
+static int
+Inotify_init(Inotify *self, PyObject *args, PyObject *kwds)
+{
+    if (!PyArg_ParseTuple(args, ""))
+        return -1;
+
+    self->fd = inotify_init1(IN_NONBLOCK | IN_CLOEXEC);
+
+    if (self->fd == -1) {
+        PyErr_SetFromErrno(PyExc_OSError);
+        return -1;
+    }
+
+    Py_XDECREF(self->watches);
+    self->watches = PyDict_New();
+
+    return self->watches ? 0 : -1;
+}
+
+static PyObject *
+Inotify_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
+{
+    Inotify *self = (Inotify *) type->tp_alloc(type, 0);
+
+    if (self) {
+        self->fd = -1;
+        self->watches = NULL;
+    }
+
+    return (PyObject *) self;
+}
+
+static void
+Inotify_dealloc(Inotify *self)
+{
+    if (self->fd != -1)
+        close(self->fd);
+
+    Py_XDECREF(self->watches);
+    self->ob_type->tp_free((PyObject *) self);
+}
+
+static int
+Inotify_check(Inotify *self)
+{
+    if (self->fd == -1) {
+        PyErr_SetString(PyExc_ValueError, "I/O operation on closed inotify instance");
+        return -1;
+    }
+
+    return 0;
+}
+
+/* add_watch(path, mask), returns the watch descriptor */
+static PyObject *
+Inotify_add_watch(Inotify *self, PyObject *args)
+{
+    PyObject *path = (PyObject *)NULL;
+    PyObject *wd   = (PyObject *)NULL;
+
+    unsigned int mask = 0;
+
+    int rtv = 0;
+
+    if (!PyArg_ParseTuple(args, "SI", &path, &mask) || Inotify_check(self) == -1)
+        return NULL;
+
+    rtv = inotify_add_watch(self->fd, PyString_AS_STRING(path), mask);
+
+    if (rtv == -1)
+        return PyErr_SetFromErrnoWithFilename(PyExc_OSError, PyString_AS_STRING(path));
+
+    wd = PyInt_FromLong(rtv);
+
+    if (!wd || PyDict_SetItem(self->watches, wd, path) == -1) {
+        Py_XDECREF(wd);
+        return NULL;
+    }
+
+    return wd;
+}
+
+/* rm_watch(wd) */
+static PyObject *
+Inotify_rm_watch(Inotify *self, PyObject *args)
+{
+    int wd = 0;
+
+    if (!PyArg_ParseTuple(args, "i", &wd) || Inotify_check(self) == -1)
+        return NULL;
+
+    if (inotify_rm_watch(self->fd, wd) == -1)
+        return PyErr_SetFromErrno(PyExc_OSError);
+
+    /* IN_IGNORED removes it from watches */
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+Inotify_read_events(Inotify *self)
+{
+    if (Inotify_check(self) == -1)
+        return NULL;
+
+    return read_events(self->fd, self->watches);
+}
+
+static PyObject *
+Inotify_fileno(Inotify *self)
+{
+    if (Inotify_check(self) == -1)
+        return NULL;
+
+    return PyInt_FromLong(self->fd);
+}
+
+/* {wd : path}, a copy */
+static PyObject *
+Inotify_watches(Inotify *self)
+{
+    return PyDict_Copy(self->watches);
+}
+
+static PyObject *
+Inotify_close(Inotify *self)
+{
+    if (self->fd != -1) {
+        close(self->fd);
+        self->fd = -1;
+    }
+
+    PyDict_Clear(self->watches);
+
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef Inotify_methods[] = {
+    { "add_watch",   (PyCFunction) Inotify_add_watch,   METH_VARARGS, "add_watch(path, mask), returns the watch descriptor" },
+    { "rm_watch",    (PyCFunction) Inotify_rm_watch,    METH_VARARGS, "rm_watch(wd)"                                       },
+    { "read_events", (PyCFunction) Inotify_read_events, METH_NOARGS,  "read pending events, without blocking"              },
+    { "fileno",      (PyCFunction) Inotify_fileno,      METH_NOARGS,  "inotify fd, for select/poll/epoll"                  },
+    { "watches",     (PyCFunction) Inotify_watches,     METH_NOARGS,  "{wd : path} of current watches"                     },
+    { "close",       (PyCFunction) Inotify_close,       METH_NOARGS,  "close the inotify fd"                               },
+    {NULL,           NULL,                              0,            NULL                                                 }
+};
+
+static PyTypeObject InotifyType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "squired.Inotify",                 /* tp_name */
+    sizeof(Inotify),                   /* tp_basicsize */
+    0,                                 /* tp_itemsize */
+    (destructor) Inotify_dealloc,      /* tp_dealloc */
+    0,                                 /* tp_print */
+    0,                                 /* tp_getattr */
+    0,                                 /* tp_setattr */
+    0,                                 /* tp_compare */
+    0,                                 /* tp_repr */
+    0,                                 /* tp_as_number */
+    0,                                 /* tp_as_sequence */
+    0,                                 /* tp_as_mapping */
+    0,                                 /* tp_hash */
+    0,                                 /* tp_call */
+    0,                                 /* tp_str */
+    0,                                 /* tp_getattro */
+    0,                                 /* tp_setattro */
+    0,                                 /* tp_as_buffer */
+    Py_TPFLAGS_DEFAULT,                /* tp_flags */
+    "inotify instance with any number of watches, non-blocking and close-on-exec", /* tp_doc */
+    0,                                 /* tp_traverse */
+    0,                                 /* tp_clear */
+    0,                                 /* tp_richcompare */
+    0,                                 /* tp_weaklistoffset */
+    0,                                 /* tp_iter */
+    0,                                 /* tp_iternext */
+    Inotify_methods,                   /* tp_methods */
+    0,                                 /* tp_members */
+    0,                                 /* tp_getset */
+    0,                                 /* tp_base */
+    0,                                 /* tp_dict */
+    0,                                 /* tp_descr_get */
+    0,                                 /* tp_descr_set */
+    0,                                 /* tp_dictoffset */
+    (initproc) Inotify_init,           /* tp_init */
+    0,                                 /* tp_alloc */
+    Inotify_new,                       /* tp_new */
+};
+
 /* python-exposed methods */
 static PyMethodDef SquiredMethods[] = {
-    { "add_watch",    squired_add_watch,    METH_VARARGS,   "inotify_add_watch" },
-    { "rm_watch",     squired_rm_watch,     METH_VARARGS,   "inotify_rm_watch"  },
-    { "select",       squired_select,       METH_VARARGS,   "shutdown inotify"  },
-    { "inotify_init", squired_inotify_init, 0,              "inotify_init"      },
-    { "shutdown",     squired_shutdown,     0,              "shutdown inotify"  },
-    { "errno",        squired_errno,        0,              "returns errno"     },
-    {NULL,            NULL,                 0,              NULL                }
+    { "add_watch",    squired_add_watch,    METH_VARARGS,   "inotify_add_watch"            },
+    { "rm_watch",     squired_rm_watch,     METH_VARARGS,   "inotify_rm_watch"             },
+    { "select",       squired_select,       METH_VARARGS,   "wait for and read events"     },
+    { "read_events",  squired_read_events,  METH_NOARGS,    "read pending events"          },
+    { "fileno",       squired_fileno,       METH_NOARGS,    "inotify fd"                   },
+    { "inotify_init", squired_inotify_init, METH_NOARGS,    "inotify_init"                 },
+    { "shutdown",     squired_shutdown,     METH_NOARGS,    "shutdown inotify"             },
+    { "errno",        squired_errno,        METH_NOARGS,    "returns errno"                },
+    {NULL,            NULL,                 0,              NULL                           }
 };
 
 /* initialization */
-void initsquired(void) {
-    (void) Py_InitModule("squired", SquiredMethods);
+PyMODINIT_FUNC
+initsquired(void) {
+    PyObject *m = Py_InitModule("squired", SquiredMethods);
+
+    if (!m)
+        return;
+
+    PyStructSequence_InitType(&EventType, &event_desc);
+
+    Py_INCREF(&EventType);
+    PyModule_AddObject(m, "event", (PyObject *) &EventType);
+
+    if (PyType_Ready(&InotifyType) < 0)
+        return;
+
+    Py_INCREF(&InotifyType);
+    PyModule_AddObject(m, "Inotify", (PyObject *) &InotifyType);
 }